@@ -0,0 +1,207 @@
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Iterator
+
+from requests import RequestException
+
+import log
+import metrics
+from breaker import CircuitBreakers, CircuitOpen
+from yadisk_api import YDApi
+
+logger = log.get_logger(__name__)
+
+# The token is revoked or expired
+AUTH_STATUSES: frozenset[int] = frozenset({401})
+# The disk is full
+QUOTA_STATUSES: frozenset[int] = frozenset({507})
+
+
+class NoAccount(Exception):
+    pass
+
+
+def is_account_error(error: RequestException) -> bool:
+    """:returns: Whether the account failed the request, not the job."""
+    return (
+        getattr(error, 'account', None) is not None
+        and error.response is not None
+        and error.response.status_code in AUTH_STATUSES | QUOTA_STATUSES
+    )
+
+
+class Account:
+    def __init__(self, name: str, token: str):
+        """:param name: Name for logs and metrics (tokens are secret)."""
+        self.name: str = name
+        self.token: str = token
+        self.api: YDApi = YDApi(token)
+
+        self.active: int = 0
+        self.reserved: int = 0
+        self.free: int | None = None
+        self.checked: float = 0.0
+        self.disabled: str | None = None
+
+    def __repr__(self):
+        return f'Account({self.name})'
+
+    @property
+    def available(self) -> float:
+        """:returns: Free space without space reserved by jobs."""
+        if self.free is None:
+            return float('inf')
+
+        return self.free - self.reserved
+
+
+class AccountPool:
+    """Yandex Disk accounts, which files are saved to.
+
+    Jobs take the least loaded account with enough free space. Accounts
+    with revoked tokens are removed, full ones are skipped until their
+    free space is checked again. Tokens can be changed while running
+    (see :meth:`update`)."""
+
+    def __init__(self, tokens: list[str], breakers: CircuitBreakers,
+                 check_interval: float = 300.0):
+        if not tokens:
+            raise ValueError('No Yandex Disk tokens!')
+
+        self.accounts: list[Account] = [
+            Account(f'account-{i}', token) for i, token in enumerate(tokens)
+        ]
+        self.breakers: CircuitBreakers = breakers
+        self.CHECK_INTERVAL: float = float(check_interval)
+        self._lock: Lock = Lock()
+
+        metrics.gauge(
+            'account_active_jobs', 'Jobs using the account.', ('account',),
+            function=lambda: {
+                (account.name,): account.active for account in self.accounts
+            }
+        )
+        metrics.gauge(
+            'account_free_bytes', 'Last known free space of the account.',
+            ('account',),
+            function=lambda: {
+                (account.name,): account.free for account in self.accounts
+                if account.free is not None
+            }
+        )
+        metrics.gauge(
+            'account_enabled', 'Whether the account is used.', ('account',),
+            function=lambda: {
+                (account.name,): int(account.disabled is None)
+                for account in self.accounts
+            }
+        )
+
+    def update(self, tokens: list[str]):
+        """Applies the changed list of tokens.
+
+        Accounts of new tokens are added, ones of removed tokens are not
+        used anymore (jobs using them finish), other accounts are kept."""
+        if not tokens:
+            logger.error('No Yandex Disk tokens, the accounts are kept.')
+            return
+
+        with self._lock:
+            accounts: list[Account] = list(self.accounts)
+            known: set[str] = {account.token for account in accounts}
+            for account in accounts:
+                if account.token not in tokens:
+                    if account.disabled is None:
+                        account.disabled = 'removed'
+                        logger.warning(f'{account} is removed.')
+                elif account.disabled == 'removed':
+                    account.disabled = None
+                    logger.warning(f'{account} is added again.')
+            for token in dict.fromkeys(tokens):
+                if token not in known:
+                    accounts.append(Account(f'account-{len(accounts)}', token))
+                    logger.warning(f'{accounts[-1]} is added.')
+
+            self.accounts = accounts
+
+    @contextmanager
+    def acquire(self, job_id: str, size: int = 0) -> Iterator[Account]:
+        """Takes an account to save ``size`` bytes to.
+
+        Errors of requests made with the account are tagged with its
+        name (``error.account``).
+
+        :raises NoAccount: All accounts are disabled or full.
+        :raises CircuitOpen: All suitable accounts are limited.
+        """
+        self._check_space()
+        account: Account = self._take(job_id, size)
+
+        try:
+            yield account
+        except RequestException as e:
+            e.account = account.name
+            self._fail(account, e)
+            raise
+        finally:
+            with self._lock:
+                account.active -= 1
+                account.reserved -= size
+
+    def _take(self, job_id: str, size: int) -> Account:
+        with self._lock:
+            candidates: list[Account] = sorted(
+                (
+                    account for account in self.accounts
+                    if account.disabled is None and account.available >= size
+                ),
+                key=lambda account: (account.active, -account.available)
+            )
+            if not candidates:
+                raise NoAccount(f'No account has {size} B of free space')
+
+            limited: CircuitOpen | None = None
+            for account in candidates:
+                try:
+                    self.breakers.check(job_id, f'account:{account.name}')
+                except CircuitOpen as e:
+                    if limited is None or e.wait < limited.wait:
+                        limited = e
+                    continue
+
+                account.active += 1
+                account.reserved += size
+                return account
+
+        raise limited
+
+    def _check_space(self):
+        """Updates free space of accounts not checked for a while."""
+        for account in self.accounts:
+            if (account.disabled is not None
+                    or time.monotonic() - account.checked < self.CHECK_INTERVAL):
+                continue
+
+            account.checked = time.monotonic()
+            try:
+                account.free = account.api.get_free_space()
+            except RequestException as e:
+                logger.error(f'Can\'t check free space of {account}: {e}')
+                self._fail(account, e)
+                continue
+            logger.debug(f'{account} has {account.free} B of free space.')
+
+    def _fail(self, account: Account, error: RequestException):
+        if error.response is None:
+            return
+
+        status: int = error.response.status_code
+        if status in AUTH_STATUSES:
+            account.disabled = f'status {status}'
+            logger.critical(f'{account} is removed: {error}')
+        elif status in QUOTA_STATUSES:
+            # Skipped until the next check
+            account.free = 0
+            account.checked = time.monotonic()
+            logger.error(f'{account} is full: {error}')
@@ -0,0 +1,178 @@
+"""Latency of opening folders in the file menu with and without the shared
+metadata store and prefetching.
+
+Virtual users browse a public folder at once: every user opens the menu,
+then opens ``--depth`` random folders of the first page, reading every
+page for ``--think`` seconds. Yandex Disk stand-in answers in
+``--latency`` seconds. Every mode is run in its own process and directory.
+
+Run from the repository root:
+
+    python -m benchmarks.browsing
+    python -m benchmarks.browsing --users 50 --think 0.5
+"""
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from types import SimpleNamespace
+
+from benchmarks.stand_ins import FakeYandexDisk
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINK: str = 'https://disk.yandex.ru/d/browsing'
+MODES: dict[str: str] = {
+    "direct": 'listings of every user are requested (before)',
+    "store": 'shared store without prefetching',
+    "prefetch": 'shared store, folders on the page are prefetched'
+}
+
+
+def _tree(depth: int, folders: int = 8, files: int = 4) -> dict:
+    if not depth:
+        return {f'file{i}.bin': 1 << 20 for i in range(files)}
+
+    return {f'dir{i}': _tree(depth - 1, folders, files) for i in range(folders)}
+
+
+class _Message:
+    """Message of the menu, which keeps its buttons."""
+
+    def __init__(self):
+        self.buttons: list = []
+
+    async def edit_text(self, text: str, reply_markup=None):
+        self.buttons = [
+            button for row in reply_markup.inline_keyboard for button in row
+        ]
+
+
+def child(mode: str, users: int, depth: int, think: float, seed: int):
+    import asyncio
+
+    from aiogram import Bot, Dispatcher
+
+    from bot import FileMenu
+    from volumes import VolumePlanner
+    from yadisk_api import MetadataStore, YDResource
+
+    metadata: MetadataStore | None = None
+    if mode != 'direct':
+        metadata = MetadataStore(prefetch_rate=10 if mode == 'prefetch' else 0)
+    dp: Dispatcher = Dispatcher(Bot('123456:benchmark'))
+    volumes: VolumePlanner = VolumePlanner()
+    latencies: list[float] = []
+
+    async def browse(user_id: int):
+        choice: random.Random = random.Random(seed + user_id)
+        await asyncio.sleep(choice.random() * think)
+
+        message: _Message = _Message()
+        menu: FileMenu = FileMenu(
+            dp, user_id, YDResource(LINK, metadata), volumes, 5
+        )
+        await menu.update_message(message)
+
+        for _ in range(depth):
+            await asyncio.sleep(think)
+            folders: list[str] = [
+                button.callback_data for button in message.buttons
+                if button.callback_data.startswith('fm:gt:')
+            ]
+            start: float = time.perf_counter()
+            await menu.goto(
+                SimpleNamespace(data=choice.choice(folders), message=message)
+            )
+            latencies.append(time.perf_counter() - start)
+
+        menu.stop_prefetching()
+
+    async def run():
+        await asyncio.gather(*(browse(user_id) for user_id in range(users)))
+
+    start: float = time.perf_counter()
+    asyncio.get_event_loop().run_until_complete(run())
+    wall: float = time.perf_counter() - start
+
+    latencies.sort()
+    print(json.dumps({
+        "p50_ms": latencies[len(latencies) // 2] * 1e3,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1e3,
+        "wall_s": wall
+    }), flush=True)
+
+
+def run(mode: str, args) -> dict:
+    yandex: FakeYandexDisk = FakeYandexDisk(
+        {LINK: _tree(args.depth)}, latency=args.latency
+    ).start()
+    sandbox: str = tempfile.mkdtemp(prefix='yadisk-browsing-')
+    for folder in ('logs', 'data'):
+        os.makedirs(os.path.join(sandbox, folder))
+
+    try:
+        process = subprocess.run(
+            [
+                sys.executable, '-m', 'benchmarks.browsing',
+                '--child', mode, '--users', str(args.users),
+                '--depth', str(args.depth), '--think', str(args.think),
+                '--seed', str(args.seed)
+            ],
+            cwd=sandbox, capture_output=True, text=True,
+            env=dict(
+                os.environ,
+                PYTHONPATH=os.pathsep.join(
+                    filter(None, (ROOT, os.environ.get('PYTHONPATH')))
+                ),
+                YADISK_API_URL=yandex.api_url
+            )
+        )
+        if process.returncode:
+            raise RuntimeError(f'Mode {mode} failed:\n{process.stderr[-3000:]}')
+    finally:
+        yandex.stop()
+        shutil.rmtree(sandbox, ignore_errors=True)
+
+    result: dict = json.loads(process.stdout.splitlines()[-1])
+    result["requests"] = yandex.calls["GET public/resources"]
+
+    return result
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=3,
+                        help='Folders opened by a user.')
+    parser.add_argument('--think', type=float, default=1.0,
+                        help='Time users read a page, seconds.')
+    parser.add_argument('--latency', type=float, default=0.1,
+                        help='Latency of Yandex Disk, seconds.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--child', choices=MODES, help='Internal: run the mode here.')
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.child, args.users, args.depth, args.think, args.seed)
+
+    print(
+        f'{args.users} users open {args.depth} folders each, reading pages '
+        f'for {args.think:.1f} s, API latency {args.latency * 1e3:.0f} ms'
+    )
+    for mode, description in MODES.items():
+        result: dict = run(mode, args)
+        print(
+            f'{mode:>9}: goto p50 {result["p50_ms"]:6.0f} ms, '
+            f'p95 {result["p95_ms"]:6.0f} ms, {result["requests"]} listing '
+            f'requests, {result["wall_s"]:.1f} s ({description})',
+            flush=True
+        )
+
+
+if __name__ == '__main__':
+    main()
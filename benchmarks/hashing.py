@@ -0,0 +1,81 @@
+"""Overhead of verifying downloads: hashing chunks while they are written
+compared to hashing the written file in a second pass.
+
+Chunks of ``--chunk`` bytes are written to a temporary file, like
+downloads of workers, without hashing, with the hash updated inline and
+with the file read again after it is written.
+
+Run from the repository root:
+
+    python -m benchmarks.hashing
+    python -m benchmarks.hashing --size 2048 --algorithm md5
+"""
+import os
+import tempfile
+import time
+from argparse import ArgumentParser
+from hashlib import md5, sha256
+
+ALGORITHMS: dict = {"sha256": sha256, "md5": md5}
+
+
+def write(path: str, size: int, chunk: bytes, digest=None) -> float:
+    """:returns: Seconds taken."""
+    start: float = time.perf_counter()
+    with open(path, 'wb') as file:
+        for _ in range(size // len(chunk)):
+            file.write(chunk)
+            if digest is not None:
+                digest.update(chunk)
+        file.flush()
+        os.fsync(file.fileno())
+
+    return time.perf_counter() - start
+
+
+def read(path: str, chunk_size: int, digest) -> float:
+    """:returns: Seconds taken."""
+    start: float = time.perf_counter()
+    with open(path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+
+    return time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=1024, help='File size, MB.')
+    parser.add_argument('--chunk', type=int, default=1 << 20,
+                        help='Chunk size, bytes.')
+    parser.add_argument('--algorithm', choices=ALGORITHMS, default='sha256')
+    args = parser.parse_args()
+
+    size: int = args.size << 20
+    chunk: bytes = os.urandom(args.chunk)
+    algorithm = ALGORITHMS[args.algorithm]
+    folder: str = tempfile.mkdtemp(prefix='yadisk-hashing-')
+    path: str = os.path.join(folder, 'file.bin')
+
+    try:
+        plain: float = write(path, size, chunk)
+        inline: float = write(path, size, chunk, algorithm())
+        second: float = write(path, size, chunk) + read(
+            path, args.chunk, algorithm()
+        )
+    finally:
+        os.remove(path)
+        os.rmdir(folder)
+
+    print(f'{args.size} MB in chunks of {args.chunk >> 10} KB, {args.algorithm}:')
+    for name, seconds in (
+        ('not verified', plain), ('inline', inline), ('second pass', second)
+    ):
+        print(
+            f'{name:>12}: {seconds:6.2f} s, {args.size / 1024 / seconds:5.2f} '
+            f'GB/s, overhead {seconds / plain - 1:+.0%}'
+        )
+
+
+if __name__ == '__main__':
+    main()
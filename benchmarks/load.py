@@ -0,0 +1,551 @@
+"""Load and soak test: thousands of virtual users talk to the bot.
+
+Virtual users send updates to the Bot API stand-in (``/start``, ``/fetch``,
+page navigation in the file menu and downloads), which the bot gets by
+polling like from Telegram. A user waits for the reply to an update (or
+``--timeout`` seconds), reads it for ``--think`` seconds on average and
+picks the next action by the weights of ``--mix``. The bot and workers are
+run in a child process against the stand-ins.
+
+Every ``--interval`` seconds, latency percentiles of updates (from sending
+an update to the reply), timeouts, errors of handlers, updates not polled
+yet and the memory of the bot are printed; a summary by action follows.
+
+Run from the repository root:
+
+    python -m benchmarks.load --users 1000 --duration 300
+    python -m benchmarks.load --users 3000 --duration 14400 --interval 600
+    python -m benchmarks.load --mix start=1,fetch=1,navigate=2,download=4
+"""
+import heapq
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections import defaultdict
+from itertools import count
+from queue import Empty, SimpleQueue
+from threading import Thread
+
+from benchmarks.stand_ins import FakeBotAPI, FakeYandexDisk
+from benchmarks.suite import ROOT, RESULT_MARK, _percentile, load_config
+
+LINK: str = 'https://disk.yandex.ru/d/load'
+MIX: str = 'start=1,fetch=2,navigate=12,download=1'
+# Buttons of the file menu users navigate with
+NAVIGATION: tuple[str, ...] = ('fm:gt:', 'fm:up', 'fm:next', 'fm:prev')
+
+
+def _tree(folders: int = 6, files: int = 12) -> dict:
+    return {
+        f'folder{i}': {
+            **{f'file{j:0>2}.bin': 64 << 10 for j in range(files)},
+            "nested": {f'file{j:0>2}.bin': 64 << 10 for j in range(files)}
+        }
+        for i in range(folders)
+    }
+
+
+def _rss() -> int:
+    """:returns: Resident memory of the process, bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def child(workers: int):
+    """Runs the bot and workers in the current working directory until
+    SIGTERM, samples are printed every second."""
+    from threading import Event
+
+    from aiogram import types
+    from aiogram.dispatcher.middlewares import BaseMiddleware
+
+    import bot
+    from jobs import JobQueue
+    from volumes import VolumePlanner
+    from workers import Workers
+
+    config: dict = load_config({"workers": workers, "job_delay": 0})
+    requests: JobQueue = JobQueue()
+    volumes: VolumePlanner = VolumePlanner(
+        config.pop("local_server", True),
+        config.pop("max_upload_time", 240),
+        config.pop("volume_size", None)
+    )
+    yd_bot: bot.YDBot = bot.YDBot('123456:benchmark', requests, volumes)
+
+    processing: list[float] = []
+    # Exceptions of handlers by their types
+    errors: dict[str: int] = defaultdict(int)
+    processed: list[int] = [0]
+
+    class Timing(BaseMiddleware):
+        async def on_pre_process_update(self, update: types.Update,
+                                        data: dict):
+            data["started"] = time.perf_counter()
+
+        async def on_post_process_update(self, update: types.Update,
+                                         results: list, data: dict):
+            processing.append(time.perf_counter() - data["started"])
+            processed[0] += 1
+
+    @yd_bot.dp.errors_handler()
+    async def count_errors(update: types.Update, exception: Exception):
+        errors[type(exception).__name__] += 1
+        return True
+
+    yd_bot.dp.middleware.setup(Timing())
+
+    workers_: Workers | None = None
+    if workers:
+        workers_ = Workers(
+            download_requests=requests, token='bench', volumes=volumes,
+            bot=yd_bot, **config
+        )
+        workers_.start()
+
+    stopped: Event = Event()
+
+    def sample():
+        while not stopped.wait(1):
+            window: list[float] = processing[:]
+            del processing[:len(window)]
+            print(RESULT_MARK + json.dumps({
+                "rss": _rss(),
+                "processed": processed[0],
+                "errors": errors,
+                "processing": [round(seconds, 5) for seconds in window],
+                "menus": len(yd_bot.dp.callback_query_handlers.handlers),
+                "queue": requests.qsize(),
+                # Users' states, which are saved on shutdown
+                "stored": len(yd_bot.dp.storage.data)
+            }), flush=True)
+
+    Thread(target=sample, daemon=True).start()
+    signal.signal(
+        signal.SIGTERM,
+        lambda *_: bot.loop.call_soon_threadsafe(yd_bot.dp.stop_polling)
+    )
+    try:
+        bot.loop.run_until_complete(yd_bot.dp.start_polling())
+    finally:
+        stopped.set()
+        if workers_ is not None:
+            workers_.stop()
+
+
+class _User:
+    def __init__(self, user_id: int, link: str):
+        self.id: int = user_id
+        self.link: str = link
+        # Message of the file menu and callback data of its buttons
+        self.menu: tuple[int, list[str]] | None = None
+        # Action, its sequence number and when the update was sent
+        self.pending: tuple[str, int, float] | None = None
+
+
+class LoadGenerator:
+    """Virtual users, which act on replies of the bot.
+
+    Replies come in threads of the Bot API stand-in, they are handled in
+    :meth:`run` with scheduled actions one by one."""
+
+    def __init__(self, bot_api: FakeBotAPI, users: int, links: list[str],
+                 mix: dict[str: float], think: float, timeout: float,
+                 ramp: float, seed: int = 0):
+        self.bot_api: FakeBotAPI = bot_api
+        self.MIX: dict[str: float] = mix
+        self.THINK: float = think
+        self.TIMEOUT: float = timeout
+        self.random: random.Random = random.Random(seed)
+
+        self.users: dict[int: _User] = {
+            user_id: _User(user_id, self.random.choice(links))
+            for user_id in range(1, users + 1)
+        }
+        self.replies: SimpleQueue = SimpleQueue()
+        # (time, sequence number, user ID, action or "timeout")
+        self._schedule: list[tuple[float, int, int, str]] = []
+        self._sequence = count()
+        self._messages = count(1)
+
+        start: float = time.monotonic()
+        for user_id in self.users:
+            self._at(start + self.random.uniform(0, ramp), user_id, 'act')
+
+        # Latencies by actions, of the current interval and totals
+        self.latencies: dict[str: list[float]] = defaultdict(list)
+        self.window: list[float] = []
+        self.sent: int = 0
+        self.timeouts: dict[str: int] = defaultdict(int)
+
+    def on_call(self, method: str, fields: dict[str: str], result):
+        if method in ('sendMessage', 'editMessageText',
+                      'answerCallbackQuery'):
+            self.replies.put((time.monotonic(), method, fields, result))
+
+    def run(self, until: float, interval: float, report):
+        """Runs users until the monotonic time, ``report`` is called every
+        ``interval`` seconds."""
+        next_report: float = time.monotonic() + interval
+
+        while (now := time.monotonic()) < until:
+            if now >= next_report:
+                report()
+                next_report += interval
+
+            wait: float = min(
+                self._schedule[0][0] - now if self._schedule else 0.1,
+                next_report - now, 0.1
+            )
+            try:
+                self._reply(*self.replies.get(timeout=max(wait, 0)))
+            except Empty:
+                pass
+
+            now = time.monotonic()
+            while self._schedule and self._schedule[0][0] <= now:
+                _, sequence, user_id, action = heapq.heappop(self._schedule)
+                user: _User = self.users[user_id]
+                if action == 'timeout':
+                    if user.pending is not None and user.pending[1] == sequence:
+                        self.timeouts[user.pending[0]] += 1
+                        # The state of the user is unknown
+                        user.pending, user.menu = None, None
+                        self._act(user)
+                else:
+                    self._act(user)
+
+    def _at(self, when: float, user_id: int, action: str, sequence: int = None):
+        if sequence is None:
+            sequence = next(self._sequence)
+        heapq.heappush(self._schedule, (when, sequence, user_id, action))
+
+    def _reply(self, received: float, method: str, fields: dict[str: str],
+               result):
+        if method == 'answerCallbackQuery':
+            user_id: int = int(fields["callback_query_id"].split('-')[0])
+        else:
+            user_id = int(fields["chat_id"])
+        user: _User | None = self.users.get(user_id)
+        if user is None:
+            return
+
+        markup: str = fields.get("reply_markup", '')
+        # Progress of downloads, which is not a reply to users
+        from_workers: bool = 'job:x:' in markup or fields.get(
+            "text", ''
+        ).startswith('Uploading files')
+        if 'fm:' in markup:
+            buttons: list[str] = [
+                button.get("callback_data", '')
+                for row in json.loads(markup)["inline_keyboard"]
+                for button in row
+            ]
+            user.menu = (int(result["message_id"]), buttons)
+        elif fields.get("text") == 'File menu is closed.':
+            user.menu = None
+
+        if user.pending is None:
+            return
+        action, _, sent = user.pending
+        if action == 'fetch' and 'fm:' not in markup and fields.get(
+                "text", ''
+        ).startswith('Please wait'):
+            return
+        if from_workers and action != 'confirm':
+            return
+
+        self.latencies[action].append(received - sent)
+        self.window.append(received - sent)
+        user.pending = None
+        self._at(
+            received + self.random.expovariate(1 / self.THINK), user.id, 'act'
+        )
+
+    def _act(self, user: _User):
+        if user.pending is not None:
+            return
+
+        action: str
+        data: str | None = None
+        if user.menu is None:
+            action = self._choose(('start', 'fetch'))
+        else:
+            buttons: list[str] = user.menu[1]
+            confirm: list[str] = [
+                button for button in buttons if button.startswith('fm:dl:.:')
+            ]
+            if confirm:
+                action, data = 'confirm', confirm[0]
+            else:
+                action = self._choose(('start', 'navigate', 'download'))
+                files: list[str] = [
+                    button for button in buttons
+                    if button.startswith('fm:dl:?:')
+                ]
+                navigation: list[str] = [
+                    button for button in buttons
+                    if button.startswith(NAVIGATION)
+                ]
+                if action == 'download' and not files:
+                    action = 'navigate'
+                if action == 'navigate' and not navigation:
+                    action = 'download' if files else 'start'
+                if action == 'download':
+                    data = self.random.choice(files)
+                elif action == 'navigate':
+                    data = self.random.choice(navigation)
+
+        if action == 'start':
+            # The menu is closed by the bot
+            user.menu = None
+        sequence: int = next(self._sequence)
+        sent: float = time.monotonic()
+        user.pending = (action, sequence, sent)
+        if data is None:
+            self._message(
+                user, '/start' if action == 'start' else f'/fetch {user.link}'
+            )
+        else:
+            self._callback(user, data, sequence)
+        self.sent += 1
+        self._at(sent + self.TIMEOUT, user.id, 'timeout', sequence)
+
+    def _choose(self, actions: tuple[str, ...]) -> str:
+        weights: list[float] = [self.MIX.get(action, 0) for action in actions]
+        if not any(weights):
+            return actions[0]
+
+        return self.random.choices(actions, weights)[0]
+
+    def _message(self, user: _User, text: str):
+        self.bot_api.put_update({
+            "message": {
+                "message_id": next(self._messages),
+                "date": int(time.time()),
+                "chat": {"id": user.id, "type": 'private'},
+                "from": {"id": user.id, "is_bot": False, "first_name": 'User'},
+                "text": text
+            }
+        })
+
+    def _callback(self, user: _User, data: str, sequence: int):
+        self.bot_api.put_update({
+            "callback_query": {
+                "id": f'{user.id}-{sequence}',
+                "from": {"id": user.id, "is_bot": False, "first_name": 'User'},
+                "chat_instance": str(user.id),
+                "data": data,
+                "message": {
+                    "message_id": user.menu[0],
+                    "date": int(time.time()),
+                    "chat": {"id": user.id, "type": 'private'},
+                    "text": 'Menu'
+                }
+            }
+        })
+
+
+def _mix(text: str) -> dict[str: float]:
+    mix: dict[str: float] = {}
+    for part in text.split(','):
+        action, weight = part.split('=')
+        if action not in ('start', 'fetch', 'navigate', 'download'):
+            raise ValueError(f'Unknown action: {action}')
+        mix[action] = float(weight)
+
+    return mix
+
+
+def _growth(samples: list[tuple[float, int]]) -> float:
+    """:returns: Slope of memory by least squares, bytes per hour."""
+    if len(samples) < 2:
+        return 0.0
+
+    times, values = zip(*samples)
+    mean_time: float = sum(times) / len(times)
+    mean_value: float = sum(values) / len(values)
+    variance: float = sum((t - mean_time) ** 2 for t in times)
+    if not variance:
+        return 0.0
+
+    return sum(
+        (t - mean_time) * (v - mean_value) for t, v in samples
+    ) / variance * 3600
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=300.0,
+                        help='Seconds, hours for soak tests.')
+    parser.add_argument('--ramp', type=float, default=30.0,
+                        help='Users start in this many seconds.')
+    parser.add_argument('--think', type=float, default=5.0,
+                        help='Mean time between a reply and the next '
+                             'action of a user, seconds.')
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help='An update without a reply is an error then.')
+    parser.add_argument('--mix', type=_mix, default=_mix(MIX),
+                        help=f'Weights of actions (default: {MIX}).')
+    parser.add_argument('--links', type=int, default=20,
+                        help='Public links users open.')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Latency of Yandex Disk, seconds.')
+    parser.add_argument('--interval', type=float, default=30.0,
+                        help='Seconds between reports.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--child', action='store_true',
+                        help='Internal: run the bot here.')
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.workers)
+
+    links: list[str] = [f'{LINK}{i}' for i in range(args.links)]
+    yandex: FakeYandexDisk = FakeYandexDisk(
+        {link: _tree() for link in links}, latency=args.latency
+    ).start()
+    bot_api: FakeBotAPI = FakeBotAPI().start()
+    generator: LoadGenerator = LoadGenerator(
+        bot_api, args.users, links, args.mix, args.think, args.timeout,
+        args.ramp, args.seed
+    )
+    bot_api.on_call = generator.on_call
+
+    sandbox: str = tempfile.mkdtemp(prefix='yadisk-load-')
+    for folder in ('config', 'logs', 'data', 'temp'):
+        os.makedirs(os.path.join(sandbox, folder))
+    with open(os.path.join(sandbox, 'config', 'tokens.json'), 'w') as f:
+        json.dump({"tg_token": '123456:benchmark', "ya_token": 'bench'}, f)
+
+    samples: list[dict] = []
+    memory: list[tuple[float, int]] = []
+    # Time handlers took, of the current interval and totals
+    processing: list[float] = []
+    handlers: list[float] = []
+    start: float = time.monotonic()
+    process = subprocess.Popen(
+        [
+            sys.executable, '-m', 'benchmarks.load', '--child',
+            '--workers', str(args.workers)
+        ],
+        cwd=sandbox, stdout=subprocess.PIPE,
+        stderr=open(os.path.join(sandbox, 'stderr.log'), 'w'), text=True,
+        env=dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(
+                filter(None, (ROOT, os.environ.get('PYTHONPATH')))
+            ),
+            YADISK_API_URL=yandex.api_url,
+            BOT_API_URL=bot_api.url
+        )
+    )
+
+    def read_samples():
+        for line in process.stdout:
+            if line.startswith(RESULT_MARK):
+                sample: dict = json.loads(line.removeprefix(RESULT_MARK))
+                sample["time"] = time.monotonic() - start
+                processing.extend(sample.pop("processing"))
+                samples.append(sample)
+                if sample["time"] > args.ramp:
+                    memory.append((sample["time"], sample["rss"]))
+
+    Thread(target=read_samples, daemon=True).start()
+
+    def report():
+        window: list[float] = sorted(generator.window)
+        generator.window.clear()
+        took: list[float] = sorted(processing)
+        del processing[:len(took)]
+        handlers.extend(took)
+        last: dict = samples[-1] if samples else {}
+        print(
+            f'{time.monotonic() - start:6.0f} s: {generator.sent} updates, '
+            f'latency p50 {_percentile(window, 50) * 1e3:.0f} ms, '
+            f'p95 {_percentile(window, 95) * 1e3:.0f} ms, '
+            f'p99 {_percentile(window, 99) * 1e3:.0f} ms, '
+            f'timeouts {sum(generator.timeouts.values())}, '
+            f'errors {sum(last.get("errors", {}).values())}, '
+            f'not polled {len(bot_api.updates)}, '
+            f'handlers p95 {_percentile(took, 95) * 1e3:.0f} ms, '
+            f'RSS {last.get("rss", 0) / (1 << 20):.0f} MB, '
+            f'open menus {last.get("menus", 0)}, '
+            f'stored users {last.get("stored", 0)}, '
+            f'queue {last.get("queue", 0)}',
+            flush=True
+        )
+
+    print(
+        f'{args.users} users for {args.duration:.0f} s, think '
+        f'{args.think:.1f} s, mix '
+        + ','.join(f'{action}={weight:g}' for action, weight in args.mix.items())
+        + f', {args.workers} workers'
+    )
+    try:
+        generator.run(start + args.duration, args.interval, report)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        yandex.stop()
+        bot_api.stop()
+        if process.returncode:
+            with open(os.path.join(sandbox, 'stderr.log')) as f:
+                print(f'The bot failed:\n{f.read()[-3000:]}', file=sys.stderr)
+        shutil.rmtree(sandbox, ignore_errors=True)
+
+    handlers.sort()
+    errors: dict[str: int] = samples[-1]["errors"] if samples else {}
+    timeouts: int = sum(generator.timeouts.values())
+    print('Latency of replies by actions:')
+    for action, latencies in sorted(generator.latencies.items()):
+        latencies.sort()
+        print(
+            f'{action:>9}: {len(latencies):7} replies, '
+            f'p50 {_percentile(latencies, 50) * 1e3:6.0f} ms, '
+            f'p95 {_percentile(latencies, 95) * 1e3:6.0f} ms, '
+            f'p99 {_percentile(latencies, 99) * 1e3:6.0f} ms, '
+            f'timeouts {generator.timeouts.get(action, 0)}'
+        )
+    print(
+        f'  handlers: {len(handlers):7} updates, '
+        f'p50 {_percentile(handlers, 50) * 1e3:6.0f} ms, '
+        f'p95 {_percentile(handlers, 95) * 1e3:6.0f} ms, '
+        f'p99 {_percentile(handlers, 99) * 1e3:6.0f} ms'
+    )
+    if memory:
+        print(
+            f'Memory: {memory[0][1] / (1 << 20):.0f} MB after the ramp, '
+            f'{memory[-1][1] / (1 << 20):.0f} MB at the end, peak '
+            f'{max(rss for _, rss in memory) / (1 << 20):.0f} MB, growth '
+            f'{_growth(memory) / (1 << 20):+.1f} MB/h over '
+            f'{memory[-1][0] - memory[0][0]:.0f} s'
+        )
+    print(
+        f'Errors: {sum(errors.values())} in handlers, {timeouts} timeouts of '
+        f'{generator.sent} updates '
+        f'({(sum(errors.values()) + timeouts) / max(generator.sent, 1):.2%})'
+        + ''.join(
+            f'\n  {name}: {number}' for name, number in sorted(errors.items())
+        )
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""Logging overhead per task: files written by the logging threads versus
+the background writer of ``log``.
+
+A task logs ``--calls`` DEBUG records across three modules, like a worker
+does, from ``--threads`` threads at once. ``--write-delay`` makes every
+file write slower (seconds), like a busy disk. The time the threads spend
+in logging calls is reported per task, and the time until all records are
+in the files. Every mode is run in its own process and directory.
+
+Run from the repository root:
+
+    python -m benchmarks.logging_overhead
+    python -m benchmarks.logging_overhead --write-delay 0.001
+"""
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from logging.handlers import TimedRotatingFileHandler
+from threading import Thread
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES: tuple[str, ...] = ('workers', 'yadisk_api', 'cache')
+MODES: dict[str: str] = {
+    "off": 'level INFO, nothing is written',
+    "sync": 'file handlers of every module (before)',
+    "queued": 'background writer',
+    "repeated": 'background writer, every task logs the same line'
+}
+
+
+def _slow(handler: logging.Handler, delay: float) -> logging.Handler:
+    if delay:
+        emit = handler.emit
+
+        def slow_emit(record: logging.LogRecord):
+            time.sleep(delay)
+            emit(record)
+
+        handler.emit = slow_emit
+
+    return handler
+
+
+def _sync_logger(name: str, delay: float) -> logging.Logger:
+    """The setup every module had before ``log``."""
+    logger = logging.getLogger(name)
+    handler = TimedRotatingFileHandler(
+        filename=f'logs/{name}.log',
+        when='midnight'
+    )
+    handler.setFormatter(
+        logging.Formatter(
+            '[%(asctime)s] [%(levelname)s] "%(message)s"',
+            datefmt='%d.%m.%Y %H:%M:%S'
+        )
+    )
+    handler.setLevel(logging.DEBUG)
+    logger.addHandler(_slow(handler, delay))
+
+    return logger
+
+
+def child(mode: str, threads: int, tasks: int, calls: int, delay: float):
+    import log
+
+    logging.getLogger().setLevel(logging.INFO if mode == 'off' else logging.DEBUG)
+    if mode == 'sync':
+        loggers: list[logging.Logger] = [
+            _sync_logger(name, delay) for name in MODULES
+        ]
+    else:
+        loggers = [log.get_logger(name) for name in MODULES]
+        for handler in (*log._router.files.values(), *log._router.others):
+            _slow(handler, delay)
+
+    spent: list[float] = [0.0] * threads
+
+    def run(thread: int):
+        for task in range(tasks):
+            job_id: str = f'{thread:0>2}{task:0>6}'
+            start: float = time.perf_counter()
+            with log.job(job_id):
+                for call in range(calls):
+                    if mode == 'repeated':
+                        loggers[0].debug(f'Waiting for the operation of {job_id}...')
+                    else:
+                        loggers[call % len(loggers)].debug(
+                            f'Step {call} of job {job_id}: downloaded '
+                            f'{call * 1_048_576} B from https://downloader.disk'
+                            f'.yandex.ru/disk/{job_id}'
+                        )
+            spent[thread] += time.perf_counter() - start
+
+    start: float = time.perf_counter()
+    workers: list[Thread] = [
+        Thread(target=run, args=(i,)) for i in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    logged: float = time.perf_counter() - start
+    log.stop()
+    written: float = time.perf_counter() - start
+
+    lines: int = 0
+    for name in os.listdir('logs'):
+        if name.endswith('.log'):
+            with open(os.path.join('logs', name)) as f:
+                lines += sum(1 for _ in f)
+
+    print(json.dumps({
+        "us_per_task": sum(spent) / (threads * tasks) * 1e6,
+        "logged_s": logged,
+        "written_s": written,
+        "lines": lines,
+        "dropped": log.dropped()
+    }), flush=True)
+
+
+def run(mode: str, args) -> dict:
+    sandbox: str = tempfile.mkdtemp(prefix='yadisk-logging-')
+    os.makedirs(os.path.join(sandbox, 'logs'))
+
+    try:
+        process = subprocess.run(
+            [
+                sys.executable, '-m', 'benchmarks.logging_overhead',
+                '--child', mode, '--threads', str(args.threads),
+                '--tasks', str(args.tasks), '--calls', str(args.calls),
+                '--write-delay', str(args.write_delay)
+            ],
+            cwd=sandbox, capture_output=True, text=True,
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(
+                filter(None, (ROOT, os.environ.get('PYTHONPATH')))
+            ))
+        )
+        if process.returncode:
+            raise RuntimeError(f'Mode {mode} failed:\n{process.stderr[-3000:]}')
+    finally:
+        shutil.rmtree(sandbox, ignore_errors=True)
+
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--tasks', type=int, default=200)
+    parser.add_argument('--calls', type=int, default=30,
+                        help='Records logged by a task.')
+    parser.add_argument('--write-delay', type=float, default=0.0)
+    parser.add_argument('--child', choices=MODES, help='Internal: run the mode here.')
+    args = parser.parse_args()
+
+    if args.child:
+        return child(
+            args.child, args.threads, args.tasks, args.calls, args.write_delay
+        )
+
+    print(
+        f'{args.threads} threads, {args.tasks} tasks each, {args.calls} '
+        f'records per task, write delay {args.write_delay * 1e3:.1f} ms'
+    )
+    for mode, description in MODES.items():
+        result: dict = run(mode, args)
+        print(
+            f'{mode:>9}: {result["us_per_task"]:8.0f} us per task, logged in '
+            f'{result["logged_s"]:.2f} s, written in '
+            f'{result["written_s"]:.2f} s, {result["lines"]} lines, '
+            f'{result["dropped"]} dropped ({description})',
+            flush=True
+        )
+
+
+if __name__ == '__main__':
+    main()
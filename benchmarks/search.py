@@ -0,0 +1,138 @@
+"""Build time and query latency of the name index of a big public folder.
+
+The Yandex Disk stand-in serves a tree of ``--folders`` folders with
+``--folders`` subfolders of ``--files`` files each (100k files by default).
+The index is built at ``--rate`` requests per second, searched while it
+is built and then with names, missing names and wildcards.
+
+Run from the repository root:
+
+    python -m benchmarks.search
+    python -m benchmarks.search --rate 35 --latency 0.05
+"""
+import os
+import random
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from benchmarks.stand_ins import FakeYandexDisk
+
+LINK: str = 'https://disk.yandex.ru/d/search'
+WORDS: tuple[str, ...] = (
+    'report', 'photo', 'invoice', 'scan', 'lecture', 'draft', 'backup', 'track'
+)
+EXTENSIONS: tuple[str, ...] = ('pdf', 'jpg', 'docx', 'mp3', 'zip')
+
+
+def _tree(folders: int, files: int) -> dict:
+    def leaf(prefix: str) -> dict:
+        return {
+            f'{WORDS[i % len(WORDS)]}-{prefix}{i:0>4}.'
+            f'{EXTENSIONS[i % len(EXTENSIONS)]}': 1 << 20
+            for i in range(files)
+        }
+
+    return {
+        f'folder{i}': {
+            f'sub{j}': leaf(f'{i}{j}-') for j in range(folders)
+        }
+        for i in range(folders)
+    }
+
+
+def _percentiles(latencies: list[float]) -> str:
+    latencies = sorted(latencies)
+    return (
+        f'p50 {latencies[len(latencies) // 2] * 1e3:7.2f} ms, '
+        f'p95 {latencies[int(len(latencies) * 0.95)] * 1e3:7.2f} ms'
+    )
+
+
+def _time(index, pattern: str) -> float:
+    start: float = time.perf_counter()
+    index.find(pattern)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--folders', type=int, default=10)
+    parser.add_argument('--files', type=int, default=1000,
+                        help='Files in every subfolder.')
+    parser.add_argument('--rate', type=float, default=10.0,
+                        help='Requests per second of the index.')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Latency of Yandex Disk, seconds.')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    tree: dict = _tree(args.folders, args.files)
+    yandex: FakeYandexDisk = FakeYandexDisk(
+        {LINK: tree}, latency=args.latency
+    ).start()
+    os.environ["YADISK_API_URL"] = yandex.api_url
+
+    # Modules log to logs/ of the working directory
+    folder: str = tempfile.mkdtemp(prefix='yadisk-search-')
+    cwd: str = os.getcwd()
+    os.chdir(folder)
+    os.makedirs('logs')
+    try:
+        from search import NameIndexes, NameIndex
+
+        choice: random.Random = random.Random(args.seed)
+        names: list[str] = [
+            name for subfolders in tree.values()
+            for files in subfolders.values() for name in files
+        ]
+        print(
+            f'{len(names)} files in {args.folders * (args.folders + 1)} '
+            f'folders, {args.rate:.0f} requests/s, API latency '
+            f'{args.latency * 1e3:.0f} ms'
+        )
+
+        start: float = time.perf_counter()
+        index: NameIndex = NameIndexes(args.rate).get(LINK)
+        building: list[float] = []
+        first: float | None = None
+        target: str = names[-1].split('.')[0]
+        while not index.done:
+            building.append(_time(index, choice.choice(names)[:10]))
+            if first is None and index.find(target):
+                first = time.perf_counter() - start
+            time.sleep(0.1)
+        build: float = time.perf_counter() - start
+        if first is None:
+            first = build
+
+        print(
+            f'   build: {build:.1f} s, {len(index)} entries, '
+            f'{index.requests} requests, {len(index) / build:.0f} entries/s'
+            + (f', stopped: {index.error}' if index.error else '')
+        )
+        print(f'   the last file is found after {first:.1f} s')
+        print(f'  during the build: {_percentiles(building)}')
+        for kind, patterns in (
+            ('name', [choice.choice(names) for _ in range(args.queries)]),
+            ('part of a name',
+             [choice.choice(names)[3:12] for _ in range(args.queries)]),
+            ('missing', [f'missing{i}' for i in range(args.queries)]),
+            ('wildcard', [f'{choice.choice(WORDS)}-*.pdf'
+                          for _ in range(args.queries)]),
+            ('missing wildcard', ['*.xyz'] * args.queries)
+        ):
+            print(
+                f'{kind:>18}: '
+                + _percentiles([_time(index, pattern) for pattern in patterns])
+            )
+    finally:
+        yandex.stop()
+        os.chdir(cwd)
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Throughput of handling small files on the disk and in memory, without
+the network.
+
+Every file is written in chunks like a download, zipped, split and read
+like an upload: through ``temp/`` with :func:`workers.zip_file` and
+:func:`workers.split_file`, and in memory with :func:`workers.zip_buffer`.
+Threads handle files in parallel like workers.
+
+Run from the repository root:
+
+    python -m benchmarks.small_files
+    python -m benchmarks.small_files --size 20 --files 2000 --threads 4
+"""
+import os
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from io import BytesIO
+
+CHUNK: int = 64 << 10
+
+
+def on_disk(folder: str, name: str, data: bytes) -> int:
+    """:returns: Bytes uploaded."""
+    from aiogram.types import InputFile
+
+    from workers import split_file, zip_file
+
+    staging: str = os.path.join(folder, name)
+    os.makedirs(staging)
+    path: str = os.path.join(staging, name)
+    with open(path, 'wb') as file:
+        for start in range(0, len(data), CHUNK):
+            file.write(data[start:start + CHUNK])
+
+    uploaded: int = 0
+    for part in split_file(zip_file(path), 2000 << 20, 1 << 20):
+        upload: InputFile = InputFile(part)
+        uploaded += len(upload.file.read())
+        upload.file.close()
+        os.remove(part)
+    shutil.rmtree(staging)
+
+    return uploaded
+
+
+def in_memory(folder: str, name: str, data: bytes) -> int:
+    """:returns: Bytes uploaded."""
+    from aiogram.types import InputFile
+
+    from workers import zip_buffer
+
+    buffer: BytesIO = BytesIO()
+    for start in range(0, len(data), CHUNK):
+        buffer.write(data[start:start + CHUNK])
+
+    upload: InputFile = InputFile(
+        BytesIO(zip_buffer(buffer.getvalue(), name)), f'{name}.zip'
+    )
+    return len(upload.file.read())
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=20, help='File size, KB.')
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    # Workers log to logs/ of the working directory
+    folder: str = tempfile.mkdtemp(prefix='yadisk-small-files-')
+    cwd: str = os.getcwd()
+    os.chdir(folder)
+    os.makedirs('logs')
+    # The event loop of the bot is created on import in the main thread
+    import_module('workers')
+
+    data: bytes = os.urandom(args.size << 10)
+
+    print(f'{args.files} files of {args.size} KB, {args.threads} threads:')
+    try:
+        for name, handle in (('disk', on_disk), ('memory', in_memory)):
+            start: float = time.perf_counter()
+            with ThreadPoolExecutor(args.threads) as executor:
+                list(executor.map(
+                    lambda i: handle(folder, f'file{i}.bin', data),
+                    range(args.files)
+                ))
+            wall: float = time.perf_counter() - start
+            print(
+                f'{name:>7}: {args.files / wall:8.0f} files/s, '
+                f'{wall / args.files * 1e6:6.0f} us per file', flush=True
+            )
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,634 @@
+"""Local stand-ins for Yandex Disk REST API and Telegram Bot API.
+
+Both servers keep everything in memory and count requests, so scenarios
+can run offline and report how many calls they made.
+
+Yandex Disk stand-in serves public resources described by a tree
+(``{name: size | {...}}``), file contents are generated from the path,
+so any byte range can be served and checked without storing files.
+"""
+import email
+import json
+import sys
+import time
+from collections import Counter, defaultdict
+from functools import lru_cache
+from hashlib import md5, sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from threading import Lock, Thread
+from typing import Callable
+from urllib.parse import urlsplit, parse_qs
+
+BLOCK_SIZE: int = 1 << 16
+MODIFIED: str = '2024-01-01T00:00:00+00:00'
+
+
+def block(public_key: str, path: str) -> bytes:
+    """:returns: Block, which file content is repeated from."""
+    seed: bytes = sha256(f'{public_key}:{_normalize(path)}'.encode()).digest()
+    return (seed * (BLOCK_SIZE // len(seed) + 1))[:BLOCK_SIZE]
+
+
+def content(public_key: str, path: str, start: int, end: int) -> bytes:
+    """:returns: Bytes [start, end) of the file."""
+    data: bytes = block(public_key, path)
+    first: int = start % BLOCK_SIZE
+    repeats: int = (first + end - start) // BLOCK_SIZE + 1
+
+    return (data * repeats)[first:first + end - start]
+
+
+@lru_cache(maxsize=1024)
+def file_hashes(public_key: str, path: str, size: int) -> tuple[str, str]:
+    """:returns: MD5 and SHA-256 of the file."""
+    md5_hash, sha256_hash = md5(), sha256()
+    for offset in range(0, size, 1 << 22):
+        chunk: bytes = content(
+            public_key, path, offset, min(size, offset + (1 << 22))
+        )
+        md5_hash.update(chunk)
+        sha256_hash.update(chunk)
+
+    return md5_hash.hexdigest(), sha256_hash.hexdigest()
+
+
+def _normalize(path: str) -> str:
+    return '/' + '/'.join(part for part in path.split('/') if part)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # Load tests open hundreds of connections at once
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients, which are stopped, drop their connections
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    stand_in = None
+
+    def do_GET(self):
+        self.stand_in.handle(self, 'GET')
+
+    def do_POST(self):
+        self.stand_in.handle(self, 'POST')
+
+    def do_PUT(self):
+        self.stand_in.handle(self, 'PUT')
+
+    def do_DELETE(self):
+        self.stand_in.handle(self, 'DELETE')
+
+    def log_message(self, format: str, *args):
+        pass
+
+    def body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def reply(self, status: int, data: dict | list | bytes = b'',
+              headers: dict[str: str] = None):
+        body: bytes = data if isinstance(data, bytes) else json.dumps(
+            data
+        ).encode()
+
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if not isinstance(data, bytes):
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandIn:
+    def __init__(self, port: int = 0, host: str = '127.0.0.1'):
+        self._lock: Lock = Lock()
+        self.calls: Counter = Counter()
+
+        handler = type('Handler', (_Handler,), {"stand_in": self})
+        self.server: _Server = _Server((host, port), handler)
+        self.url: str = f'http://{host}:{self.server.server_port}'
+
+    def start(self) -> 'StandIn':
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, request: _Handler, method: str):
+        raise NotImplementedError
+
+
+class FakeYandexDisk(StandIn):
+    """Yandex Disk API: public resources, save-to-disk, operations,
+    download links with Range support and deleting.
+
+    :param trees: Trees of public resources by public keys.
+    :param latency: Delay of every API request, seconds.
+    :param bandwidth: Download speed, bytes per second (per download).
+    :param account_bandwidth: Download speed shared by all downloads of an
+        account, bytes per second.
+    :param async_size: Saving of bigger files is asynchronous.
+    :param operation_time: Time asynchronous saving takes.
+    :param faults: Statuses (or statuses and error names) returned instead
+        of handling requests to the endpoint with the path, in order.
+    :param damage: Downloads of files by paths, in order: ``'corrupt'``
+        (a byte in the middle is changed), ``'truncate'`` (the second half
+        is not sent, as if the file was shorter) or ``None`` (intact).
+    """
+
+    def __init__(self, trees: dict[str: dict], port: int = 0,
+                 latency: float = 0.0, bandwidth: float = None,
+                 account_bandwidth: float = None,
+                 async_size: int = 50_000_000, operation_time: float = 0.5,
+                 total_space: int = 1 << 40,
+                 faults: dict[tuple[str, str]: list[int | tuple]] = None,
+                 damage: dict[str: list[str | None]] = None):
+        super().__init__(port)
+        self.trees: dict[str: dict] = trees
+        self.latency: float = latency
+        self.bandwidth: float | None = bandwidth
+        self.account_bandwidth: float | None = account_bandwidth
+        # When the next chunk of the account may be sent
+        self._account_time: dict[str: float] = defaultdict(float)
+        self.ASYNC_SIZE: int = async_size
+        self.OPERATION_TIME: float = operation_time
+        self.TOTAL_SPACE: int = total_space
+
+        # Saved files by account tokens: path -> (public key, path, size)
+        self.disks: dict[str: dict[str: tuple[str, str, int]]] = defaultdict(dict)
+        self.operations: dict[str: tuple[float, str, str, tuple]] = {}
+        # Token, public key, path and size by links
+        self.links: dict[str: tuple[str, str, str, int]] = {}
+        self.downloaded: int = 0
+        self._ids = count(1)
+
+        # Status codes to answer instead of serving: (endpoint, path) -> codes
+        self.faults: dict[tuple[str, str]: list[int | tuple]] = {
+            key: list(codes) for key, codes in (faults or {}).items()
+        }
+        self.damage: dict[str: list[str | None]] = {
+            _normalize(path): list(kinds)
+            for path, kinds in (damage or {}).items()
+        }
+
+    @property
+    def api_url(self) -> str:
+        return f'{self.url}/v1/disk/'
+
+    def find(self, public_key: str, path: str) -> int | dict | None:
+        node: int | dict | None = self.trees.get(public_key)
+        for part in filter(None, path.split('/')):
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+
+        return node
+
+    def handle(self, request: _Handler, method: str):
+        url = urlsplit(request.path)
+        params: dict[str: str] = {
+            name: values[0] for name, values in parse_qs(url.query).items()
+        }
+        endpoint: str = url.path.removeprefix('/v1/disk/')
+        token: str = request.headers.get('Authorization', '').removeprefix(
+            'OAuth '
+        )
+
+        label: str = endpoint
+        if url.path.startswith('/download/'):
+            label = 'download'
+        elif endpoint.startswith('operations/'):
+            label = 'operations'
+        with self._lock:
+            self.calls[f'{method} {label}'] += 1
+
+        if url.path.startswith('/download/'):
+            return self._download(request, url.path.removeprefix('/download/'))
+
+        if request.command != 'GET':
+            request.body()
+        if self.latency:
+            time.sleep(self.latency)
+
+        fault: int | tuple[int, str] | None = self._fault(
+            endpoint, params.get("path", '')
+        )
+        if fault is not None:
+            status, error = (
+                fault if isinstance(fault, tuple) else (fault, 'FaultInjected')
+            )
+            return request.reply(status, {"error": error})
+
+        match method, endpoint:
+            case 'GET', 'public/resources':
+                return self._metadata(request, params)
+            case 'POST', 'public/resources/save-to-disk':
+                return self._save(request, params, token)
+            case 'GET', 'resources/download':
+                return self._link(request, params, token)
+            case 'DELETE', 'resources':
+                with self._lock:
+                    found = self.disks[token].pop(params["path"], None)
+                return request.reply(204 if found else 404)
+            case 'GET', '':
+                used: int = sum(
+                    size for _, _, size in self.disks[token].values()
+                )
+                return request.reply(
+                    200,
+                    {"total_space": self.TOTAL_SPACE, "used_space": used}
+                )
+            case 'GET', _ if endpoint.startswith('operations/'):
+                return self._operation(request, endpoint.split('/')[-1])
+            case _:
+                return request.reply(404, {"error": 'NotFound'})
+
+    def _fault(self, endpoint: str,
+               path: str) -> int | tuple[int, str] | None:
+        with self._lock:
+            codes: list[int | tuple[int, str]] = self.faults.get((endpoint, _normalize(path)))
+            if codes:
+                return codes.pop(0)
+
+        return None
+
+    def _item(self, public_key: str, path: str, node: int | dict,
+              hashes: bool = True) -> dict:
+        item: dict = {
+            "public_key": public_key,
+            "name": _normalize(path).split('/')[-1] or public_key.split('/')[-1],
+            "path": _normalize(path),
+            "modified": MODIFIED,
+            "type": 'dir' if isinstance(node, dict) else 'file'
+        }
+        if not isinstance(node, dict):
+            item["size"] = node
+            if hashes:
+                item["md5"], item["sha256"] = file_hashes(
+                    public_key, path, node
+                )
+
+        return item
+
+    def _metadata(self, request: _Handler, params: dict[str: str]):
+        public_key: str = params.get("public_key", '')
+        path: str = params.get("path", '/')
+        node: int | dict | None = self.find(public_key, path)
+        if node is None:
+            return request.reply(404, {"error": 'DiskNotFoundError'})
+
+        # Only hashes are left out of listings with fields, they are slow
+        hashes: bool = "fields" not in params or 'sha256' in params["fields"]
+        data: dict = self._item(public_key, path, node, hashes)
+        if isinstance(node, dict):
+            limit: int = int(params.get("limit", 20))
+            offset: int = int(params.get("offset", 0))
+            names: list[str] = list(node)[offset:offset + limit]
+            data["_embedded"] = {
+                "items": [
+                    self._item(
+                        public_key, f'{path}/{name}', node[name], hashes
+                    )
+                    for name in names
+                ],
+                "limit": limit,
+                "offset": offset,
+                "total": len(node),
+                "path": _normalize(path),
+                "public_key": public_key
+            }
+
+        return request.reply(200, data)
+
+    def _save(self, request: _Handler, params: dict[str: str], token: str):
+        public_key: str = params.get("public_key", '')
+        path: str = params.get("path", '/')
+        node: int | dict | None = self.find(public_key, path)
+        if node is None:
+            return request.reply(404, {"error": 'DiskNotFoundError'})
+        if isinstance(node, dict):
+            return request.reply(400, {"error": 'NotSupported'})
+
+        name: str = params.get("name") or _normalize(path).split('/')[-1]
+        folder: str = params.get("save_path", '/Загрузки').rstrip('/')
+
+        with self._lock:
+            # Yandex Disk doesn't overwrite, the copy is renamed
+            saved: str = f'{folder}/{name}'
+            stem, dot, ext = name.partition('.')
+            for i in count(1):
+                if saved not in self.disks[token] and not any(
+                        target == saved for _, _, target, _ in
+                        self.operations.values()
+                ):
+                    break
+                saved = f'{folder}/{stem} ({i}){dot}{ext}'
+
+            entry: tuple[str, str, int] = (public_key, path, node)
+            if node < self.ASYNC_SIZE:
+                self.disks[token][saved] = entry
+                return request.reply(
+                    201,
+                    {"href": f'{self.api_url}resources?path={saved}',
+                     "method": 'GET'}
+                )
+
+            operation: str = f'op{next(self._ids)}'
+            self.operations[operation] = (
+                time.time() + self.OPERATION_TIME, token, saved, entry
+            )
+
+        return request.reply(
+            202,
+            {"href": f'{self.api_url}operations/{operation}', "method": 'GET'}
+        )
+
+    def _operation(self, request: _Handler, operation: str):
+        with self._lock:
+            if operation not in self.operations:
+                return request.reply(404, {"error": 'NotFound'})
+
+            done_time, token, saved, entry = self.operations[operation]
+            if time.time() < done_time:
+                return request.reply(200, {"status": 'in-progress'})
+
+            self.operations.pop(operation)
+            self.disks[token][saved] = entry
+
+        return request.reply(200, {"status": 'success'})
+
+    def _link(self, request: _Handler, params: dict[str: str], token: str):
+        with self._lock:
+            entry = self.disks[token].get(params.get("path"))
+            if entry is None:
+                return request.reply(404, {"error": 'DiskNotFoundError'})
+
+            link: str = f'l{next(self._ids)}'
+            self.links[link] = (token, *entry)
+
+        return request.reply(
+            200, {"href": f'{self.url}/download/{link}', "method": 'GET'}
+        )
+
+    def _download(self, request: _Handler, link: str):
+        entry = self.links.get(link)
+        if entry is None:
+            return request.reply(404)
+
+        token, public_key, path, size = entry
+        with self._lock:
+            kinds: list[str | None] = self.damage.get(_normalize(path))
+            damage: str | None = kinds.pop(0) if kinds else None
+        if damage == 'truncate':
+            size //= 2
+        start, end = 0, size
+        status: int = 200
+        headers: dict[str: str] = {"Accept-Ranges": 'bytes'}
+
+        if request.headers.get('Range', '').startswith('bytes='):
+            first, _, last = request.headers['Range'][6:].partition('-')
+            start = int(first or 0)
+            if start >= size:
+                # Like Yandex Disk, a range after the end isn't satisfiable
+                return request.reply(
+                    416, headers={"Content-Range": f'bytes */{size}'}
+                )
+            end = min(size, int(last) + 1) if last else size
+            status = 206
+            headers["Content-Range"] = f'bytes {start}-{end - 1}/{size}'
+
+        request.send_response(status)
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.send_header('Content-Type', 'application/octet-stream')
+        request.send_header('Content-Length', str(end - start))
+        request.end_headers()
+
+        chunk_size: int = 1 << 20
+        for offset in range(start, end, chunk_size):
+            chunk: bytes = content(
+                public_key, path, offset, min(end, offset + chunk_size)
+            )
+            middle: int = size // 2 - offset
+            if damage == 'corrupt' and 0 <= middle < len(chunk):
+                chunk = (
+                    chunk[:middle] + bytes([chunk[middle] ^ 0xFF])
+                    + chunk[middle + 1:]
+                )
+            if self.bandwidth:
+                time.sleep(len(chunk) / self.bandwidth)
+            if self.account_bandwidth:
+                with self._lock:
+                    sent_time: float = max(
+                        time.monotonic(), self._account_time[token]
+                    ) + len(chunk) / self.account_bandwidth
+                    self._account_time[token] = sent_time
+                time.sleep(max(0.0, sent_time - time.monotonic()))
+            try:
+                request.wfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+
+            with self._lock:
+                self.downloaded += len(chunk)
+
+
+class FakeBotAPI(StandIn):
+    """Telegram Bot API: messages, documents and media groups.
+
+    Received documents are recorded by chat IDs (see ``documents``),
+    contents are kept when ``keep_content`` is set.
+
+    :param latency: Delay of every request, seconds.
+    :param first_update_id: Update IDs continue a previous server.
+    :param on_call: Called with the method, fields and result of every
+        request after it is answered (in the thread of the request).
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0.0,
+                 keep_content: bool = False, first_update_id: int = 1,
+                 on_call: Callable[[str, dict, object], None] = None):
+        super().__init__(port)
+        self.latency: float = latency
+        self.keep_content: bool = keep_content
+        self.on_call: Callable[[str, dict, object], None] | None = on_call
+
+        self.files: dict[str: dict] = {}
+        self.contents: dict[str: bytes] = {}
+        self.documents: dict[int: list[tuple[float, dict]]] = defaultdict(list)
+        self.messages: dict[int: dict] = {}
+        self.uploaded: int = 0
+
+        self.updates: list[dict] = []
+        self._ids = count(1)
+        self._update_ids = count(first_update_id)
+
+    def put_update(self, update: dict):
+        with self._lock:
+            update["update_id"] = next(self._update_ids)
+            self.updates.append(update)
+
+    def handle(self, request: _Handler, method: str):
+        api_method: str = request.path.split('?')[0].rstrip('/').split('/')[-1]
+        with self._lock:
+            self.calls[api_method] += 1
+
+        fields, files = self._parse(request)
+        if self.latency:
+            time.sleep(self.latency)
+
+        match api_method:
+            case 'getMe':
+                result = {
+                    "id": 1, "is_bot": True, "first_name": 'Bot',
+                    "username": 'bench_bot'
+                }
+            case 'getWebhookInfo':
+                result = {"url": '', "has_custom_certificate": False,
+                          "pending_update_count": 0}
+            case 'getUpdates':
+                result = self._get_updates(fields)
+            case 'sendMessage' | 'editMessageText':
+                if "chat_id" not in fields:
+                    # Answered like Telegram, so a malformed request fails
+                    # in the bot instead of dropping the connection
+                    request.reply(400, {
+                        "ok": False, "error_code": 400,
+                        "description": 'Bad Request: chat_id is empty'
+                    })
+                    return
+                result = self._message(fields)
+            case 'sendDocument':
+                result = self._document(
+                    fields, fields.get("document"), files.get("document")
+                )
+            case 'sendMediaGroup':
+                result = [
+                    self._document(
+                        fields,
+                        media["media"],
+                        files.get(media["media"].removeprefix('attach://'))
+                    )
+                    for media in json.loads(fields["media"])
+                ]
+            case _:
+                result = True
+
+        request.reply(200, {"ok": True, "result": result})
+        if self.on_call is not None:
+            self.on_call(api_method, fields, result)
+
+    def _get_updates(self, fields: dict[str: str]) -> list[dict]:
+        offset: int = int(fields.get("offset", 0))
+        deadline: float = time.time() + min(float(fields.get("timeout", 0)), 1)
+
+        while True:
+            with self._lock:
+                self.updates = [
+                    update for update in self.updates
+                    if update["update_id"] >= offset
+                ]
+                if self.updates or time.time() >= deadline:
+                    return list(self.updates)
+
+            time.sleep(0.01)
+
+    def _message(self, fields: dict[str: str]) -> dict:
+        chat_id: int = int(fields["chat_id"])
+        message: dict = {
+            "message_id": int(fields.get("message_id") or next(self._ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": 'private'},
+            "text": fields.get("text", '')
+        }
+        if "reply_markup" in fields:
+            message["reply_markup"] = json.loads(fields["reply_markup"])
+
+        with self._lock:
+            self.messages[chat_id] = message
+
+        return message
+
+    def _document(self, fields: dict[str: str], document: str | None,
+                  upload: tuple[str, bytes] | None) -> dict:
+        chat_id: int = int(fields["chat_id"])
+
+        with self._lock:
+            if upload is not None:
+                name, data = upload
+                file_id: str = f'file{next(self._ids)}'
+                self.files[file_id] = {
+                    "file_id": file_id,
+                    "file_unique_id": file_id,
+                    "file_name": name,
+                    "file_size": len(data),
+                    "sha256": sha256(data).hexdigest()
+                }
+                self.uploaded += len(data)
+                if self.keep_content:
+                    self.contents[file_id] = data
+            else:
+                file_id = document
+
+            info: dict = dict(
+                self.files.get(file_id, {
+                    "file_id": file_id, "file_unique_id": file_id
+                })
+            )
+            self.documents[chat_id].append((time.time(), info))
+            info.pop("sha256", None)
+
+        return {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": 'private'},
+            "document": info
+        }
+
+    @staticmethod
+    def _parse(request: _Handler) -> tuple[dict[str: str],
+                                           dict[str: tuple[str, bytes]]]:
+        """:returns: Fields and files (names and contents) of the request."""
+        content_type: str = request.headers.get('Content-Type', '')
+        body: bytes = request.body()
+        query: str = urlsplit(request.path).query
+
+        fields: dict[str: str] = {
+            name: values[0] for name, values in parse_qs(query).items()
+        }
+        files: dict[str: tuple[str, bytes]] = {}
+
+        if content_type.startswith('multipart/form-data'):
+            message = email.message_from_bytes(
+                f'Content-Type: {content_type}\r\n\r\n'.encode() + body
+            )
+            for part in message.get_payload():
+                name: str = part.get_param('name', header='content-disposition')
+                filename: str | None = part.get_filename()
+                data: bytes = part.get_payload(decode=True)
+                if filename is not None:
+                    files[name] = (filename, data)
+                else:
+                    fields[name] = data.decode()
+        elif content_type.startswith('application/json'):
+            fields.update(
+                {name: value if isinstance(value, str) else json.dumps(value)
+                 for name, value in json.loads(body or b'{}').items()}
+            )
+        elif body:
+            fields.update(
+                {name: values[0]
+                 for name, values in parse_qs(body.decode()).items()}
+            )
+
+        return fields, files
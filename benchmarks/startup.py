@@ -0,0 +1,240 @@
+"""Cold start of the bot: from running ``main.py`` to the first polled
+update and the first reply.
+
+``main.py`` is run in a fresh working directory with ``server_path``
+pointing to a Bot API stand-in, which becomes ready after a delay and
+sends ``/start`` once it is. The update is polled with the first
+``getUpdates`` of the bot. With ``--crash``, the first server exits
+right after the reply, and the time until the restarted server gets a
+reply is measured too.
+
+Run from the repository root:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --delays 0 2 5 --crash
+"""
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from statistics import median
+
+from benchmarks.stand_ins import FakeBotAPI
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USER_ID: int = 1000
+# The fixed pause main.py made before the supervisor
+OLD_STARTUP: float = 10.0
+
+
+def _event(name: str, **values):
+    with open(os.environ["STARTUP_EVENTS"], 'a') as f:
+        f.write(json.dumps({"event": name, "time": time.time(), **values}))
+        f.write('\n')
+
+
+def serve(arguments: list[str]):
+    """Bot API stand-in run by the supervisor."""
+    port: int = 8081
+    for argument in arguments:
+        if argument.startswith('--http-port='):
+            port = int(argument.split('=')[1])
+
+    with open(os.environ["STARTUP_EVENTS"], 'a+') as f:
+        f.seek(0)
+        generation: int = sum('"spawn"' in line for line in f)
+    _event('spawn', pid=os.getpid())
+
+    time.sleep(float(os.environ.get("STARTUP_DELAY", 0)))
+    polled: list[bool] = []
+
+    def on_call(method: str, fields: dict, result):
+        # The update is answered to the first getUpdates of the bot
+        if method == 'getUpdates' and result and not polled:
+            polled.append(True)
+            _event('polled')
+
+    bot_api: FakeBotAPI = FakeBotAPI(
+        port, first_update_id=1000 * generation + 1, on_call=on_call
+    ).start()
+    bot_api.put_update({
+        "message": {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": USER_ID, "type": 'private'},
+            "from": {"id": USER_ID, "is_bot": False, "first_name": 'User'},
+            "text": '/start',
+            "entities": [{"type": 'bot_command', "offset": 0, "length": 6}]
+        }
+    })
+
+    while USER_ID not in bot_api.messages:
+        time.sleep(0.01)
+    _event('reply')
+
+    if os.environ.get("STARTUP_CRASH") and not generation:
+        # Pending responses are not sent, as if the server crashed
+        os._exit(1)
+    while True:
+        time.sleep(1)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _events(path: str) -> list[dict]:
+    if not os.path.exists(path):
+        return []
+
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def run(delay: float, crash: bool, timeout: float) -> dict:
+    sandbox: str = tempfile.mkdtemp(prefix='yadisk-startup-')
+    events_path: str = os.path.join(sandbox, 'events.jsonl')
+    server_path: str = os.path.join(sandbox, 'telegram-bot-api')
+    replies: int = 2 if crash else 1
+    process: subprocess.Popen | None = None
+
+    try:
+        for folder in ('config', 'logs', 'data', 'temp'):
+            os.makedirs(os.path.join(sandbox, folder))
+
+        with open(os.path.join(ROOT, 'config', 'config.json')) as f:
+            config: dict = json.load(f)
+        config.update({
+            "log_level": 'WARNING',
+            "server_path": server_path,
+            "metrics_port": None
+        })
+        with open(os.path.join(sandbox, 'config', 'config.json'), 'w') as f:
+            json.dump(config, f)
+        with open(os.path.join(sandbox, 'config', 'tokens.json'), 'w') as f:
+            json.dump({
+                "tg_token": '123456:benchmark', "ya_token": 'bench',
+                "tg_api-id": 1, "tg_api-hash": 'hash'
+            }, f)
+        with open(server_path, 'w') as f:
+            f.write(
+                f'#!/bin/sh\nexec "{sys.executable}" -m benchmarks.startup '
+                f'--serve "$@"\n'
+            )
+        os.chmod(server_path, 0o755)
+
+        env: dict[str: str] = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(
+                filter(None, (ROOT, os.environ.get('PYTHONPATH')))
+            ),
+            BOT_API_URL=f'http://127.0.0.1:{_free_port()}',
+            STARTUP_EVENTS=events_path,
+            STARTUP_DELAY=str(delay),
+            STARTUP_CRASH='1' if crash else ''
+        )
+
+        start: float = time.time()
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'main.py')],
+            cwd=sandbox, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+        )
+        while time.time() - start < timeout:
+            events: list[dict] = _events(events_path)
+            if sum(event["event"] == 'reply' for event in events) >= replies:
+                break
+            if process.poll() is not None:
+                raise RuntimeError(
+                    f'main.py exited:\n{process.stderr.read()[-3000:]}'
+                )
+            time.sleep(0.05)
+        else:
+            raise RuntimeError(f'No reply in {timeout:.0f} s')
+
+        process.send_signal(signal.SIGINT)
+        stopping: float = time.time()
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        stop_time: float = time.time() - stopping
+    finally:
+        events = _events(events_path)
+        leftover: bool = False
+        for event in events:
+            if event["event"] == 'spawn':
+                try:
+                    os.kill(event["pid"], signal.SIGKILL)
+                    leftover = True
+                except ProcessLookupError:
+                    pass
+        if process is not None and process.poll() is None:
+            process.kill()
+        shutil.rmtree(sandbox, ignore_errors=True)
+
+    reply_times: list[float] = [
+        event["time"] for event in events if event["event"] == 'reply'
+    ]
+    polled: float = next(
+        event["time"] for event in events if event["event"] == 'polled'
+    )
+    result: dict = {
+        "polled_s": polled - start,
+        "cold_start_s": reply_times[0] - start,
+        "stop_s": stop_time,
+        "server_left_running": leftover
+    }
+    if crash:
+        result["recovery_s"] = reply_times[1] - reply_times[0]
+
+    return result
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--delays', type=float, nargs='+', default=[0, 1, 3],
+                        help='Startup times of the server, seconds.')
+    parser.add_argument('--crash', action='store_true',
+                        help='Measure a restart after a crash too.')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='Runs of every delay, medians are printed.')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--serve', nargs='...', help='Internal.')
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        return serve(args.serve)
+
+    for delay in args.delays:
+        results: list[dict] = [
+            run(delay, args.crash, args.timeout) for _ in range(args.runs)
+        ]
+        result: dict = {
+            key: median(result[key] for result in results)
+            for key in results[0] if key != 'server_left_running'
+        }
+        line: str = (
+            f'server ready in {delay:.1f} s: first update polled in '
+            f'{result["polled_s"]:.2f} s, first reply in '
+            f'{result["cold_start_s"]:.2f} s '
+            f'(at least {max(OLD_STARTUP, delay):.1f} s with a fixed pause), '
+            f'stopped in {result["stop_s"]:.2f} s'
+        )
+        if args.crash:
+            line += f', recovered from a crash in {result["recovery_s"]:.2f} s'
+        if any(result["server_left_running"] for result in results):
+            line += ', SERVER LEFT RUNNING'
+        print(line, flush=True)
+
+
+if __name__ == '__main__':
+    main()
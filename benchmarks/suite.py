@@ -0,0 +1,659 @@
+"""Offline end-to-end benchmarks of the bot and workers.
+
+Every scenario runs the real ``Workers`` and ``YDBot`` in a separate
+process (so peak RSS is per scenario) inside a fresh working directory,
+against local Yandex Disk and Bot API stand-ins. The configuration is
+``config/config.json`` of the repository with scenario overrides.
+
+Run from the repository root:
+
+    python -m benchmarks.suite                       # all scenarios
+    python -m benchmarks.suite small-files folder    # some of them
+    python -m benchmarks.suite --save results.json
+    python -m benchmarks.suite --baseline results.json --tolerance 0.2
+
+With ``--baseline``, the exit code is 1 if wall time, p95 latency, peak
+RSS or peak disk usage of any scenario regressed by more than the
+tolerance.
+"""
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from hashlib import sha256
+from statistics import quantiles
+from zipfile import ZipFile
+
+from benchmarks.stand_ins import FakeYandexDisk, FakeBotAPI, file_hashes
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINK: str = 'https://disk.yandex.ru/d/'
+RESULT_MARK: str = 'BENCHMARK RESULT: '
+REGRESSION_METRICS: tuple[str, ...] = (
+    'wall_s', 'latency_p95_s', 'peak_rss_mb', 'peak_disk_mb', 'shutdown_s'
+)
+
+
+class Scenario:
+    """Jobs put in the queue at once, ``rounds`` times in a row.
+
+    :param jobs: Public keys, paths and whether they are folders.
+    :param accounts: Number of Yandex Disk tokens.
+    :param verify: Check that users got the right files (not folders).
+    :param restart_after: Stop the workers this many seconds after the
+        first round is put in the queue and finish it with new workers.
+    :param warm_up: The first jobs of a round are done before the rest are
+        put in the queue, so the rest are given an ETA.
+    :param cancel_after: Odd jobs of the first round are cancelled this
+        many seconds after it is put in the queue.
+    :param pause: Seconds between rounds.
+    :param evict: The cache is emptied before every round but the first.
+    """
+
+    def __init__(self, description: str, trees: dict[str: dict],
+                 jobs: list[tuple[str, str, bool]], rounds: int = 1,
+                 config: dict = None, yandex: dict = None, accounts: int = 1,
+                 verify: bool = False, restart_after: float = None,
+                 warm_up: int = 0, cancel_after: float = None,
+                 pause: float = 0.0, evict: bool = False):
+        self.description: str = description
+        self.trees: dict[str: dict] = trees
+        self.jobs: list[tuple[str, str, bool]] = jobs
+        self.rounds: int = rounds
+        self.config: dict = config or {}
+        self.yandex: dict = yandex or {}
+        self.accounts: int = accounts
+        self.verify: bool = verify
+        self.restart_after: float | None = restart_after
+        self.warm_up: int = warm_up
+        self.cancel_after: float | None = cancel_after
+        self.pause: float = pause
+        self.evict: bool = evict
+
+
+def _files(count: int, size: int, prefix: str = 'file') -> dict[str: int]:
+    return {f'{prefix}{i:0>3}.bin': size for i in range(count)}
+
+
+SCENARIOS: dict[str: Scenario] = {
+    "small-files": Scenario(
+        '24 files of 64 KB, 4 workers',
+        {f'{LINK}small': _files(24, 64 << 10)},
+        [(f'{LINK}small', f'/file{i:0>3}.bin', False) for i in range(24)],
+        config={"workers": 4}
+    ),
+    **{
+        name: Scenario(
+            f'100 files of 20 KB, 4 workers, {description}',
+            {f'{LINK}docs': _files(100, 20 << 10)},
+            [(f'{LINK}docs', f'/file{i:0>3}.bin', False) for i in range(100)],
+            config={"workers": 4, "memory_threshold": threshold},
+            verify=True
+        )
+        for name, description, threshold in (
+            ('small-docs', 'kept in memory', 1 << 20),
+            ('small-docs-disk', 'written to the disk', 0)
+        )
+    },
+    "multipart": Scenario(
+        '120 MB file split into 20 MB parts',
+        {f'{LINK}big': {"video.mp4": 120 << 20}},
+        [(f'{LINK}big', '/video.mp4', False)],
+        config={"local_server": False, "volume_size": 20 << 20}
+    ),
+    "cached": Scenario(
+        '4 files of 5 MB, requested twice',
+        {f'{LINK}cached': _files(4, 5 << 20)},
+        [(f'{LINK}cached', f'/file{i:0>3}.bin', False) for i in range(4)],
+        rounds=2,
+        config={"workers": 2}
+    ),
+    "folder": Scenario(
+        'Folder with 40 files of 256 KB in 4 subfolders',
+        {f'{LINK}folder': {
+            f'dir{d}': _files(10, 256 << 10) for d in range(4)
+        }},
+        [(f'{LINK}folder', '/', True)]
+    ),
+    "folder-flaky": Scenario(
+        'Folder with 8 files of 4 MB, the last one fails once, while the '
+        'rest are downloaded',
+        {f'{LINK}folder-flaky': _files(8, 4 << 20)},
+        [(f'{LINK}folder-flaky', '/', True)],
+        config={"retry_base_delay": 0.5},
+        yandex={"account_bandwidth": 16 << 20, "faults": {
+            ('public/resources/save-to-disk', '/file007.bin'): [503]
+        }}
+    ),
+    "concurrent": Scenario(
+        '8 files of 20 MB, 4 workers',
+        {f'{LINK}concurrent': _files(8, 20 << 20)},
+        [(f'{LINK}concurrent', f'/file{i:0>3}.bin', False) for i in range(8)],
+        config={"workers": 4}
+    ),
+    "flaky": Scenario(
+        '6 files of 1 MB, 3 fail transiently, 1 is gone',
+        {f'{LINK}flaky': _files(6, 1 << 20)},
+        [(f'{LINK}flaky', f'/file{i:0>3}.bin', False) for i in range(6)],
+        config={"workers": 2, "retry_base_delay": 0.5},
+        yandex={"faults": {
+            ('public/resources/save-to-disk', '/file000.bin'): [503, 503],
+            ('public/resources/save-to-disk', '/file001.bin'): [500],
+            ('resources/download', '/Загрузки/file002.bin'): [502],
+            ('public/resources/save-to-disk', '/file003.bin'): [404]
+        }}
+    ),
+    "limited": Scenario(
+        'A link over its download limit and 6 other files, 2 workers',
+        {f'{LINK}limited': _files(3, 1 << 20),
+         f'{LINK}other': _files(6, 1 << 20, 'other')},
+        [(f'{LINK}limited', f'/file{i:0>3}.bin', False) for i in range(3)]
+        + [(f'{LINK}other', f'/other{i:0>3}.bin', False) for i in range(6)],
+        config={"workers": 2, "breaker_cool_down": 1},
+        yandex={"faults": {
+            ('public/resources/save-to-disk', '/file000.bin'):
+                [(429, 'DiskResourceDownloadLimitExceededError')] * 2
+        }}
+    ),
+    **{
+        f'accounts-{accounts}': Scenario(
+            f'8 files of 4 MB, 4 workers, {accounts} account(s) '
+            f'downloading at 8 MB/s',
+            {f'{LINK}accounts': _files(8, 4 << 20)},
+            [(f'{LINK}accounts', f'/file{i:0>3}.bin', False)
+             for i in range(8)],
+            config={"workers": 4},
+            yandex={"account_bandwidth": 8 << 20},
+            accounts=accounts
+        )
+        for accounts in (1, 2, 4)
+    },
+    "same-names": Scenario(
+        '16 different files named video.mp4, 8 workers',
+        {f'{LINK}same{i}': {"video.mp4": (1 << 20) + i} for i in range(16)},
+        [(f'{LINK}same{i}', '/video.mp4', False) for i in range(16)],
+        config={"workers": 8},
+        verify=True
+    ),
+    "shutdown": Scenario(
+        '2 files of 32 MB downloading at 8 MB/s, workers are restarted '
+        'after 3 s with 1 s to drain',
+        {f'{LINK}shutdown': _files(2, 32 << 20)},
+        [(f'{LINK}shutdown', f'/file{i:0>3}.bin', False) for i in range(2)],
+        config={"workers": 2, "drain_timeout": 1, "abort_timeout": 5},
+        yandex={"account_bandwidth": 8 << 20},
+        verify=True,
+        restart_after=3
+    ),
+    "backlog": Scenario(
+        '4 files, then 16 files of 1-4 MB queued at once, 2 workers, '
+        'downloading at 4 MB/s',
+        {f'{LINK}backlog': {
+            f'file{i:0>3}.bin': (1 + i % 4) << 20 for i in range(20)
+        }},
+        [(f'{LINK}backlog', f'/file{i:0>3}.bin', False) for i in range(20)],
+        config={"workers": 2},
+        yandex={"account_bandwidth": 4 << 20},
+        warm_up=4
+    ),
+    "progress": Scenario(
+        '4 files of 16 MB downloading at 8 MB/s, 2 workers, progress after '
+        '1 s, edited every 2 s',
+        {f'{LINK}progress': _files(4, 16 << 20)},
+        [(f'{LINK}progress', f'/file{i:0>3}.bin', False) for i in range(4)],
+        config={"workers": 2, "progress_delay": 1, "progress_interval": 2},
+        yandex={"account_bandwidth": 8 << 20}
+    ),
+    "cancel": Scenario(
+        '4 files of 32 MB downloading at 8 MB/s, 2 workers, a running and '
+        'a queued job are cancelled after 2 s',
+        {f'{LINK}cancel': _files(4, 32 << 20)},
+        [(f'{LINK}cancel', f'/file{i:0>3}.bin', False) for i in range(4)],
+        config={"workers": 2},
+        yandex={"account_bandwidth": 8 << 20},
+        cancel_after=2
+    ),
+    "damaged": Scenario(
+        '3 files of 8 MB and one of 64 KB, downloads are damaged: one is '
+        'corrupted, one is truncated, one is corrupted twice, the small one '
+        'is truncated',
+        {f'{LINK}damaged': {**_files(3, 8 << 20), "small.bin": 64 << 10}},
+        [(f'{LINK}damaged', f'/file{i:0>3}.bin', False) for i in range(3)]
+        + [(f'{LINK}damaged', '/small.bin', False)],
+        config={"workers": 3, "retry_base_delay": 0.5},
+        yandex={"damage": {
+            '/file000.bin': ['corrupt'],
+            '/file001.bin': ['truncate'],
+            '/file002.bin': ['corrupt', 'corrupt'],
+            '/small.bin': ['truncate']
+        }},
+        verify=True
+    ),
+    "damaged-folder": Scenario(
+        'Folder with 4 files of 4 MB, downloads are damaged: one is '
+        'corrupted, one is truncated',
+        {f'{LINK}damaged-folder': {"dir": _files(4, 4 << 20)}},
+        [(f'{LINK}damaged-folder', '/', True)],
+        config={"retry_base_delay": 0.5},
+        yandex={"damage": {
+            '/dir/file000.bin': ['corrupt'],
+            '/dir/file001.bin': ['truncate']
+        }}
+    ),
+    **{
+        name: Scenario(
+            '4 files of 2 MB requested twice, then again after the cache is '
+            f'emptied, 1 worker, {description}',
+            {f'{LINK}popular': _files(4, 2 << 20)},
+            [(f'{LINK}popular', f'/file{i // 2:0>3}.bin', False)
+             for i in range(8)],
+            rounds=2,
+            config=config,
+            pause=8,
+            evict=True
+        )
+        for name, description, config in (
+            ('warming', 'cache warming', {"warm_chat_id": 1, "warm_interval": 1}),
+            ('warming-off', 'no warming', {})
+        )
+    }
+}
+
+
+def load_config(overrides: dict) -> dict:
+    with open(os.path.join(ROOT, 'config', 'config.json')) as f:
+        config: dict = json.load(f)
+
+    for key in ('log_level', 'server_path', 'server_ready_timeout',
+                'metrics_port', 'admins', 'metadata_ttl', 'prefetch_rate',
+                'index_rate', 'index_ttl'):
+        config.pop(key, None)
+    config.update({"db_path": 'data/stats.db'})
+    config.update(overrides)
+
+    return config
+
+
+def child(name: str, job_delay: float | None):
+    """Runs the scenario in the current working directory.
+
+    Stand-ins are run by the parent process, their URLs are passed in the
+    environment before the bot modules are imported."""
+    import resource
+    from threading import Thread, Event
+
+    import bot
+    from jobs import Job, JobQueue
+    from storage import _size
+    from volumes import VolumePlanner
+    from workers import CACHE, VERIFIED, Workers
+
+    scenario: Scenario = SCENARIOS[name]
+    config: dict = load_config(scenario.config)
+    if job_delay is not None:
+        config["job_delay"] = job_delay
+
+    requests: JobQueue = JobQueue()
+    volumes: VolumePlanner = VolumePlanner(
+        config.pop("local_server", True),
+        config.pop("max_upload_time", 240),
+        config.pop("volume_size", None)
+    )
+
+    yd_bot: bot.YDBot = bot.YDBot('123456:benchmark', requests, volumes)
+    Thread(target=bot.loop.run_forever, daemon=True).start()
+
+    def create_workers(queue: JobQueue) -> Workers:
+        return Workers(
+            download_requests=queue,
+            token=[f'bench-{i}' for i in range(scenario.accounts)],
+            volumes=volumes, bot=yd_bot, **config
+        )
+
+    workers: Workers = create_workers(requests)
+
+    peak_disk: list[int] = [0]
+    done: Event = Event()
+
+    def sample_disk():
+        while not done.wait(0.05):
+            peak_disk[0] = max(peak_disk[0], _size('temp'))
+
+    Thread(target=sample_disk, daemon=True).start()
+    workers.start()
+
+    enqueued: dict[int: float] = {}
+    etas: dict[int: float | None] = {}
+    cancelled: list[Job] = []
+    shutdown: float | None = None
+    start: float = time.time()
+    for round_number in range(scenario.rounds):
+        if round_number:
+            if scenario.evict:
+                for key in list(workers.cache):
+                    del workers.cache[key]
+            time.sleep(scenario.pause)
+
+        for i, (public_key, path, is_dir) in enumerate(scenario.jobs):
+            user_id: int = 1000 * (round_number + 1) + i
+            if i == scenario.warm_up > 0:
+                requests.join()
+            enqueued[user_id] = time.time()
+            job: Job = Job(
+                user_id, public_key, path,
+                0 if is_dir else _find(scenario.trees[public_key], path),
+                is_dir
+            )
+            requests.put(job)
+            etas[user_id] = requests.position(job)[1]
+            if i % 2 and scenario.cancel_after is not None and round_number == 0:
+                cancelled.append(job)
+
+        cancel_times: list[float] = []
+        if cancelled:
+            time.sleep(scenario.cancel_after)
+            for job in cancelled:
+                requests.cancel(job.id, job.user_id)
+                del enqueued[job.user_id]
+            # Until jobs are forgotten and their files are removed
+            while cancelled:
+                for job in list(cancelled):
+                    if (job.id not in requests.registry.jobs
+                            and not os.path.exists(f'temp{os.sep}{job.id}')):
+                        cancel_times.append(time.monotonic() - job.cancelled)
+                        cancelled.remove(job)
+                time.sleep(0.005)
+
+        if scenario.restart_after is not None and round_number == 0:
+            time.sleep(scenario.restart_after)
+            shutdown = workers.stop()
+            # Unfinished jobs are restored from the job store
+            requests = JobQueue()
+            workers = create_workers(requests)
+            workers.start()
+
+        requests.join()
+    wall: float = time.time() - start
+
+    done.set()
+    workers.stop()
+
+    print(RESULT_MARK + json.dumps({
+        "wall_s": wall,
+        "shutdown_s": shutdown,
+        "cancel_s": cancel_times,
+        "cache": {labels[0]: value for _, labels, value in CACHE.samples()},
+        "verified": {
+            labels[0]: value for _, labels, value in VERIFIED.samples()
+        },
+        "enqueued": enqueued,
+        "etas": etas,
+        "peak_rss_mb": resource.getrusage(
+            resource.RUSAGE_SELF
+        ).ru_maxrss / 1024,
+        "peak_disk_mb": peak_disk[0] / (1 << 20)
+    }), flush=True)
+
+
+def _find(tree: dict, path: str) -> int:
+    """:returns: Size of the file in the tree."""
+    for name in filter(None, path.split('/')):
+        tree = tree[name]
+
+    return tree
+
+
+def _fill_sizes(scenario: Scenario, yandex: FakeYandexDisk) -> int:
+    """:returns: Bytes requested in one round."""
+    total: int = 0
+
+    def size(node: int | dict) -> int:
+        return node if isinstance(node, int) else sum(map(size, node.values()))
+
+    for public_key, path, _ in scenario.jobs:
+        total += size(yandex.find(public_key, path))
+
+    return total
+
+
+def run(name: str, job_delay: float | None) -> dict:
+    scenario: Scenario = SCENARIOS[name]
+    yandex: FakeYandexDisk = FakeYandexDisk(
+        scenario.trees, **scenario.yandex
+    ).start()
+    bot_api: FakeBotAPI = FakeBotAPI(keep_content=scenario.verify).start()
+    sandbox: str = tempfile.mkdtemp(prefix='yadisk-benchmark-')
+
+    try:
+        for folder in ('config', 'logs', 'data', 'temp'):
+            os.makedirs(os.path.join(sandbox, folder))
+        with open(os.path.join(sandbox, 'config', 'tokens.json'), 'w') as f:
+            json.dump({"tg_token": '123456:benchmark', "ya_token": 'bench'}, f)
+
+        env: dict[str: str] = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(
+                filter(None, (ROOT, os.environ.get('PYTHONPATH')))
+            ),
+            YADISK_API_URL=yandex.api_url,
+            BOT_API_URL=bot_api.url
+        )
+        command: list[str] = [
+            sys.executable, '-m', 'benchmarks.suite', '--child', name
+        ]
+        if job_delay is not None:
+            command += ['--job-delay', str(job_delay)]
+
+        process = subprocess.run(
+            command, cwd=sandbox, env=env, capture_output=True, text=True
+        )
+        lines: list[str] = [
+            line for line in process.stdout.splitlines()
+            if line.startswith(RESULT_MARK)
+        ]
+        if process.returncode or not lines:
+            raise RuntimeError(
+                f'Scenario {name} failed:\n{process.stderr[-3000:]}'
+            )
+        result: dict = json.loads(lines[-1].removeprefix(RESULT_MARK))
+    finally:
+        yandex.stop()
+        bot_api.stop()
+        shutil.rmtree(sandbox, ignore_errors=True)
+
+    enqueued_times: dict[str: float] = result.pop("enqueued")
+    etas: dict[str: float | None] = result.pop("etas")
+    if result["shutdown_s"] is None:
+        del result["shutdown_s"]
+    cancel_times: list[float] = sorted(result.pop("cancel_s"))
+    if cancel_times:
+        result["cancel_p50_s"] = _percentile(cancel_times, 50)
+        result["cancel_max_s"] = cancel_times[-1]
+        # Copies in "Загрузки" left by downloads
+        result["leftover_copies"] = sum(map(len, yandex.disks.values()))
+    if scenario.verify:
+        result["corrupted"] = _verify(scenario, yandex, bot_api, enqueued_times)
+
+    cache: dict[str: float] = result.pop("cache")
+    if scenario.rounds > 1:
+        result["cache_hit_rate"] = (
+            cache.get('hit', 0) + cache.get('warmed', 0)
+        ) / (len(scenario.jobs) * scenario.rounds)
+        result["warmed_hits"] = cache.get('warmed', 0)
+
+    latencies: list[float] = []
+    eta_errors: list[float] = []
+    for user_id, enqueued in enqueued_times.items():
+        documents: list[tuple[float, dict]] = bot_api.documents.get(
+            int(user_id), []
+        )
+        if documents:
+            latency: float = documents[-1][0] - enqueued
+            latencies.append(latency)
+            if etas.get(user_id) is not None:
+                eta_errors.append(abs(etas[user_id] - latency) / latency)
+    latencies.sort()
+    eta_errors.sort()
+    if eta_errors:
+        result["eta_error_p50"] = _percentile(eta_errors, 50)
+        result["eta_error_p95"] = _percentile(eta_errors, 95)
+
+    size: int = _fill_sizes(scenario, yandex) * scenario.rounds
+    jobs: int = len(scenario.jobs) * scenario.rounds
+    result.update({
+        "jobs": jobs - len(cancel_times),
+        "delivered": len(latencies),
+        "throughput_jobs_s": jobs / result["wall_s"],
+        "throughput_mb_s": size / (1 << 20) / result["wall_s"],
+        "latency_p50_s": _percentile(latencies, 50),
+        "latency_p95_s": _percentile(latencies, 95),
+        "latency_p99_s": _percentile(latencies, 99),
+        "bot_api_calls": sum(
+            calls for method, calls in bot_api.calls.items()
+            if method not in ('getMe', 'getUpdates')
+        ),
+        "yandex_api_calls": sum(yandex.calls.values()),
+        "progress_edits": bot_api.calls["editMessageText"],
+        "size_mb": size / (1 << 20),
+        "downloaded_mb": yandex.downloaded / (1 << 20)
+    })
+
+    return result
+
+
+def _verify(scenario: Scenario, yandex: FakeYandexDisk, bot_api: FakeBotAPI,
+            user_ids: list[str]) -> int:
+    """:returns: Number of files users got with wrong contents."""
+    corrupted: int = 0
+
+    for user_id in map(int, user_ids):
+        public_key, path, _ = scenario.jobs[user_id % 1000]
+        data: bytes = b''.join(
+            bot_api.contents.get(info["file_id"], b'')
+            for _, info in bot_api.documents.get(user_id, [])
+        )
+
+        try:
+            with ZipFile(io.BytesIO(data)) as archive:
+                received: str = sha256(
+                    archive.read(path.split('/')[-1])
+                ).hexdigest()
+        except (KeyError, ValueError, OSError):
+            received = ''
+
+        size: int = yandex.find(public_key, path)
+        if received != file_hashes(public_key, path, size)[1]:
+            corrupted += 1
+
+    return corrupted
+
+
+def _percentile(values: list[float], percent: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+
+    return quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+def compare(results: dict[str: dict], baseline: dict[str: dict],
+            tolerance: float) -> list[str]:
+    """:returns: Descriptions of regressions."""
+    regressions: list[str] = []
+
+    for name, result in results.items():
+        for metric in REGRESSION_METRICS:
+            old: float | None = baseline.get(name, {}).get(metric)
+            new: float | None = result.get(metric)
+            if old and new is not None and new > old * (1 + tolerance):
+                regressions.append(f'{name}: {metric} {old:.2f} -> {new:.2f}')
+
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('scenarios', nargs='*',
+                        help=f'Scenarios to run (all by default): '
+                             f'{", ".join(SCENARIOS)}.')
+    parser.add_argument('--save', help='Save results to the JSON file.')
+    parser.add_argument('--baseline', help='Compare with saved results.')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--job-delay', type=float, default=None,
+                        help='Override "job_delay" of the config.')
+    parser.add_argument('--child', help='Internal: run the scenario here.')
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.child, args.job_delay)
+
+    unknown: set[str] = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    results: dict[str: dict] = {}
+    for name in args.scenarios or SCENARIOS:
+        print(f'{name}: {SCENARIOS[name].description}...', flush=True)
+        results[name] = run(name, args.job_delay)
+
+        result: dict = results[name]
+        print(
+            f'  {result["delivered"]}/{result["jobs"]} jobs in '
+            f'{result["wall_s"]:.1f} s '
+            f'({result["throughput_jobs_s"]:.2f} jobs/s, '
+            f'{result["throughput_mb_s"]:.1f} MB/s), latency '
+            f'p50 {result["latency_p50_s"]:.2f} s, '
+            f'p95 {result["latency_p95_s"]:.2f} s, '
+            f'p99 {result["latency_p99_s"]:.2f} s\n'
+            f'  peak RSS {result["peak_rss_mb"]:.0f} MB, '
+            f'peak disk {result["peak_disk_mb"]:.0f} MB, '
+            f'API calls: Bot {result["bot_api_calls"]}, '
+            f'Yandex {result["yandex_api_calls"]}, '
+            f'progress edits {result["progress_edits"]}'
+            + (f', corrupted files {result["corrupted"]}'
+               if "corrupted" in result else '')
+            + (f'\n  ETA error p50 {result["eta_error_p50"]:.0%}, '
+               f'p95 {result["eta_error_p95"]:.0%}'
+               if "eta_error_p50" in result else '')
+            + (f'\n  shutdown {result["shutdown_s"]:.2f} s, downloaded '
+               f'{result["downloaded_mb"]:.0f} of {result["size_mb"]:.0f} MB'
+               if "shutdown_s" in result else '')
+            + (f'\n  cancelled in p50 {result["cancel_p50_s"] * 1e3:.0f} ms, '
+               f'max {result["cancel_max_s"] * 1e3:.0f} ms, downloaded '
+               f'{result["downloaded_mb"]:.0f} of {result["size_mb"]:.0f} MB, '
+               f'{result["leftover_copies"]} copies left on Yandex Disk'
+               if "cancel_p50_s" in result else '')
+            + (f'\n  downloaded {result["downloaded_mb"]:.0f} of '
+               f'{result["size_mb"]:.0f} MB'
+               if "faults" in SCENARIOS[name].yandex else '')
+            + ('\n  downloads: ' + ', '.join(
+                f'{count:.0f} {label}'
+                for label, count in sorted(result["verified"].items())
+            ) if "damage" in SCENARIOS[name].yandex else '')
+            + (f'\n  cache hit rate {result["cache_hit_rate"]:.0%}, '
+               f'{result["warmed_hits"]:.0f} hits on warmed entries'
+               if "cache_hit_rate" in result else ''),
+            flush=True
+        )
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions: list[str] = compare(
+                results, json.load(f), args.tolerance
+            )
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
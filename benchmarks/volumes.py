@@ -0,0 +1,53 @@
+"""Compares static 50 MB volumes with the volume planner.
+
+Upload time is modeled as a fixed per-request overhead plus transfer time
+at the given throughput. Run from the repository root:
+
+    python -m benchmarks.volumes
+"""
+import os
+from argparse import ArgumentParser
+
+os.makedirs('logs', exist_ok=True)
+
+from volumes import VolumePlanner  # noqa: E402
+
+SIZES: tuple[int, ...] = (
+    20_000_000, 300_000_000, 1_000_000_000, 5_000_000_000, 9_500_000_000
+)
+
+
+def upload_time(size: int, parts: int, throughput: float,
+                overhead: float) -> float:
+    return parts * overhead + size / throughput
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--throughput', type=float, default=10.0,
+                        help='Upload throughput, MB/s.')
+    parser.add_argument('--overhead', type=float, default=1.5,
+                        help='Per-request overhead, s.')
+    args = parser.parse_args()
+    throughput: float = args.throughput * 1e6
+
+    static = VolumePlanner(local_server=False)
+    planner = VolumePlanner(local_server=True)
+    planner.observe(int(throughput * 100), 100.0)
+
+    print(f'{"size":>10} | {"static parts":>12} {"time, s":>9} | '
+          f'{"planned parts":>13} {"time, s":>9}')
+    for size in SIZES:
+        static_parts: int = static.parts(size)
+        planned_parts: int = planner.parts(size)
+        print(
+            f'{size / 1e6:>8.0f}MB | '
+            f'{static_parts:>12} '
+            f'{upload_time(size, static_parts, throughput, args.overhead):>9.1f} | '
+            f'{planned_parts:>13} '
+            f'{upload_time(size, planned_parts, throughput, args.overhead):>9.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
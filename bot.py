@@ -1,32 +1,54 @@
-import logging
 import os
-from asyncio import get_event_loop, run_coroutine_threadsafe
-from logging.handlers import TimedRotatingFileHandler
-from queue import Queue
+import time
+from asyncio import (
+    AbstractEventLoop, Future, Task, get_event_loop, run_coroutine_threadsafe,
+    sleep
+)
+from concurrent import futures
+from threading import Lock
+from typing import Callable
+from html import escape
+from io import BytesIO
 
 from aiogram import Bot, Dispatcher, executor, types
 from aiogram.bot.api import TelegramAPIServer
 from aiogram.contrib.fsm_storage.files import JSONStorage
+from aiogram.utils.exceptions import TelegramAPIError
 
-import tokens
-from yadisk_api import YDResource
+import log
+import metrics
+from jobs import Job, JobQueue, JobRegistry
+from profiling import MAX_DURATION, Profile, ProfilerBusy
+from search import NameIndex, NameIndexes
+from supervisor import SERVER
+from volumes import VolumePlanner
+from yadisk_api import MetadataStore, YDResource
 
-logger = logging.getLogger(__name__)
-handler = TimedRotatingFileHandler(
-    filename='logs/bot.log',
-    when='midnight'
-)
-handler.setFormatter(
-    logging.Formatter(
-        '[%(asctime)s] [%(levelname)s] "%(message)s"',
-        datefmt='%d.%m.%Y %H:%M:%S'
-    )
-)
-handler.setLevel(logging.DEBUG)
-logger.addHandler(handler)
+logger = log.get_logger(__name__)
 
 loop = get_event_loop()
 
+MEDIA_GROUP_SIZE: int = 10
+# Results of /find shown, seconds a new index is waited for
+FOUND: int = 10
+FIND_WAIT: float = 2.0
+
+# Phases of jobs shown to users
+PHASES: dict[str: str] = {
+    "download": 'downloading',
+    "compress": 'compressing',
+    "split": 'splitting into parts',
+    "upload": 'uploading'
+}
+
+EDITS: metrics.Counter = metrics.counter(
+    'progress_messages_total', 'Bot API calls of progress messages.',
+    ('method',)
+)
+GOTO: metrics.Histogram = metrics.histogram(
+    'menu_goto_seconds', 'Time to open a folder in the file menu.'
+)
+
 
 def _format_size(size: int):
     if size > 1 << 30:
@@ -39,14 +61,40 @@ def _format_size(size: int):
         return f'{size} B'
 
 
+def _cancel_button(job: Job) -> types.InlineKeyboardMarkup:
+    return types.InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                types.InlineKeyboardButton(
+                    '❌ Cancel',
+                    callback_data=f'job:x:{job.id}'
+                )
+            ]
+        ]
+    )
+
+
+def _format_time(seconds: float) -> str:
+    if seconds < 60:
+        return 'less than a minute'
+    elif seconds < 3600:
+        return f'about {round(seconds / 60)} min'
+    else:
+        return f'about {seconds / 3600:.1f} h'
+
+
 class FileMenu:
     def __init__(self, dp: Dispatcher, user_id: int, resource: YDResource,
-                 vol_size: int,
-                 rows_on_page: int = 5, download_requests: Queue = Queue()):
-        self.VOL_SIZE = vol_size
+                 volumes: VolumePlanner,
+                 rows_on_page: int = 5, download_requests: JobQueue = JobQueue()):
+        self.volumes: VolumePlanner = volumes
         self.resource: YDResource = resource
         self.page: int = 0
         self.rows: int = rows_on_page
+        self._prefetching: list[futures.Future] = []
+        # Paths and sizes found by the last search and the number of searches
+        self.found: list[tuple[str, int | None]] = []
+        self.searches: int = 0
 
         async def menu_handler(q: types.CallbackQuery):
             command: str = q.data.removeprefix('fm:').split(':')[0]
@@ -69,13 +117,21 @@ class FileMenu:
                             return await self.ask_download(q)
                         case '??':
                             return await self.ask_download(q, True)
+                        case 'd?':
+                            return await self.ask_download(q, is_dir=True)
                         case '.':
                             await self.accept_download(q, download_requests)
                             return await self.close(q.message, dp)
+                        case 'd.':
+                            await self.accept_download(q, download_requests,
+                                                       True)
+                            return await self.close(q.message, dp)
                         case 'i':
                             return await self.show_info(q.message)
                         case _:
                             return None
+                case 'fd':
+                    return await self.download_found(q, download_requests)
 
                 case 'x':
                     sub_command: str = q.data.removeprefix('fm:x:'
@@ -126,15 +182,15 @@ class FileMenu:
                 icon: str
                 data: str
 
-                if info < self.VOL_SIZE:
+                if info >= 10_000_000_000:
+                    icon = '⚠️'
+                    data = 'fm:dl:i'
+                elif not self.volumes.is_split(info):
                     icon = '📄'
                     data = f'fm:dl:?:{index}'
-                elif info < 10_000_000_000:
+                else:
                     icon = '📑'
                     data = f'fm:dl:??:{index}'
-                else:
-                    icon = '⚠️'
-                    data = 'fm:dl:i'
 
                 rows.append(
                     [
@@ -150,6 +206,10 @@ class FileMenu:
                         types.InlineKeyboardButton(
                             text=f'📁 {name}',
                             callback_data=f'fm:gt:{index}'
+                        ),
+                        types.InlineKeyboardButton(
+                            text='📦',
+                            callback_data=f'fm:dl:d?:{index}'
                         )
                     ]
                 )
@@ -194,11 +254,26 @@ class FileMenu:
         return await self.update_message(q.message)
 
     async def update_message(self, msg: types.Message):
+        rows: list[list[types.InlineKeyboardButton]] = self.get_rows()
+        self.prefetch()
+
         return await msg.edit_text(
             f'Path: {self.resource.name}{self.resource.cwd}',
-            reply_markup=types.InlineKeyboardMarkup(
-                inline_keyboard=self.get_rows()
-            )
+            reply_markup=types.InlineKeyboardMarkup(inline_keyboard=rows)
+        )
+
+    def prefetch(self):
+        """Listings of folders on this and the next page are requested in
+        the background, users usually open one of them."""
+        items: tuple[tuple[str, int | dict], ...] = tuple(
+            self.resource.ll().items()
+        )[self.page * self.rows:(self.page + 2) * self.rows]
+
+        self._prefetching = [
+            future for future in self._prefetching if not future.done()
+        ] + self.resource.prefetch(
+            # Not listed yet
+            name for name, info in items if info == {}
         )
 
     async def up(self, q: types.CallbackQuery):
@@ -206,15 +281,25 @@ class FileMenu:
 
         return await self.update_message(q.message)
 
+    def stop_prefetching(self):
+        for future in self._prefetching:
+            future.cancel()
+        self._prefetching = []
+
     async def goto(self, q: types.CallbackQuery):
+        start: float = time.perf_counter()
         location: str = self.resource[int(q.data.split(':')[-1])]
 
         self.resource.goto(location)
         self.page = 0
 
-        return await self.update_message(q.message)
+        try:
+            return await self.update_message(q.message)
+        finally:
+            GOTO.observe(time.perf_counter() - start)
 
-    async def ask_download(self, q: types.CallbackQuery, warn_size: bool = False):
+    async def ask_download(self, q: types.CallbackQuery,
+                           warn_size: bool = False, is_dir: bool = False):
         index: int = int(q.data.split(':')[-1])
         file: str = self.resource[index]
         if file not in self.resource.ll():
@@ -227,11 +312,17 @@ class FileMenu:
 
         msg: str = (
             'Are you sure you want to download '
+            f'{"the folder " if is_dir else ""}'
             f'{self.resource.name}{self.resource.cwd}/{file}?\n'
-            f'It is impossible to cancel it.'
+            f'It can be cancelled until the files are sent.'
         )
 
-        if warn_size:
+        if is_dir:
+            msg += (
+                '\nAll files of the folder will be put into one archive, '
+                'which can be split into several parts.'
+            )
+        elif warn_size:
             msg += (
                 '\n⚠️ Due to telegram limitations on file upload size, '
                 'it can be split into several archives.'
@@ -244,7 +335,7 @@ class FileMenu:
                     [
                         types.InlineKeyboardButton(
                             '✅',
-                            callback_data=f'fm:dl:.:{index}'
+                            callback_data=f'fm:dl:{"d" if is_dir else ""}.:{index}'
                         ),
                         types.InlineKeyboardButton(
                             '❌',
@@ -257,18 +348,70 @@ class FileMenu:
 
     async def accept_download(self,
                               q: types.CallbackQuery,
-                              download_requests: Queue):
-        path: str = (
-            f'{self.resource.cwd}/'
-            f'{self.resource[(int(q.data.split(":")[-1]))]}'
+                              download_requests: JobQueue,
+                              is_dir: bool = False):
+        name: str = self.resource[(int(q.data.split(":")[-1]))]
+        path: str = f'{self.resource.cwd}/{name}'
+        size: int = self.resource.ll()[name] if not is_dir else 0
+
+        return await self._enqueue(q, download_requests, path, size, is_dir)
+
+    def found_rows(self) -> list[list[types.InlineKeyboardButton]]:
+        """:returns: Buttons to download found files and folders."""
+        rows: list[list[types.InlineKeyboardButton]] = []
+        for i, (path, size) in enumerate(self.found):
+            if size is None:
+                text: str = f'📦 {path}'
+            elif size >= 10_000_000_000:
+                rows.append([
+                    types.InlineKeyboardButton(
+                        text=f'⚠️ [{_format_size(size)}] {path}',
+                        callback_data='fm:dl:i'
+                    )
+                ])
+                continue
+            else:
+                text = f'📄 [{_format_size(size)}] {path}'
+
+            rows.append([
+                types.InlineKeyboardButton(
+                    text=text, callback_data=f'fm:fd:{self.searches}:{i}'
+                )
+            ])
+
+        return rows
+
+    async def download_found(self, q: types.CallbackQuery,
+                             download_requests: JobQueue):
+        search, i = map(int, q.data.removeprefix('fm:fd:').split(':'))
+        if search != self.searches:
+            return await q.answer(
+                'The results are outdated, please search again.',
+                show_alert=True
+            )
+
+        path, size = self.found[i]
+        return await self._enqueue(
+            q, download_requests, path, size or 0, size is None
         )
 
-        download_requests.put((q.from_user.id, self.resource.public_key, path))
+    async def _enqueue(self, q: types.CallbackQuery,
+                       download_requests: JobQueue, path: str, size: int,
+                       is_dir: bool):
+        job: Job = Job(
+            q.from_user.id, self.resource.public_key, path, size, is_dir
+        )
+        download_requests.put(job)
+        position, eta = download_requests.position(job)
 
         return await q.message.reply(
-            'Your request was putted in the queue.\n'
-            f'Your approximate position is: {download_requests.qsize() + 1}',
-            reply=False
+            'Your request was put in the queue.\n'
+            + (f'Your position is: {position}' if position else
+               'Downloading has started')
+            + (f', it should be ready in {_format_time(eta)}.'
+               if eta is not None else '.'),
+            reply=False,
+            reply_markup=_cancel_button(job)
         )
 
     @staticmethod
@@ -309,6 +452,7 @@ class FileMenu:
 
     async def close(self, msg: types.Message, dp: Dispatcher):
         dp.callback_query_handlers.unregister(self.handler)
+        self.stop_prefetching()
         await dp.current_state().set_state('idle')
 
         return await msg.edit_text(
@@ -318,21 +462,45 @@ class FileMenu:
 
 class YDBot:
     def __init__(self,
-                 token: str, download_requests: Queue = Queue(),
-                 vol_size: int = 1_983_000):
+                 token: str, download_requests: JobQueue = None,
+                 volumes: VolumePlanner = None,
+                 admins: list[int] = (),
+                 metadata: MetadataStore = None,
+                 indexes: NameIndexes = None):
+        # Defaults are created here, not on import
+        if download_requests is None:
+            download_requests = JobQueue()
+        if volumes is None:
+            volumes = VolumePlanner()
+
         self.bot = Bot(
             token=token,
-            server=TelegramAPIServer.from_base('http://localhost:8081')
+            server=TelegramAPIServer.from_base(SERVER)
         )
         self.dp = Dispatcher(
             self.bot,
             storage=JSONStorage(f'data{os.sep}users.json')
         )
 
-        self.download_requests: Queue = download_requests
+        self.download_requests: JobQueue = download_requests
+        self.metadata: MetadataStore = (
+            MetadataStore() if metadata is None else metadata
+        )
+        self.indexes: NameIndexes = (
+            NameIndexes() if indexes is None else indexes
+        )
 
         self.menu_handlers: dict[int: FileMenu] = {}
 
+        self.admins: frozenset[int] = frozenset(admins)
+        self._profiling: Task | None = None
+
+        @self.dp.callback_query_handler(
+            lambda q: q.data.startswith('job:x:'), state='*'
+        )
+        async def cancel_handler(q: types.CallbackQuery):
+            return await self.cancel(q)
+
         @self.dp.message_handler(state='*')
         async def message_handler(msg: types.Message):
             if await self.dp.current_state().get_state() == 'feedback':
@@ -342,7 +510,9 @@ class YDBot:
                 case '/start':
                     return await self.start(msg)
                 case '/fetch':
-                    return await self.fetch(msg, vol_size)
+                    return await self.fetch(msg, volumes)
+                case '/find':
+                    return await self.find(msg)
                 case '/commands':
                     return await self.commands(msg)
                 case '/about':
@@ -351,6 +521,10 @@ class YDBot:
                     return await self.help(msg)
                 case '/feedback':
                     return await self.feedback(msg)
+                case '/profile' if msg.from_user.id in self.admins:
+                    return await self.profile(msg)
+                case '/status' if msg.from_user.id in self.admins:
+                    return await self.status(msg)
                 case _:
                     return await msg.reply('Use /commands for commands.')
 
@@ -377,7 +551,7 @@ class YDBot:
                 if msg.from_user.id in self.menu_handlers:
                     try:
                         self.dp.callback_query_handlers.unregister(
-                            self.menu_handlers.pop(msg.from_user.id, None)
+                            self.menu_handlers.pop(msg.from_user.id).handler
                         )
                     except ValueError:
                         logger.warning('Unregistering error.')
@@ -392,7 +566,7 @@ class YDBot:
 
         return await self.dp.current_state().set_state('idle')
 
-    async def fetch(self, msg: types.Message, vol_size: int):
+    async def fetch(self, msg: types.Message, volumes: VolumePlanner):
         match await self.dp.current_state().get_state():
             case 'browsing':
                 return await msg.reply(
@@ -420,13 +594,13 @@ class YDBot:
                 fm = FileMenu(
                     self.dp,
                     msg.from_user.id,
-                    YDResource(link),
-                    vol_size,
+                    YDResource(link, self.metadata),
+                    volumes,
                     5,
                     self.download_requests
                 )
 
-                self.menu_handlers[msg.from_id] = fm.handler
+                self.menu_handlers[msg.from_id] = fm
 
                 await fm.update_message(bot_msg)
                 return await self.dp.current_state().set_state('browsing')
@@ -438,11 +612,58 @@ class YDBot:
                     'Something went wrong... Please restart the bot: /start.'
                 )
 
+    async def find(self, msg: types.Message):
+        """``/find <pattern>``: searches names in the whole tree of the
+        opened link."""
+        menu: FileMenu | None = self.menu_handlers.get(msg.from_user.id)
+        if (
+                await self.dp.current_state().get_state() != 'browsing'
+                or menu is None
+        ):
+            return await msg.reply('Open a link with /fetch to search in it.')
+
+        pattern: str = msg.get_args().strip()
+        if not pattern:
+            return await msg.reply(
+                'Usage: /find <part of a name>, or a name with wildcards '
+                '(/find *.pdf).'
+            )
+
+        index: NameIndex = self.indexes.get(menu.resource.public_key)
+        waited: float = 0.0
+        while not index.done and waited < FIND_WAIT:
+            await sleep(0.1)
+            waited += 0.1
+
+        menu.found = index.find(pattern, FOUND)
+        menu.searches += 1
+
+        text: str = (
+            f'Found in {menu.resource.name}:' if menu.found
+            else 'Nothing is found.'
+        )
+        if not index.done:
+            text += (
+                f'\nIndexing: {len(index)} files and folders so far, '
+                f'{index.pending()} folders are left. Search again later '
+                'to find more.'
+            )
+        elif index.error:
+            text += '\nNot all folders could be indexed.'
+
+        return await msg.reply(
+            text,
+            reply_markup=types.InlineKeyboardMarkup(
+                inline_keyboard=menu.found_rows()
+            ) if menu.found else None
+        )
+
     @staticmethod
     async def commands(msg: types.Message):
         return await msg.reply(
             '/start - Start the bot.\n'
             '/fetch <link> - Get file (pass link without <>).\n'
+            '/find <name> - Find files in the opened link.\n'
             '/help - How to join split files?\n'
             '/about - Show info about the bot.\n'
             '/commands - Show this message.\n'
@@ -480,6 +701,108 @@ class YDBot:
             disable_web_page_preview=True
         )
 
+    async def cancel(self, q: types.CallbackQuery):
+        job: Job | None = self.download_requests.cancel(
+            q.data.removeprefix('job:x:'), q.from_user.id
+        )
+        if job is None:
+            await q.answer('It is already done.')
+            return await q.message.edit_reply_markup()
+
+        await q.answer('Cancelled.')
+        try:
+            return await q.message.edit_text(f'"{job.name}" is cancelled.')
+        except TelegramAPIError as e:
+            # The progress message may be deleted meanwhile
+            logger.debug(f'The message of cancelled {job} isn\'t edited: {e}')
+
+    async def status(self, msg: types.Message):
+        """``/status``: queue and jobs of workers (admins only)."""
+        registry: JobRegistry = self.download_requests.registry
+        with self.download_requests.mutex:
+            queued: list[Job] = list(self.download_requests.queue)
+        running: list[Job] = registry.running()
+        now: float = time.time()
+
+        lines: list[str] = [
+            f'Queue: {len(queued)} jobs '
+            f'({_format_size(sum(job.size for job in queued))}), '
+            f'{max(0, len(registry.jobs) - len(queued) - len(running))} '
+            f'put aside.',
+            'Download speed: '
+            + (f'{_format_size(round(registry.speed))}/s' if registry.speed
+               else '?')
+            + ', other phases: '
+            + (f'{registry.overhead:.1f} s' if registry.overhead is not None
+               else '?')
+            + ' per job.'
+        ]
+        eta: float | None = (
+            registry.eta(queued[-1], queued[:-1]) if queued else None
+        )
+        if eta is not None:
+            lines.append(f'The queue is done in {_format_time(eta)}.')
+
+        jobs: dict[str: Job] = {job.worker: job for job in running}
+        for worker in registry.workers:
+            job: Job | None = jobs.get(worker)
+            if job is None or job.started is None:
+                lines.append(f'{worker}: idle')
+                continue
+
+            lines.append(
+                f'{worker}: {job.name} ({job.state}, '
+                f'{_format_size(job.done)} of {_format_size(job.size)}, '
+                f'{_format_size(round(job.done / max(now - job.started, 1e-3)))}/s, '
+                f'{_format_time(registry.remaining(job, now))} left)'
+            )
+
+        return await msg.reply('\n'.join(lines))
+
+    async def profile(self, msg: types.Message):
+        """``/profile [seconds] [memory]``: profiles the bot and sends the
+        report and stacks for flame graphs (admins only)."""
+        arguments: list[str] = msg.text.split()[1:]
+        try:
+            duration: float = float(arguments[0]) if arguments else 30.0
+        except ValueError:
+            return await msg.reply('Usage: /profile [seconds] [memory]')
+        duration = max(1.0, min(duration, MAX_DURATION))
+
+        profile: Profile = Profile(memory='memory' in arguments[1:])
+        try:
+            profile.start()
+        except ProfilerBusy:
+            return await msg.reply('Profiling is already running.')
+
+        # Updates are handled one by one, so the profile runs on its own
+        self._profiling = loop.create_task(
+            self._send_profile(msg.chat.id, profile, duration)
+        )
+
+        return await msg.reply(f'Profiling for {duration:.0f} s...')
+
+    async def _send_profile(self, chat_id: int, profile: Profile,
+                            duration: float):
+        try:
+            await sleep(duration)
+        finally:
+            report: str = await loop.run_in_executor(None, profile.stop)
+
+        await self.bot.send_message(
+            chat_id,
+            f'<pre>{escape(report[:4000])}</pre>',
+            parse_mode='HTML'
+        )
+        await self.bot.send_document(
+            chat_id,
+            types.InputFile(
+                BytesIO(profile.folded().encode()),
+                filename=time.strftime('profile-%Y%m%d-%H%M%S.folded')
+            ),
+            caption='Stacks for flamegraph.pl or speedscope.app'
+        )
+
     def send_message(self, user_id: int, text: str) -> None:
         run_coroutine_threadsafe(
             self.bot.send_message(
@@ -488,35 +811,60 @@ class YDBot:
             loop
         )
 
-    def send_files(self, user_id: int, files: list[str]) -> list[str, ...]:
+    def send_files(self, user_id: int, files: list[str | types.InputFile],
+                   on_sent: Callable[[int], None] = None) -> list[str, ...]:
+        """:param on_sent: Called with the number of sent files. Users
+            aren't told about the upload then (progress is reported)."""
         async def _send_files() -> list[str]:
             file_ids: list[str] = []
             filenames: list[str] = []
+            api_calls: int = 0
+            start_time: float = time.monotonic()
 
-            await self.bot.send_message(
-                user_id,
-                'Uploading files...'
-            )
+            if on_sent is None and any(
+                    isinstance(file, types.InputFile) or os.path.exists(file)
+                    for file in files
+            ):
+                await self.bot.send_message(
+                    user_id,
+                    'Uploading files...'
+                )
+                api_calls += 1
 
             logger.debug(f'Started files uploading ({files})...')
 
-            for file in files:
-                logger.debug(f'Sending {file}...')
+            if len(files) == 1:
                 document: types.Document = (
                     await self.bot.send_document(
                         user_id,
-                        types.InputFile(file) if os.path.exists(file) else file
+                        _input_file(files[0])
                     )
                 ).document
+                api_calls += 1
+
                 file_ids.append(document.file_id)
                 filenames.append(document.file_name)
+                if on_sent is not None:
+                    on_sent(len(file_ids))
+            else:
+                for group in _split_groups(files, MEDIA_GROUP_SIZE):
+                    logger.debug(f'Sending {group}...')
 
-            logger.info(f'Files sent ({files}).')
+                    media = types.MediaGroup()
+                    for file in group:
+                        media.attach_document(_input_file(file))
+
+                    messages: list[types.Message] = (
+                        await self.bot.send_media_group(user_id, media)
+                    )
+                    api_calls += 1
+
+                    for message in messages:
+                        file_ids.append(message.document.file_id)
+                        filenames.append(message.document.file_name)
+                    if on_sent is not None:
+                        on_sent(len(file_ids))
 
-            await self.bot.send_message(
-                user_id,
-                'Done!'
-            )
             if len(filenames) > 1:
                 original_name: str = filenames[0][:-7]  # .part01
                 await self.bot.send_message(
@@ -528,6 +876,12 @@ class YDBot:
                     'For more info: /help.',
                     parse_mode='Markdown'
                 )
+                api_calls += 1
+
+            logger.info(
+                f'Files sent ({files}): {api_calls} API calls, '
+                f'{time.monotonic() - start_time:.1f} s.'
+            )
 
             await self.dp.current_state(user=user_id).set_state('idle')
 
@@ -559,6 +913,190 @@ class YDBot:
                 )
 
 
+class ProgressReporter:
+    """One message per job, which is edited with its progress.
+
+    Workers only change jobs, messages are sent from the event loop every
+    ``interval`` seconds. Jobs shorter than ``delay`` get no message, a
+    chat gets at most one call per ``chat_interval`` seconds (jobs of a
+    chat take turns), and there are at most ``rate`` calls per second."""
+
+    def __init__(self, bot: Bot, loop: AbstractEventLoop,
+                 registry: JobRegistry, interval: float = 1.0,
+                 delay: float = 10.0, chat_interval: float = 5.0,
+                 rate: float = 10.0):
+        self.bot: Bot = bot
+        self.loop: AbstractEventLoop = loop
+        self.registry: JobRegistry = registry
+        self.INTERVAL: float = float(interval)
+        self.DELAY: float = float(delay)
+        self.CHAT_INTERVAL: float = float(chat_interval)
+        self.RATE: float = float(rate)
+
+        self._lock: Lock = Lock()
+        self._jobs: dict[str: Job] = {}
+        # Job ID: [message ID, text]
+        self._messages: dict[str: list] = {}
+        self._finished: list[Job] = []
+        self._chats: dict[int: float] = {}
+        self._task: Future | None = None
+
+    def start(self):
+        self._task = run_coroutine_threadsafe(self._run(), self.loop)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def track(self, job: Job):
+        with self._lock:
+            self._jobs[job.id] = job
+
+    def finish(self, job: Job):
+        """The message of the job is deleted."""
+        with self._lock:
+            if self._jobs.pop(job.id, None) is not None:
+                self._finished.append(job)
+
+    async def _run(self):
+        while True:
+            await sleep(self.INTERVAL)
+            try:
+                await self._report()
+            except Exception as e:
+                logger.error(f'Progress is not reported: {e}', exc_info=e)
+
+    async def _report(self):
+        now: float = time.monotonic()
+        with self._lock:
+            finished: list[Job] = self._finished
+            self._finished = []
+            jobs: list[Job] = sorted(
+                (
+                    job for job in self._jobs.values()
+                    if job.started is not None
+                    and time.time() - job.started >= self.DELAY
+                ),
+                # Jobs not reported for the longest go first
+                key=lambda job: self._chats.get(job.user_id, 0.0)
+            )
+
+        budget: int = max(1, round(self.RATE * self.INTERVAL))
+        for job in finished:
+            message: list | None = self._messages.pop(job.id, None)
+            if message is not None:
+                budget -= 1
+                await self._call(
+                    'deleteMessage',
+                    self.bot.delete_message(job.user_id, message[0])
+                )
+
+        for job in jobs:
+            if budget <= 0:
+                break
+            if now - self._chats.get(job.user_id, 0.0) < self.CHAT_INTERVAL:
+                continue
+
+            text: str = self.text(job)
+            message = self._messages.get(job.id)
+            if message is not None and message[1] == text:
+                continue
+
+            budget -= 1
+            self._chats[job.user_id] = now
+            if message is None:
+                sent = await self._call(
+                    'sendMessage',
+                    self.bot.send_message(
+                        job.user_id, text, reply_markup=_cancel_button(job)
+                    )
+                )
+                if sent is not None:
+                    self._messages[job.id] = [sent.message_id, text]
+            else:
+                message[1] = text
+                await self._call(
+                    'editMessageText',
+                    self.bot.edit_message_text(
+                        text, job.user_id, message[0],
+                        reply_markup=_cancel_button(job)
+                    )
+                )
+
+        # Chats without jobs are forgotten
+        for chat in [
+            chat for chat, reported in self._chats.items()
+            if now - reported > self.CHAT_INTERVAL
+        ]:
+            del self._chats[chat]
+
+    async def _call(self, method: str, call):
+        EDITS.inc(method)
+        try:
+            return await call
+        except TelegramAPIError as e:
+            logger.warning(f'{method} of a progress message failed: {e}')
+            return None
+
+    def text(self, job: Job) -> str:
+        phase: str = PHASES.get(job.state, 'preparing')
+        details: list[str] = []
+
+        match job.state:
+            case 'download' if job.size:
+                details.append(
+                    f'{job.done / job.size:.0%} of {_format_size(job.size)}'
+                )
+                elapsed: float = time.time() - (job.started or time.time())
+                if elapsed > 0:
+                    details.append(
+                        f'{_format_size(round(job.done / elapsed))}/s'
+                    )
+            case 'compress' | 'upload' if job.progress is not None:
+                done, total = job.progress
+                if total:
+                    details.append(
+                        f'{done / total:.0%}' if job.state == 'compress' else
+                        f'part {done + 1} of {total}'
+                    )
+
+        remaining: float = self.registry.remaining(job)
+        if remaining:
+            details.append(f'about {max(1, round(remaining / 60))} min left')
+
+        return (
+            f'"{job.name}": {phase}'
+            + (f' ({", ".join(details)})' if details else '')
+            + '...'
+        )
+
+
+def _input_file(file: str | types.InputFile) -> types.InputFile | str:
+    """:returns: File to upload or file ID to resend."""
+    if isinstance(file, types.InputFile):
+        return file
+
+    return types.InputFile(file) if os.path.exists(file) else file
+
+
+def _split_groups(files: list[str], size: int) -> list[list[str]]:
+    """Splits files into even groups of at most size items.
+
+    Even split never leaves a single item in the last group, which is
+    not allowed in media groups."""
+    count: int = -(-len(files) // size)
+    step, extra = divmod(len(files), count)
+
+    groups: list[list[str]] = []
+    start: int = 0
+    for i in range(count):
+        end: int = start + step + (i < extra)
+        groups.append(files[start:end])
+        start = end
+
+    return groups
+
+
 def _get_link(text: str) -> str | bool:
     if ' https://disk.yandex.ru/d/' not in text:
         return False
@@ -566,7 +1104,6 @@ def _get_link(text: str) -> str | bool:
     return text.split()[1]
 
 
-def main(queue: Queue, vol_size: int):
-    bot: YDBot = YDBot(tokens.get("tg_token"), queue, vol_size)
-
+def main(bot: YDBot):
+    """Polls updates with the bot shared with workers."""
     bot.start_polling()
@@ -0,0 +1,149 @@
+import time
+from threading import Lock
+
+from requests import RequestException
+
+import log
+import metrics
+
+logger = log.get_logger(__name__)
+
+# Daily download limit of a public resource, other 429s limit the account
+RESOURCE_LIMIT_ERROR: str = 'DiskResourceDownloadLimitExceededError'
+# How often jobs check whether the probe of a breaker has finished
+PROBE_WAIT: float = 30.0
+
+TRIPS: metrics.Counter = metrics.counter(
+    'circuit_breaker_trips_total', 'Circuit breakers opened.', ('scope',)
+)
+
+
+class CircuitOpen(Exception):
+    def __init__(self, key: str, wait: float):
+        super().__init__(f'{key} is limited for {wait:.0f} s')
+        self.key: str = key
+        self.wait: float = wait
+
+
+def limited_key(error: RequestException, public_key: str,
+                account: str) -> str | None:
+    """:returns: Key of the breaker to open, if the error is a limit."""
+    if error.response is None or error.response.status_code != 429:
+        return None
+
+    try:
+        name: str = error.response.json().get("error", '')
+    except ValueError:
+        name = ''
+
+    if name == RESOURCE_LIMIT_ERROR:
+        return f'public:{public_key}'
+
+    return f'account:{account}'
+
+
+def retry_after(error: RequestException) -> float | None:
+    """:returns: Delay from the Retry-After header (in seconds only)."""
+    try:
+        return float(error.response.headers["Retry-After"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class CircuitBreakers:
+    """Circuit breakers by keys (public keys and accounts).
+
+    A breaker is opened by a limit error for a cool-down. After it, one
+    job is let through as a probe (half-open state): if it succeeds, the
+    breaker is closed, if it fails, the breaker is opened again for twice
+    as long. Closed breakers aren't stored."""
+
+    def __init__(self, cool_down: float = 600.0,
+                 max_cool_down: float = 86400.0,
+                 probe_timeout: float = 600.0):
+        self.COOL_DOWN: float = float(cool_down)
+        self.MAX_COOL_DOWN: float = float(max_cool_down)
+        self.PROBE_TIMEOUT: float = float(probe_timeout)
+
+        self._lock: Lock = Lock()
+        # Key: [open until, cool-down, probe start or None, probe job ID]
+        self._breakers: dict[str: list] = {}
+
+        metrics.gauge(
+            'circuit_breakers', 'Circuit breakers, which are not closed.',
+            ('scope', 'state'),
+            function=self.states
+        )
+
+    def check(self, job_id: str, *keys: str):
+        """Lets the job through or raises :class:`CircuitOpen`.
+
+        The job may become the probe of a breaker."""
+        with self._lock:
+            now: float = time.monotonic()
+            for key in keys:
+                breaker: list | None = self._breakers.get(key)
+                if breaker is None:
+                    continue
+
+                until, cool_down, probe, _ = breaker
+                if now < until:
+                    raise CircuitOpen(key, until - now)
+                if probe is not None and now - probe < self.PROBE_TIMEOUT:
+                    raise CircuitOpen(key, min(cool_down, PROBE_WAIT))
+
+            for key in keys:
+                breaker = self._breakers.get(key)
+                if breaker is not None:
+                    breaker[2:] = now, job_id
+                    logger.info(f'Probing {key} with job {job_id}...')
+
+    def trip(self, key: str, delay: float = None) -> float:
+        """Opens the breaker.
+
+        :param delay: Cool-down given by the server.
+        :returns: Cool-down, seconds."""
+        with self._lock:
+            breaker: list | None = self._breakers.get(key)
+            if breaker is None:
+                cool_down: float = self.COOL_DOWN
+            elif breaker[2] is not None:
+                # The probe failed
+                cool_down = min(breaker[1] * 2, self.MAX_COOL_DOWN)
+            else:
+                # Jobs started before the breaker was opened
+                return max(0.0, breaker[0] - time.monotonic())
+
+            if delay is not None:
+                cool_down = delay
+            self._breakers[key] = [
+                time.monotonic() + cool_down, cool_down, None, None
+            ]
+
+        TRIPS.inc(key.split(':')[0])
+        logger.warning(f'{key} is limited for {cool_down:.0f} s.')
+
+        return cool_down
+
+    def success(self, job_id: str):
+        """Closes breakers probed by the job."""
+        with self._lock:
+            for key in [
+                key for key, breaker in self._breakers.items()
+                if breaker[3] == job_id
+            ]:
+                del self._breakers[key]
+                logger.info(f'{key} is not limited anymore.')
+
+    def states(self) -> dict[tuple[str, str]: int]:
+        states: dict[tuple[str, str]: int] = {}
+        now: float = time.monotonic()
+
+        with self._lock:
+            for key, (until, *_) in self._breakers.items():
+                state: tuple[str, str] = (
+                    key.split(':')[0], 'open' if now < until else 'half-open'
+                )
+                states[state] = states.get(state, 0) + 1
+
+        return states
@@ -1,23 +1,20 @@
 import time
 import json
-import logging
-from logging.handlers import TimedRotatingFileHandler
+from hashlib import md5
 from threading import Lock
 from math import ceil
 
-logger = logging.getLogger(__name__)
-handler = TimedRotatingFileHandler(
-    filename='logs/cache.log',
-    when='midnight'
-)
-handler.setLevel(logging.DEBUG)
-handler.setFormatter(
-    logging.Formatter(
-        '[%(asctime)s] [%(levelname)s] "%(message)s"',
-        datefmt='%d.%m.%Y %H:%M:%S'
-    )
-)
-logger.addHandler(handler)
+import log
+
+logger = log.get_logger(__name__)
+
+
+def cache_key(public_key: str, path: str) -> str:
+    """:returns: Key of the cache entry of the resource."""
+    return md5(
+        (public_key + path).encode(errors='replace'),
+        usedforsecurity=False
+    ).hexdigest()
 
 
 class Cache:
@@ -40,9 +37,34 @@ class Cache:
             )
             raise
 
+    def is_fresh(self, key: str, modified: int,
+                 hashes: dict[str: str]) -> bool:
+        """Checks the entry against the resource on Yandex Disk: it is
+        fresh if the resource isn't modified since, or is touched, but has
+        the same hash (then the time of the entry is updated).
+
+        :param modified: Modification time of the resource.
+        :param hashes: Hashes of the resource by algorithms."""
+        entry: dict = self[key]
+        if not entry:
+            return False
+        if entry["time"] >= modified:
+            return True
+
+        checksum: str | None = entry.get("checksum")
+        if checksum is None:
+            return False
+        algorithm, _, expected = checksum.partition(':')
+        if hashes.get(algorithm) != expected:
+            return False
+
+        logger.debug(f'Entry {key} is touched, but has the same hash.')
+        self[key] = dict(entry, time=modified)
+        return True
+
     def save(self):
-        with self._file_lock and open(self.cache_file, 'w') as f:
-            json.dump(self.cache, f)
+        with self._file_lock, open(self.cache_file, 'w') as f:
+            json.dump(dict(self.cache), f)
 
     def __contains__(self, item):
         return item in self.cache
@@ -81,6 +103,9 @@ class Cache:
             "files": list(value["files"]),
             "time": ceil(value["time"])
         }
+        # Hash of the downloaded file (algorithm:hex), if it was checked
+        if value.get("checksum"):
+            self.cache[key]["checksum"] = value["checksum"]
         self.save()
 
     def __delitem__(self, key):
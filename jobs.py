@@ -0,0 +1,301 @@
+import heapq
+import json
+import os
+import queue
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable
+from uuid import uuid4
+
+import log
+from cache import cache_key
+
+logger = log.get_logger(__name__)
+
+# Attributes of jobs, which are kept between restarts
+STORED: tuple[str, ...] = (
+    'id', 'user_id', 'public_key', 'path', 'size', 'is_dir', 'queued',
+    'attempts', 'modified'
+)
+
+
+class Job:
+    """Download request put in the queue by the bot."""
+
+    def __init__(self, user_id: int, public_key: str, path: str,
+                 size: int = 0, is_dir: bool = False):
+        self.id: str = uuid4().hex
+        self.user_id: int = user_id
+        self.public_key: str = public_key
+        self.path: str = path
+        self.size: int = size
+        self.is_dir: bool = is_dir
+
+        self.queued: float = time.time()
+        self.attempts: int = 0
+        # When the user was told the job would start, if it was delayed
+        self.eta: float | None = None
+        # Modification time of the resource being downloaded
+        self.modified: int | None = None
+        self.state: str = 'queued'
+        self.phases: list[tuple[str, float, float]] = []
+        # Set while a worker handles the job
+        self.worker: str | None = None
+        self.started: float | None = None
+        # Downloaded bytes
+        self.done: int = 0
+        # Done and total amount of the current phase besides downloading
+        self.progress: tuple[int, int] | None = None
+        # When the user cancelled the job (monotonic)
+        self.cancelled: float | None = None
+        # Refreshes the cache, nobody waits for it
+        self.warm: bool = False
+
+    def __repr__(self):
+        return (
+            f'Job({self.id}, {self.user_id}, {self.public_key!r}, '
+            f'{self.path!r}{", dir" if self.is_dir else ""})'
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Job':
+        job: Job = cls(
+            data["user_id"], data["public_key"], data["path"],
+            data["size"], data["is_dir"]
+        )
+        for name in STORED:
+            setattr(job, name, data[name])
+
+        return job
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in STORED}
+
+    @property
+    def key(self) -> str:
+        """:returns: Key of the cache entry."""
+        return cache_key(self.public_key, self.path)
+
+    @property
+    def name(self) -> str:
+        return self.path.rstrip('/').split('/')[-1]
+
+    def report(self, done: int, total: int):
+        self.progress = (done, total)
+
+    @contextmanager
+    def phase(self, name: str):
+        """Records time spent in the context."""
+        start_time: float = time.time()
+        start: float = time.perf_counter()
+        self.state = name
+
+        try:
+            yield
+        finally:
+            self.state = 'running'
+            self.progress = None
+            self.phases.append(
+                (name, start_time, time.perf_counter() - start)
+            )
+
+
+class JobRegistry:
+    """Jobs from being put in the queue until they are finished.
+
+    Expected time of jobs is a fixed part and downloading at the observed
+    speed (both are smoothed over recent jobs)."""
+
+    def __init__(self, smoothing: float = 0.2):
+        self.SMOOTHING: float = float(smoothing)
+        self.workers: list[str] = []
+        self.jobs: dict[str: Job] = {}
+        # Download speed, bytes/s
+        self.speed: float | None = None
+        # Time of a job without downloading, seconds
+        self.overhead: float | None = None
+        self._lock: Lock = Lock()
+
+    def add(self, job: Job):
+        self.jobs[job.id] = job
+
+    def start(self, job: Job, worker: str):
+        job.worker = worker
+        job.started = time.time()
+        job.done = 0
+
+    def stop(self, job: Job, finished: bool = True):
+        """:param finished: The job is done or failed (not put aside to
+            be retried)."""
+        job.worker = job.started = None
+        if finished:
+            self.jobs.pop(job.id, None)
+
+    def observe(self, job: Job):
+        """Updates expected time with phases of the done job."""
+        download: float = sum(
+            duration for phase, _, duration in job.phases
+            if phase == 'download'
+        )
+        total: float = sum(
+            duration for phase, _, duration in job.phases if phase != 'queue'
+        )
+
+        with self._lock:
+            # Files of folders are downloaded in parallel
+            if download and not job.is_dir:
+                self.speed = self._smooth(self.speed, job.size / download)
+            self.overhead = self._smooth(self.overhead, total - download)
+
+    def _smooth(self, average: float | None, value: float) -> float:
+        if average is None:
+            return value
+
+        return average + self.SMOOTHING * (value - average)
+
+    def duration(self, job: Job) -> float | None:
+        """:returns: Expected time of the job without waiting, seconds."""
+        if self.overhead is None:
+            return None
+        if self.speed is None:
+            return self.overhead
+
+        return self.overhead + job.size / self.speed
+
+    def remaining(self, job: Job, now: float = None) -> float:
+        """:returns: Expected time until the running job is done, seconds."""
+        started: float | None = job.started
+        if started is None or self.overhead is None:
+            return 0.0
+
+        remaining: float = self.duration(job) - ((now or time.time()) - started)
+        if self.speed is not None:
+            remaining = max(remaining, (job.size - job.done) / self.speed)
+
+        return max(0.0, remaining)
+
+    def eta(self, job: Job, ahead: list[Job]) -> float | None:
+        """:param ahead: Queued jobs, which are taken before the job.
+        :returns: Expected time until the job is done, seconds."""
+        duration: float | None = self.duration(job)
+        if duration is None:
+            return None
+        if job.worker is not None:
+            return self.remaining(job)
+
+        # Workers take jobs as soon as they are free
+        now: float = time.time()
+        free: list[float] = [
+            self.remaining(running, now) for running in self.running()
+        ]
+        free += [0.0] * max(1, len(self.workers) - len(free))
+        heapq.heapify(free)
+        for queued in ahead:
+            heapq.heapreplace(free, free[0] + self.duration(queued))
+
+        return free[0] + duration
+
+    def running(self) -> list[Job]:
+        return [
+            job for job in list(self.jobs.values()) if job.worker is not None
+        ]
+
+
+class JobQueue(queue.Queue):
+    """Queue of jobs, which are registered when they are put."""
+
+    def __init__(self, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.registry: JobRegistry = JobRegistry()
+        # Called with cancelled jobs and whether they were removed from
+        # the queue (others are stopped by their workers)
+        self.on_cancel: Callable[[Job, bool], None] | None = None
+
+    def _put(self, job: Job):
+        self.registry.add(job)
+        super()._put(job)
+
+    def position(self, job: Job) -> tuple[int, float | None]:
+        """:returns: Position of the job in the queue (0 if it is running
+            or put aside) and expected time until it is done, seconds."""
+        with self.mutex:
+            jobs: list[Job] = list(self.queue)
+
+        try:
+            position: int = jobs.index(job) + 1
+        except ValueError:
+            return 0, self.registry.eta(job, [])
+
+        return position, self.registry.eta(job, jobs[:position - 1])
+
+    def cancel(self, job_id: str, user_id: int) -> Job | None:
+        """Cancels the job of the user. A queued job is removed at once,
+        a running one is stopped by its worker.
+
+        :returns: Cancelled job or ``None``, if it is finished (or isn't
+            of the user)."""
+        job: Job | None = self.registry.jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        if job.cancelled is not None:
+            return job
+
+        job.cancelled = time.monotonic()
+        with self.mutex:
+            try:
+                self.queue.remove(job)
+            except ValueError:
+                removed: bool = False
+            else:
+                removed = True
+                self.unfinished_tasks -= 1
+                if not self.unfinished_tasks:
+                    self.all_tasks_done.notify_all()
+                self.not_full.notify()
+
+        if removed:
+            self.registry.stop(job)
+        logger.info(f'{job} is cancelled{" in the queue" if removed else ""}.')
+        if self.on_cancel is not None:
+            self.on_cancel(job, removed)
+
+        return job
+
+    def redeliver(self, job: Job):
+        """Puts the job taken by :meth:`get` in front of the queue.
+
+        The job is still unfinished (:meth:`task_done` isn't called for it),
+        so it is not counted again."""
+        with self.mutex:
+            self.queue.appendleft(job)
+            self.not_empty.notify()
+
+
+class JobStore:
+    """Unfinished jobs saved on shutdown and restored on startup."""
+
+    def __init__(self, path: str = 'data/jobs.json'):
+        self.path: str = path
+
+    def load(self) -> list[Job]:
+        try:
+            with open(self.path) as f:
+                jobs: list[Job] = [Job.from_dict(data) for data in json.load(f)]
+        except FileNotFoundError:
+            return []
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            logger.critical(f'Jobs in "{self.path}" are lost: {e}')
+            return []
+
+        logger.info(f'{len(jobs)} jobs are restored.')
+
+        return jobs
+
+    def save(self, jobs: list[Job]):
+        # Written at once, so a crash leaves either old or new jobs
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump([job.to_dict() for job in jobs], f)
+        os.replace(f'{self.path}.tmp', self.path)
+
+        logger.info(f'{len(jobs)} jobs are saved.')
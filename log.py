@@ -0,0 +1,233 @@
+"""Logging of all modules through one background writer.
+
+Loggers only put records in a queue, files are written by the listener
+thread, so logging doesn't block the event loop or workers. Every module
+has its own file in ``logs/``, all records are also written as JSON lines
+to ``logs/records.jsonl`` with the ID of the job they were logged for.
+"""
+import atexit
+import json
+import logging
+import queue
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from threading import Lock
+from typing import Iterator
+
+PATH: str = 'logs/'
+FORMATTER: logging.Formatter = logging.Formatter(
+    '[%(asctime)s] [%(levelname)s] "%(message)s"',
+    datefmt='%d.%m.%Y %H:%M:%S'
+)
+# Same messages passed in a window, the rest are dropped
+BURST: int = 5
+BURST_INTERVAL: float = 10.0
+# Messages remembered before finished windows are removed
+MAX_MESSAGES: int = 10_000
+
+JOB_ID: ContextVar[str | None] = ContextVar('job_id', default=None)
+
+
+class _Queue(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Formats the message here, but keeps the record for formatters
+        of the listener (unlike :class:`QueueHandler`).
+
+        The record isn't copied: the root logger has the only handler."""
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+
+class _Context(logging.Filter):
+    """Adds the job ID and drops repeated records (errors are kept)."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock: Lock = Lock()
+        # Message: [window start, records passed, records dropped]
+        self._messages: dict[tuple[str, int, str]: list] = {}
+        self._forgotten: float = 0.0
+        self.dropped: int = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.job_id = JOB_ID.get()
+        record.message = record.getMessage()
+        if record.levelno >= logging.ERROR:
+            return True
+
+        message: tuple[str, int, str] = (
+            record.name, record.levelno, record.message
+        )
+        with self._lock:
+            window: list | None = self._messages.get(message)
+            if window is None or record.created - window[0] >= BURST_INTERVAL:
+                if window is None and len(self._messages) >= MAX_MESSAGES:
+                    self._forget(record.created)
+                    if len(self._messages) >= MAX_MESSAGES:
+                        # Too many different messages to count them
+                        return True
+                self._messages[message] = [record.created, 1, 0]
+                if window is not None and window[2]:
+                    record.message += (
+                        f' ({window[2]} repeated messages were dropped)'
+                    )
+                return True
+
+            if window[1] < BURST:
+                window[1] += 1
+                return True
+
+            window[2] += 1
+            self.dropped += 1
+            return False
+
+    def _forget(self, now: float):
+        """Removes windows, which are over (once a second at most)."""
+        if now - self._forgotten < 1:
+            return
+        self._forgotten = now
+        self._messages = {
+            message: window for message, window in self._messages.items()
+            if now - window[0] < BURST_INTERVAL
+        }
+
+
+class _JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "job": getattr(record, 'job_id', None),
+            "message": record.getMessage()
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _Router(logging.Handler):
+    """Writes records of modules to their files (in the listener).
+
+    Handlers of files are created by the first record, so modules, which
+    log nothing, cost nothing at startup."""
+
+    def __init__(self):
+        super().__init__()
+        # Loggers: names of their files
+        self.names: dict[str: str] = {}
+        self.files: dict[str: logging.Handler] = {}
+        self.others: list[logging.Handler] = []
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        file: logging.Handler | None = self.files.get(record.name)
+        if file is None and record.name in self.names:
+            file = self.files[record.name] = _file(
+                self.names[record.name], FORMATTER
+            )
+        if file is not None:
+            file.handle(record)
+        for handler in self.others:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+        return True
+
+    def flush(self):
+        for handler in (*self.files.values(), *self.others):
+            handler.flush()
+
+
+def _file(filename: str, formatter: logging.Formatter) -> logging.Handler:
+    handler = TimedRotatingFileHandler(
+        filename=f'{PATH}{filename}',
+        when='midnight',
+        delay=True
+    )
+    handler.setFormatter(formatter)
+    handler.setLevel(logging.DEBUG)
+
+    return handler
+
+
+_router: _Router = _Router()
+_router.others.append(_file('records.jsonl', _JSONFormatter()))
+_context: _Context = _Context()
+_queue: queue.SimpleQueue = queue.SimpleQueue()
+_handler: _Queue = _Queue(_queue)
+_handler.addFilter(_context)
+_listener: QueueListener | None = None
+_lock: Lock = Lock()
+
+
+def _start():
+    global _listener
+
+    with _lock:
+        if _listener is not None:
+            return
+
+        logging.getLogger().addHandler(_handler)
+        _listener = QueueListener(_queue, _router)
+        _listener.start()
+        atexit.register(stop)
+
+
+def get_logger(name: str, filename: str = None) -> logging.Logger:
+    """:param filename: File in ``logs/`` (``<name>.log`` by default)."""
+    _start()
+    _router.names[name] = filename or f'{name}.log'
+
+    return logging.getLogger(name)
+
+
+def setup(level: str | int = 'INFO'):
+    """Sets the level of all loggers and prints records to stderr.
+
+    :raises ValueError: Invalid level."""
+    logging.getLogger().setLevel(level)
+    _start()
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    _router.others.append(console)
+
+
+def stop():
+    """Writes queued records and stops the listener."""
+    global _listener
+
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener = None
+    logging.getLogger().removeHandler(_handler)
+    _router.flush()
+
+
+def pending() -> int:
+    """:returns: Number of records, which are not written yet."""
+    return _queue.qsize()
+
+
+def dropped() -> int:
+    """:returns: Number of repeated records, which were dropped."""
+    return _context.dropped
+
+
+@contextmanager
+def job(job_id: str) -> Iterator[None]:
+    """Records logged inside are tagged with the job ID."""
+    token = JOB_ID.set(job_id)
+    try:
+        yield
+    finally:
+        JOB_ID.reset(token)
@@ -1,9 +1,10 @@
+import atexit
 import logging
 import os
+import signal
+import sys
 from json import load, JSONDecodeError
-from queue import Queue
-from threading import Thread
-from time import sleep
+from urllib.parse import urlsplit
 
 try:
     with open(f'config{os.sep}config.json') as f:
@@ -15,45 +16,113 @@ except JSONDecodeError as JDE:
     logging.critical('The file is not JSON!', exc_info=JDE)
     raise
 
+import log
+
 try:
-    logging.basicConfig(
-        level=config.pop("log_level", 'INFO')
-    )
+    log.setup(config.pop("log_level", 'INFO'))
 except ValueError:
     logging.critical('Invalid log level!')
     raise
 
-from bot import main
-from workers import Workers
 import tokens
+from supervisor import SERVER, Supervisor
+
+# The server starts while the bot is imported and initialized, it is
+# waited for before the first request
+server_path: str | None = config.pop("server_path", "./telegram-bot-api")
+ready_timeout: float = config.pop("server_ready_timeout", 30)
+local_server: bool = config.pop("local_server", True)
+supervisor: Supervisor | None = None
+if server_path:
+    command: list[str] = [
+        server_path,
+        f'--api-id={tokens.get("tg_api-id")}',
+        f'--api-hash={tokens.get("tg_api-hash")}',
+        f'--http-port={urlsplit(SERVER).port or 8081}'
+    ]
+    if local_server:
+        command.append('--local')
+
+    supervisor = Supervisor(command, SERVER, ready_timeout)
+    supervisor.launch()
+    # Also if the bot fails to start
+    atexit.register(supervisor.stop)
+
+import metrics
+from bot import main, YDBot
+from jobs import JobQueue
+from search import NameIndexes
+from volumes import VolumePlanner
+from workers import Workers
+from yadisk_api import MetadataStore
 
-dr: Queue = Queue()
+dr: JobQueue = JobQueue()
+
+metrics_port: int | None = config.pop("metrics_port", None)
+if metrics_port:
+    metrics.start_server(metrics_port)
+metrics.gauge(
+    'log_queue_size', 'Records waiting for the log writer.',
+    function=log.pending
+)
+metrics.gauge(
+    'log_records_dropped', 'Repeated records, which were dropped.',
+    function=log.dropped
+)
+
+volumes: VolumePlanner = VolumePlanner(
+    local_server,
+    config.pop("max_upload_time", 240),
+    config.pop("volume_size", None)
+)
+
+admins: list[int] = config.pop("admins", [])
+metadata: MetadataStore = MetadataStore(
+    config.pop("metadata_ttl", 60), config.pop("prefetch_rate", 10)
+)
+indexes: NameIndexes = NameIndexes(
+    config.pop("index_rate", 10), config.pop("index_ttl", 600)
+)
+# One bot polls updates and sends messages and files of workers
+bot: YDBot = YDBot(
+    tokens.get("tg_token"), dr, volumes, admins, metadata, indexes
+)
 
 config.update(
     {
         "download_requests": dr,
-        "token": tokens.get("ya_token")
+        "token": tokens.get("ya_token"),
+        "volumes": volumes,
+        "bot": bot
     }
 )
 
-command: str = (
-    f'{config.pop("server_path", "./telegram-bot-api")} '
-    f'--api-id={tokens.get("tg_api-id")} '
-    f'--api-hash={tokens.get("tg_api-hash")}'
-)
-print(command)
+wrk = Workers(**config)
+if supervisor is not None:
+    supervisor.wait()
+wrk.start()
 
-Thread(
-    target=os.system,
-    args=(command,),
-    daemon=True
-).start()
+# "docker stop" sends SIGTERM, workers are drained as on Ctrl+C
+signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
 
-sleep(10)
 
-wrk = Workers(**config)
-wrk.start()
+def reload_tokens(*_):
+    """Reads tokens again, accounts of Yandex Disk are changed without a
+    restart (the bot and the server keep the tokens they started with)."""
+    if not tokens.reload():
+        return
+
+    ya_token: str | list[str] | None = tokens.get("ya_token")
+    wrk.accounts.update([ya_token] if isinstance(ya_token, str) else ya_token)
 
-main(dr, config["volume_size"])
 
-wrk.stop()
+# "kill -HUP <pid>" (or "docker kill -s HUP <container>")
+if hasattr(signal, 'SIGHUP'):
+    signal.signal(signal.SIGHUP, reload_tokens)
+
+try:
+    main(bot)
+finally:
+    wrk.stop()
+    if supervisor is not None:
+        supervisor.stop()
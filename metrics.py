@@ -0,0 +1,234 @@
+"""In-process metrics in Prometheus text format.
+
+Updating a metric takes one lock and one dict lookup, values which are
+expensive to compute are read by callbacks on scrape only."""
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Callable
+
+import log
+
+logger = log.get_logger(__name__)
+
+PREFIX: str = 'yadisk_'
+BUCKETS: tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+    60.0, 300.0, 900.0, 3600.0
+)
+
+
+class Metric:
+    TYPE: str
+
+    def __init__(self, name: str, documentation: str,
+                 labels: tuple[str, ...] = ()):
+        self.name: str = PREFIX + name
+        self.documentation: str = documentation
+        self.label_names: tuple[str, ...] = labels
+
+        self._lock: Lock = Lock()
+        self._values: dict[tuple: float] = {}
+
+    def samples(self) -> list[tuple[str, tuple, float]]:
+        """:returns: Name suffixes, label values and values."""
+        with self._lock:
+            return [('', labels, value) for labels, value in self._values.items()]
+
+    def render(self) -> str:
+        lines: list[str] = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.TYPE}'
+        ]
+
+        for suffix, labels, value in self.samples():
+            names: tuple[str, ...] = self.label_names
+            if suffix == '_bucket':
+                names += ('le',)
+
+            lines.append(
+                f'{self.name}{suffix}{_format_labels(names, labels)} {value}'
+            )
+
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """Gauge, which is either set or computed by ``function`` on scrape.
+
+    ``function`` returns a value or values by label values."""
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, documentation: str,
+                 labels: tuple[str, ...] = (),
+                 function: Callable[[], float | dict[tuple: float]] = None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> list[tuple[str, tuple, float]]:
+        if self.function is None:
+            return super().samples()
+
+        try:
+            values: float | dict[tuple: float] = self.function()
+        except Exception as e:
+            logger.error(f'Can\'t compute {self.name}: {e}')
+            return []
+
+        if not isinstance(values, dict):
+            return [('', (), values)]
+
+        return [('', labels, value) for labels, value in values.items()]
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, documentation: str,
+                 labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets: tuple[float, ...] = buckets
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            # Counts per bucket, sum and count
+            values: list[float] = self._values.get(labels)
+            if values is None:
+                values = self._values[labels] = [0] * (len(self.buckets) + 3)
+
+            values[bisect_left(self.buckets, value)] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def samples(self) -> list[tuple[str, tuple, float]]:
+        samples: list[tuple[str, tuple, float]] = []
+
+        with self._lock:
+            items: list[tuple[tuple, list[float]]] = [
+                (labels, list(values)) for labels, values in self._values.items()
+            ]
+
+        for labels, values in items:
+            cumulative: float = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                samples.append(
+                    ('_bucket', labels + (_format_bound(bound),), cumulative)
+                )
+
+            samples.append(('_sum', labels, values[-2]))
+            samples.append(('_count', labels, values[-1]))
+
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._lock: Lock = Lock()
+        self.metrics: dict[str: Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """Registers the metric, if it isn't registered yet.
+
+        :returns: Registered metric with the same name."""
+        with self._lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics: list[Metric] = list(self.metrics.values())
+
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY: Registry = Registry()
+
+
+def counter(name: str, documentation: str,
+            labels: tuple[str, ...] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labels))
+
+
+def gauge(name: str, documentation: str, labels: tuple[str, ...] = (),
+          function: Callable[[], float | dict[tuple: float]] = None) -> Gauge:
+    metric: Gauge = REGISTRY.register(
+        Gauge(name, documentation, labels, function)
+    )
+    # Callback of the latest owner (e.g. recreated workers) is used
+    if function is not None:
+        metric.function = function
+
+    return metric
+
+
+def histogram(name: str, documentation: str, labels: tuple[str, ...] = (),
+              buckets: tuple[float, ...] = BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labels, buckets))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body: bytes = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args):
+        logger.debug(format % args)
+
+
+def start_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serves metrics on http://host:port/metrics from a daemon thread."""
+    server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+
+    Thread(
+        target=server.serve_forever,
+        name='MetricsServer',
+        daemon=True
+    ).start()
+    logger.info(f'Metrics are served on http://{host}:{port}/metrics.')
+
+    return server
+
+
+def _format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ''
+
+    return '{' + ','.join(
+        f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)
+    ) + '}'
+
+
+def _format_bound(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
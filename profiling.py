@@ -0,0 +1,177 @@
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from threading import Event, Lock, Thread, enumerate as threads
+
+import log
+
+logger = log.get_logger(__name__)
+
+# Sampling period, seconds
+INTERVAL: float = 0.01
+MAX_DURATION: float = 300.0
+TOP: int = 15
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class Profile:
+    """Sampling CPU profile of all threads (including the event loop) and
+    memory allocated meanwhile.
+
+    Stacks of threads are sampled every ``interval`` seconds, so running
+    code isn't slowed down by tracing. Tracing allocations (with one frame)
+    makes Python code several times slower, so it is optional."""
+
+    _lock: Lock = Lock()
+
+    def __init__(self, interval: float = INTERVAL, memory: bool = False):
+        self.INTERVAL: float = float(interval)
+        self.MEMORY: bool = memory
+
+        # (thread, functions from the outermost): samples
+        self.stacks: Counter = Counter()
+        self.samples: int = 0
+        self.sampling_time: float = 0.0
+        self.start_time: float = 0.0
+        self.duration: float = 0.0
+
+        self._stop: Event = Event()
+        self._thread: Thread = Thread(
+            target=self._sample, name='Profiler', daemon=True
+        )
+        self._snapshot: tracemalloc.Snapshot | None = None
+        self._tracing: bool = False
+
+    def start(self):
+        """:raises ProfilerBusy: Another profile is running."""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy('Another profile is running')
+
+        if self.MEMORY:
+            # Somebody else may be tracing already
+            self._tracing = not tracemalloc.is_tracing()
+            if self._tracing:
+                tracemalloc.start(1)
+            self._snapshot = tracemalloc.take_snapshot()
+
+        self.start_time = time.monotonic()
+        self._thread.start()
+        logger.info('Profiling started.')
+
+    def stop(self) -> str:
+        """:returns: Report."""
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.monotonic() - self.start_time
+
+        try:
+            report: str = self.cpu_report()
+            if self.MEMORY:
+                report += '\n\n' + self.memory_report()
+        finally:
+            if self._tracing:
+                tracemalloc.stop()
+            self._lock.release()
+
+        logger.info(
+            f'Profiling stopped: {self.samples} samples in '
+            f'{self.duration:.1f} s, sampling took {self.sampling_time:.2f} s.'
+        )
+
+        return report
+
+    def _sample(self):
+        own: int = self._thread.ident
+
+        while not self._stop.wait(self.INTERVAL):
+            start: float = time.perf_counter()
+            names: dict[int: str] = {
+                thread.ident: thread.name for thread in threads()
+            }
+
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+
+                stack: list[str] = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f'{code.co_name} ({os.path.basename(code.co_filename)}'
+                        f':{code.co_firstlineno})'
+                    )
+                    frame = frame.f_back
+                stack.reverse()
+                self.stacks[(names.get(ident, str(ident)), tuple(stack))] += 1
+
+            self.samples += 1
+            self.sampling_time += time.perf_counter() - start
+
+    def folded(self) -> str:
+        """:returns: Stacks in the folded format of flame graph tools
+        (``flamegraph.pl``, speedscope)."""
+        return ''.join(
+            f'{";".join((thread, *stack))} {count}\n'
+            for (thread, stack), count in sorted(self.stacks.items())
+        )
+
+    def cpu_report(self, top: int = TOP) -> str:
+        total: int = sum(self.stacks.values()) or 1
+        own: Counter = Counter()
+        cumulative: Counter = Counter()
+        for (_, stack), count in self.stacks.items():
+            if stack:
+                own[stack[-1]] += count
+            for function in set(stack):
+                cumulative[function] += count
+
+        lines: list[str] = [
+            f'CPU: {self.samples} samples in {self.duration:.1f} s '
+            f'(every {self.INTERVAL * 1000:.0f} ms) of '
+            f'{len({thread for thread, _ in self.stacks})} threads, '
+            f'sampling took {self._overhead():.2%} of one core.',
+            'Running functions (waiting ones too):'
+        ]
+        lines += [
+            f'{count / total:6.1%} {function}'
+            for function, count in own.most_common(top)
+        ]
+        lines.append('Functions with their calls:')
+        lines += [
+            f'{count / total:6.1%} {function}'
+            for function, count in cumulative.most_common(top)
+        ]
+
+        return '\n'.join(lines)
+
+    def memory_report(self, top: int = TOP) -> str:
+        snapshot: tracemalloc.Snapshot = tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__)
+            )
+        )
+        current, peak = tracemalloc.get_traced_memory()
+
+        lines: list[str] = [
+            f'Memory: {current / (1 << 20):.1f} MB traced, '
+            f'peak {peak / (1 << 20):.1f} MB.',
+            'Allocated since the start:'
+        ]
+        for stat in snapshot.compare_to(self._snapshot, 'lineno')[:top]:
+            frame: tracemalloc.Frame = stat.traceback[0]
+            lines.append(
+                f'{stat.size_diff / 1024:+10.0f} KB '
+                f'{stat.count_diff:+7} blocks '
+                f'{os.path.basename(frame.filename)}:{frame.lineno}'
+            )
+
+        return '\n'.join(lines)
+
+    def _overhead(self) -> float:
+        return self.sampling_time / self.duration if self.duration else 0.0
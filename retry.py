@@ -0,0 +1,163 @@
+import heapq
+import random
+import time
+from itertools import count
+from threading import Condition, Thread
+from typing import Callable
+
+from requests import RequestException
+
+import log
+import metrics
+from jobs import Job
+
+logger = log.get_logger(__name__)
+
+# The resource is gone or can't be accessed, retrying won't help
+PERMANENT_STATUSES: frozenset[int] = frozenset({400, 401, 403, 404, 410})
+
+RETRIES: metrics.Counter = metrics.counter(
+    'retries_total', 'Scheduled retries of jobs.', ('reason',)
+)
+GIVEN_UP: metrics.Counter = metrics.counter(
+    'retries_given_up_total', 'Jobs failed without (more) retries.',
+    ('reason',)
+)
+
+
+def reason(error: Exception) -> str:
+    """:returns: HTTP status or type of the error."""
+    if isinstance(error, RequestException) and error.response is not None:
+        return str(error.response.status_code)
+
+    return type(error).__name__
+
+
+def is_retryable(error: Exception) -> bool:
+    """Server errors, throttling, connection errors and other errors
+    without a response are retryable."""
+    return (
+        not isinstance(error, RequestException)
+        or error.response is None
+        or error.response.status_code not in PERMANENT_STATUSES
+    )
+
+
+class RetryScheduler:
+    """Delivers jobs back to the queue after a delay.
+
+    Jobs wait in a heap, so no worker is held while they do. Delays grow
+    exponentially with attempts and are jittered, so jobs failed together
+    don't come back together."""
+
+    def __init__(self, deliver: Callable[[Job], None],
+                 base_delay: float = 10.0, max_delay: float = 600.0,
+                 max_attempts: int = 5, jitter: float = 0.5):
+        """:param deliver: Puts the job back in the queue."""
+        self.deliver: Callable[[Job], None] = deliver
+        self.BASE_DELAY: float = float(base_delay)
+        self.MAX_DELAY: float = float(max_delay)
+        self.MAX_ATTEMPTS: int = int(max_attempts)
+        self.JITTER: float = float(jitter)
+
+        self._jobs: list[tuple[float, int, Job]] = []
+        self._seq = count()
+        self._condition: Condition = Condition()
+        self._stopped: bool = False
+        self._thread: Thread = Thread(
+            target=self._deliver,
+            name='RetryScheduler',
+            daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> list[Job]:
+        """:returns: Jobs, which are not retried yet."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+        with self._condition:
+            jobs: list[Job] = [job for *_, job in sorted(self._jobs)]
+            self._jobs = []
+
+        return jobs
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._jobs)
+
+    def backoff(self, attempt: int) -> float:
+        """:returns: Delay before the attempt (starting from 1)."""
+        delay: float = min(
+            self.MAX_DELAY, self.BASE_DELAY * 2 ** (attempt - 1)
+        )
+
+        return delay * (1 - self.JITTER * random.random())
+
+    def retry(self, job: Job, error: Exception) -> float | None:
+        """Schedules the job, if the error is retryable and attempts are
+        left.
+
+        :returns: Delay, or ``None`` if the job is not retried."""
+        label: str = reason(error)
+
+        if not is_retryable(error) or job.attempts >= self.MAX_ATTEMPTS:
+            GIVEN_UP.inc(label)
+            logger.warning(
+                f'{job} is not retried after {job.attempts} attempts: {error}'
+            )
+            return None
+
+        job.attempts += 1
+        delay: float = self.backoff(job.attempts)
+        RETRIES.inc(label)
+        logger.info(
+            f'{job} is retried in {delay:.1f} s '
+            f'(attempt {job.attempts}): {error}'
+        )
+        self.schedule(job, delay)
+
+        return delay
+
+    def schedule(self, job: Job, delay: float):
+        with self._condition:
+            heapq.heappush(
+                self._jobs, (time.monotonic() + delay, next(self._seq), job)
+            )
+            self._condition.notify()
+
+    def hurry(self, job: Job) -> bool:
+        """Delivers the waiting job at once (e.g. it is cancelled).
+
+        :returns: The job was waiting."""
+        with self._condition:
+            for i, (_, seq, waiting) in enumerate(self._jobs):
+                if waiting is job:
+                    self._jobs[i] = (0.0, seq, job)
+                    heapq.heapify(self._jobs)
+                    self._condition.notify()
+                    return True
+
+        return False
+
+    def _deliver(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    timeout: float | None = None
+                    if self._jobs:
+                        timeout = self._jobs[0][0] - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    self._condition.wait(timeout)
+
+                if self._stopped:
+                    return
+                job: Job = heapq.heappop(self._jobs)[2]
+
+            job.queued = time.time()
+            self.deliver(job)
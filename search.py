@@ -0,0 +1,258 @@
+import re
+import time
+from bisect import bisect_right
+from collections import deque
+from threading import Event, Lock, Thread
+
+import requests
+from requests import Session
+
+import log
+import metrics
+from yadisk_api import LimitedRPPSession, PAGE_LIMIT, _fetch_metadata
+
+logger = log.get_logger(__name__)
+
+# Keys of listings, which are indexed
+FIELDS: str = (
+    '_embedded.items.name,_embedded.items.type,_embedded.items.size,'
+    '_embedded.total'
+)
+WILDCARDS: re.Pattern = re.compile(r'([*?])')
+
+INDEXES: metrics.Counter = metrics.counter(
+    'name_indexes_total', 'Name indexes of public resources looked up.',
+    ('result',)
+)
+SEARCHES: metrics.Histogram = metrics.histogram(
+    'name_search_seconds', 'Time to search a name index.'
+)
+
+
+class NameIndex:
+    """Names of all files and folders of a public resource.
+
+    The tree is listed in the background, breadth first (so the files near
+    the root are found first) and page by page. Searches see the entries
+    listed so far."""
+
+    def __init__(self, public_key: str, session: Session,
+                 max_entries: int = 200_000):
+        self.public_key: str = public_key
+        self.session: Session = session
+        self.MAX_ENTRIES: int = int(max_entries)
+
+        self._lock: Lock = Lock()
+        # Lowercase names, paths and sizes (None for folders) of entries
+        self._names: list[str] = []
+        self.paths: list[str] = []
+        self.sizes: list[int | None] = []
+        self._folders: deque[str] = deque(['/'])
+        # Names joined by new lines and their offsets there, for searches
+        self._text: str = ''
+        self._starts: list[int] = []
+
+        self.requests: int = 0
+        self.error: str | None = None
+        self.started: float = time.monotonic()
+        self.finished: float | None = None
+        self.used: float = self.started
+
+        self._stop: Event = Event()
+        self._thread: Thread = Thread(
+            target=self._build, name='NameIndex', daemon=True
+        )
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    @property
+    def done(self) -> bool:
+        """The tree is listed, or listing it stopped (see ``error``)."""
+        return self.finished is not None
+
+    def pending(self) -> int:
+        """:returns: Number of folders, which are not listed yet."""
+        return len(self._folders)
+
+    def start(self) -> 'NameIndex':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def find(self, pattern: str,
+             limit: int = 10) -> list[tuple[str, int | None]]:
+        """Finds entries by a part of their names, or by a whole name with
+        wildcards (``*`` and ``?``, like ``*.pdf``), case-insensitively.
+
+        Candidates are found by the rarest text between wildcards in all
+        names at once, so only they are matched with the pattern.
+
+        :returns: Paths and sizes (``None`` for folders) of at most
+            ``limit`` entries in the order they were listed."""
+        start: float = time.perf_counter()
+        self.used = time.monotonic()
+        pattern = pattern.strip().lower()
+
+        with self._lock:
+            if len(self._starts) < len(self._names):
+                self._join()
+            text, starts = self._text, self._starts
+            count: int = len(starts)
+
+        parts: list[str] = WILDCARDS.split(pattern)
+        literals: list[str] = [
+            part for part in parts[::2] if part and '\n' not in part
+        ]
+        match = None
+        if len(parts) > 1:
+            match = re.compile(''.join(
+                {"*": '.*', "?": '.'}.get(part) or re.escape(part)
+                for part in parts
+            ), re.S).fullmatch
+
+        found: list[int] = []
+        if literals:
+            literal: str = (
+                min(literals, key=text.count) if len(literals) > 1
+                else literals[0]
+            )
+            # Names have no new lines, so a literal is found in one name
+            position: int = text.find(literal)
+            while position != -1 and len(found) < limit:
+                i: int = bisect_right(starts, position) - 1
+                if match is None or match(self._names[i]):
+                    found.append(i)
+                position = text.find(
+                    literal, starts[i + 1] if i + 1 < count else len(text)
+                )
+        elif match is not None:
+            for i in range(count):
+                if match(self._names[i]):
+                    found.append(i)
+                    if len(found) >= limit:
+                        break
+
+        SEARCHES.observe(time.perf_counter() - start)
+
+        return [(self.paths[i], self.sizes[i]) for i in found]
+
+    def _join(self):
+        """Adds names listed since the last search to the text."""
+        names: list[str] = self._names[len(self._starts):]
+        offset: int = len(self._text)
+        for name in names:
+            self._starts.append(offset)
+            offset += len(name) + 1
+        self._text += ''.join(f'{name}\n' for name in names)
+
+    def _build(self):
+        while not self._stop.is_set():
+            with self._lock:
+                if not self._folders:
+                    break
+                folder: str = self._folders.popleft()
+
+            try:
+                self._list(folder)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code == 429:
+                    self.error = str(e)
+                    break
+                # The folder may be deleted meanwhile
+                logger.warning(f'{folder} ({self.public_key}) is skipped: {e}')
+            except requests.RequestException as e:
+                self.error = str(e)
+                break
+
+            if len(self) >= self.MAX_ENTRIES:
+                self.error = f'More than {self.MAX_ENTRIES} entries'
+                break
+
+        self.finished = time.monotonic()
+        logger.info(
+            f'Indexed {len(self)} entries of {self.public_key} in '
+            f'{self.finished - self.started:.1f} s, {self.requests} '
+            f'requests' + (f', stopped: {self.error}' if self.error else '.')
+        )
+
+    def _list(self, folder: str):
+        offset: int = 0
+        while not self._stop.is_set():
+            data: dict = _fetch_metadata(
+                self.session, self.public_key, folder, PAGE_LIMIT, offset,
+                FIELDS
+            )
+            self.requests += 1
+            if "_embedded" not in data:
+                # The resource is a file
+                return
+
+            items: list[dict] = data["_embedded"]["items"]
+            with self._lock:
+                for item in items:
+                    path: str = f'{folder.rstrip("/")}/{item["name"]}'
+                    self._names.append(item["name"].lower())
+                    self.paths.append(path)
+                    if item["type"] == 'dir':
+                        self.sizes.append(None)
+                        self._folders.append(path)
+                    else:
+                        self.sizes.append(item["size"])
+
+            offset += len(items)
+            if not items or offset >= data["_embedded"]["total"]:
+                return
+
+
+class NameIndexes:
+    """Name indexes of public resources shared by all users.
+
+    All indexes are built with one session, so together they make at most
+    ``rate`` requests per second. An index is dropped when it isn't searched
+    or was built ``ttl`` seconds ago (so changes are found), and so is the
+    least recently searched one when there are ``max_indexes``."""
+
+    def __init__(self, rate: float = 10.0, ttl: float = 600.0,
+                 max_indexes: int = 20, max_entries: int = 200_000):
+        self.TTL: float = float(ttl)
+        self.MAX_INDEXES: int = int(max_indexes)
+        self.MAX_ENTRIES: int = int(max_entries)
+
+        self._lock: Lock = Lock()
+        self._indexes: dict[str: NameIndex] = {}
+        self._session: LimitedRPPSession = LimitedRPPSession(rate)
+
+    def get(self, public_key: str) -> NameIndex:
+        """:returns: Index of the resource, which is started to build if
+            there is none."""
+        now: float = time.monotonic()
+
+        with self._lock:
+            self._expire(now)
+            index: NameIndex | None = self._indexes.get(public_key)
+            if index is not None:
+                INDEXES.inc('reused')
+                index.used = now
+                return index
+
+            if len(self._indexes) >= self.MAX_INDEXES:
+                oldest: str = min(
+                    self._indexes, key=lambda key: self._indexes[key].used
+                )
+                self._indexes.pop(oldest).stop()
+            INDEXES.inc('built')
+            index = NameIndex(public_key, self._session, self.MAX_ENTRIES)
+            self._indexes[public_key] = index
+
+        return index.start()
+
+    def _expire(self, now: float):
+        for public_key, index in list(self._indexes.items()):
+            if now - index.used > self.TTL or (
+                    index.done and now - index.finished > self.TTL
+            ):
+                del self._indexes[public_key]
+                index.stop()
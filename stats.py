@@ -0,0 +1,141 @@
+import queue
+from sqlite3 import connect, Connection, Error
+from threading import Thread
+
+import log
+
+logger = log.get_logger(__name__)
+
+SCHEMA: tuple[str, ...] = (
+    """
+    CREATE TABLE IF NOT EXISTS Statistics(
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        PublicKey TEXT,
+        Path TEXT,
+        Size INT,
+        StartTime INT,
+        EndTime INT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS Phases(
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        JobID TEXT,
+        Phase TEXT,
+        StartTime REAL,
+        Duration REAL
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS StatisticsStartTime ON Statistics(StartTime)',
+    'CREATE INDEX IF NOT EXISTS PhasesStartTime ON Phases(StartTime, Phase)',
+    'CREATE INDEX IF NOT EXISTS PhasesJobID ON Phases(JobID)'
+)
+
+INSERT_STATISTICS: str = """
+    INSERT INTO Statistics(
+        JobID, PublicKey, Path, IsDir, Size, StartTime, EndTime
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+INSERT_PHASES: str = """
+    INSERT INTO Phases(JobID, Phase, StartTime, Duration)
+    VALUES (?, ?, ?, ?)
+"""
+
+
+def create_tables(con: Connection):
+    for statement in SCHEMA:
+        con.execute(statement)
+
+    # Databases created before phases were recorded
+    columns: set[str] = {
+        row[1] for row in con.execute('PRAGMA table_info(Statistics)')
+    }
+    if 'JobID' not in columns:
+        con.execute('ALTER TABLE Statistics ADD COLUMN JobID TEXT')
+    # Types of resources downloaded before are unknown
+    if 'IsDir' not in columns:
+        con.execute('ALTER TABLE Statistics ADD COLUMN IsDir INT')
+
+    con.commit()
+
+
+class StatsWriter:
+    """Writes statistics from a dedicated thread.
+
+    Rows are inserted in batches, one transaction per batch, so workers
+    never wait for the database."""
+
+    def __init__(self, db_path: str, batch_size: int = 100,
+                 flush_interval: float = 5.0):
+        self.db_path: str = db_path
+        self.BATCH_SIZE: int = batch_size
+        self.FLUSH_INTERVAL: float = flush_interval
+
+        self._rows: queue.Queue = queue.Queue()
+        self._thread: Thread = Thread(
+            target=self._write,
+            name='StatsWriter',
+            daemon=True
+        )
+
+        con: Connection = connect(self.db_path)
+        create_tables(con)
+        con.close()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._rows.put(None)
+        self._thread.join()
+
+    def add_job(self, job_id: str, public_key: str, path: str, is_dir: bool,
+                size: int, start_time: int, end_time: int):
+        self._rows.put(
+            (INSERT_STATISTICS,
+             (job_id, public_key, path, is_dir, size, start_time, end_time))
+        )
+
+    def add_phases(self, job_id: str,
+                   phases: list[tuple[str, float, float]]):
+        """:param phases: Names, start times and durations of phases."""
+        for phase, start_time, duration in phases:
+            self._rows.put(
+                (INSERT_PHASES, (job_id, phase, start_time, duration))
+            )
+
+    def _write(self):
+        con: Connection = connect(self.db_path)
+        stopped: bool = False
+
+        while not stopped:
+            batch: dict[str: list[tuple]] = {}
+
+            try:
+                row = self._rows.get(timeout=self.FLUSH_INTERVAL)
+                while True:
+                    if row is None:
+                        stopped = True
+                        break
+
+                    statement, parameters = row
+                    batch.setdefault(statement, []).append(parameters)
+                    if sum(map(len, batch.values())) >= self.BATCH_SIZE:
+                        break
+
+                    row = self._rows.get_nowait()
+            except queue.Empty:
+                pass
+
+            if not batch:
+                continue
+
+            try:
+                with con:
+                    for statement, rows in batch.items():
+                        con.executemany(statement, rows)
+            except Error as e:
+                logger.error(f'Statistics are not written: {e}')
+
+        con.close()
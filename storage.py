@@ -0,0 +1,157 @@
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from threading import Condition
+
+import log
+
+logger = log.get_logger(__name__)
+
+
+class NotEnoughSpace(Exception):
+    """There is no space for the reservation in the budget now."""
+
+
+class Budget:
+    """Reservations of tasks, which can't exceed the capacity together."""
+
+    def __init__(self, capacity: int):
+        self._condition: Condition = Condition()
+        self._reservations: dict[str: int] = {}
+        self.CAPACITY: int = max(0, int(capacity))
+
+    @property
+    def reserved(self) -> int:
+        """:returns: Reserved bytes."""
+        with self._condition:
+            return sum(self._reservations.values())
+
+    @property
+    def reservations(self) -> dict[str: int]:
+        """:returns: Reserved bytes by reservation IDs."""
+        with self._condition:
+            return dict(self._reservations)
+
+    def fits(self, size: int) -> bool:
+        """:returns: Whether the reservation can ever be made."""
+        return size <= self.CAPACITY
+
+    @contextmanager
+    def reserve(self, reservation_id: str, size: int, timeout: float = None):
+        """Reserves space while in context.
+
+        Waits for other reservations to be released.
+
+        :raises NotEnoughSpace: If space wasn't freed in ``timeout``."""
+        size = int(size)
+
+        with self._condition:
+            if not self._condition.wait_for(
+                    lambda: self.reserved + size <= self.CAPACITY,
+                    timeout
+            ):
+                raise NotEnoughSpace(
+                    f'No space for {size} B in {timeout} s '
+                    f'({self.reserved} of {self.CAPACITY} B reserved).'
+                )
+
+            self._reservations[reservation_id] = size
+            logger.debug(
+                f'Reserved {size} B for {reservation_id} '
+                f'({self.reserved} of {self.CAPACITY} B).'
+            )
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._reservations.pop(reservation_id, None)
+                self._condition.notify_all()
+                logger.debug(
+                    f'Released {size} B of {reservation_id} '
+                    f'({self.reserved} of {self.CAPACITY} B).'
+                )
+
+
+class StorageBudget(Budget):
+    """Disk space reservations of tasks in the working directory.
+
+    Tasks reserve their peak footprint before writing anything, so
+    several big tasks can't fill the volume together."""
+
+    def __init__(self, path: str, budget: int | None = None,
+                 keep_free: int = 1_000_000_000):
+        """:param budget: Bytes tasks can use. By default, it is the free
+            space of the volume without ``keep_free`` bytes."""
+        self.path: str = path
+        os.makedirs(self.path, exist_ok=True)
+
+        free: int = shutil.disk_usage(self.path).free - int(keep_free)
+        super().__init__(min(free, int(budget)) if budget else free)
+        logger.info(f'Storage budget: {self.CAPACITY} B.')
+
+    def used(self) -> int:
+        """:returns: Bytes used in the working directory."""
+        return _size(self.path)
+
+    def sweep(self, checkpoint_ttl: float = 86_400.0,
+              keep: set[str] = frozenset()) -> int:
+        """Removes files left by crashed tasks.
+
+        Folder jobs staging ("<key>/" with "<key>.json" checkpoint) is kept
+        for ``checkpoint_ttl`` seconds, so the job can be resumed.
+
+        :param keep: Names of staging of restored jobs, which are kept.
+
+        :returns: Freed bytes."""
+        freed: int = 0
+        now: float = time.time()
+
+        with os.scandir(self.path) as entries:
+            entries: list[os.DirEntry] = list(entries)
+        names: set[str] = {entry.name for entry in entries}
+
+        for entry in entries:
+            staging: str = entry.name.removesuffix('.json')
+            if staging in keep:
+                continue
+            if {staging, f'{staging}.json'} <= names and now - os.path.getmtime(
+                    os.path.join(self.path, f'{staging}.json')
+            ) < checkpoint_ttl:
+                continue
+
+            freed += _size(entry.path)
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.remove(entry.path)
+            logger.warning(f'Removed orphaned "{entry.path}".')
+
+        logger.info(f'Swept {freed} B from "{self.path}".')
+
+        return freed
+
+
+class MemoryBudget(Budget):
+    """Memory reservations of tasks, which keep their files in memory.
+
+    Reservations are all that is used."""
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        logger.info(f'Memory budget: {self.CAPACITY} B.')
+
+    def used(self) -> int:
+        """:returns: Reserved bytes."""
+        return self.reserved
+
+
+def _size(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+
+    return sum(
+        os.path.getsize(os.path.join(root, file))
+        for root, _, files in os.walk(path) for file in files
+    )
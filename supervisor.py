@@ -0,0 +1,182 @@
+import os
+import subprocess
+import time
+from threading import Event, Lock, Thread
+
+import log
+import metrics
+
+logger = log.get_logger(__name__)
+
+SERVER: str = os.environ.get('BOT_API_URL', 'http://localhost:8081')
+
+STARTUP = metrics.gauge(
+    'bot_api_startup_seconds',
+    'Time from spawning the Bot API server to its readiness.'
+)
+RESTARTS = metrics.counter(
+    'bot_api_restarts_total',
+    'Restarts of the Bot API server after it exited.'
+)
+UP = metrics.gauge('bot_api_up', 'Whether the Bot API server is ready.')
+
+
+class ServerNotReady(Exception):
+    pass
+
+
+class Supervisor:
+    """Runs the Bot API server and restarts it when it exits.
+
+    The server is ready when its HTTP endpoint answers anything at all.
+    Restarts are delayed exponentially, the delay is reset once the
+    server has been running for ``stable_time``."""
+
+    def __init__(self, command: list[str], url: str,
+                 ready_timeout: float = 30.0, poll_interval: float = 0.1,
+                 min_backoff: float = 1.0, max_backoff: float = 60.0,
+                 stable_time: float = 60.0):
+        self.command: list[str] = command
+        self.url: str = url
+        self.READY_TIMEOUT: float = ready_timeout
+        self.POLL_INTERVAL: float = poll_interval
+        self.MIN_BACKOFF: float = min_backoff
+        self.MAX_BACKOFF: float = max_backoff
+        self.STABLE_TIME: float = stable_time
+
+        self.process: subprocess.Popen | None = None
+        self.startup_time: float | None = None
+        self._launched: float | None = None
+
+        self._lock: Lock = Lock()
+        self._stop: Event = Event()
+        self._monitor: Thread = Thread(
+            target=self.monitor,
+            name='Supervisor',
+            daemon=True
+        )
+
+    def start(self) -> float:
+        """Starts the server and waits until it is ready.
+
+        :returns: Startup time, seconds.
+        :raises ServerNotReady: The server exited or isn't ready in time.
+        """
+        self.launch()
+
+        return self.wait()
+
+    def launch(self):
+        """Starts the server without waiting for it, so the bot can be
+        initialized meanwhile (see :meth:`wait`)."""
+        self._launched = time.perf_counter()
+        self._popen()
+
+    def wait(self) -> float:
+        """Waits until the launched server is ready and restarts it when it
+        exits from then on.
+
+        :returns: Startup time, seconds.
+        :raises ServerNotReady: The server exited or isn't ready in time.
+        """
+        startup_time: float = self._ready(self._launched)
+        self._monitor.start()
+
+        return startup_time
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+
+        with self._lock:
+            process: subprocess.Popen | None = self.process
+        if process is None or process.poll() is not None:
+            return
+
+        logger.info(f'Stopping the server (PID {process.pid})...')
+        process.terminate()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning('The server is not stopped in time, killing it.')
+            process.kill()
+            process.wait()
+        UP.set(0)
+
+    def monitor(self):
+        backoff: float = self.MIN_BACKOFF
+
+        while not self._stop.is_set():
+            started: float = time.monotonic()
+            code: int = self.process.wait()
+            if self._stop.is_set():
+                break
+
+            UP.set(0)
+            RESTARTS.inc()
+            if time.monotonic() - started >= self.STABLE_TIME:
+                backoff = self.MIN_BACKOFF
+            logger.error(
+                f'The server exited with code {code}, '
+                f'restarting in {backoff:.0f} s...'
+            )
+
+            while not self._stop.wait(backoff):
+                backoff = min(backoff * 2, self.MAX_BACKOFF)
+                try:
+                    self._spawn()
+                    break
+                except (ServerNotReady, OSError) as e:
+                    # The binary can be missing or no process can be
+                    # spawned for a while, it is tried again
+                    logger.error(
+                        f'{e}, restarting in {backoff:.0f} s...'
+                    )
+
+    def _spawn(self) -> float:
+        start: float = time.perf_counter()
+        self._popen()
+
+        return self._ready(start)
+
+    def _popen(self):
+        with self._lock:
+            if self._stop.is_set():
+                raise ServerNotReady('The supervisor is stopped')
+
+            self.process = subprocess.Popen(self.command)
+        logger.info(f'Server is started (PID {self.process.pid}).')
+
+    def _ready(self, start: float) -> float:
+        try:
+            self._wait_ready(start)
+        except ServerNotReady:
+            if self.process.poll() is None:
+                self.process.kill()
+                self.process.wait()
+            raise
+
+        self.startup_time = time.perf_counter() - start
+        STARTUP.set(self.startup_time)
+        UP.set(1)
+        logger.info(f'Server is ready in {self.startup_time:.2f} s.')
+
+        return self.startup_time
+
+    def _wait_ready(self, start: float):
+        # Imported here, so the server is launched before it is imported
+        import requests
+
+        while time.perf_counter() - start < self.READY_TIMEOUT:
+            code: int | None = self.process.poll()
+            if code is not None:
+                raise ServerNotReady(f'The server exited with code {code}')
+
+            try:
+                requests.get(self.url, timeout=self.POLL_INTERVAL * 10)
+                return
+            except requests.RequestException:
+                time.sleep(self.POLL_INTERVAL)
+
+        raise ServerNotReady(
+            f'The server is not ready in {self.READY_TIMEOUT:.0f} s'
+        )
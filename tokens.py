@@ -1,34 +1,51 @@
 import json
-import logging
-from logging.handlers import TimedRotatingFileHandler
-
-logger = logging.getLogger(__name__)
-handler = TimedRotatingFileHandler(
-    filename='logs/token-access.log',
-    when='midnight'
-)
-handler.setFormatter(
-    logging.Formatter(
-        '[%(asctime)s] [%(levelname)s] "%(message)s"',
-        datefmt='%d.%m.%Y %H:%M:%S'
-    )
-)
-handler.setLevel(logging.DEBUG)
-logger.addHandler(handler)
+from threading import Lock
 
+import log
+
+logger = log.get_logger(__name__, 'token-access.log')
+
+PATH: str = 'config/tokens.json'
+
+_lock: Lock = Lock()
+_tokens: dict[str: str] | None = None
 
-def get(token_name: str):
-    logger.warning(f'Requested access: {token_name}.')
+
+def reload() -> bool:
+    """Reads the file with tokens again, the tokens are kept if it can't
+    be read.
+
+    :returns: Whether the tokens are loaded."""
+    global _tokens
 
     try:
-        with open('config/tokens.json') as f:
+        with open(PATH) as f:
             data: dict[str: str] = json.load(f)
     except FileNotFoundError:
         logger.critical('File with tokens not found!')
-        return None
+        return False
     except json.JSONDecodeError as JDE:
         logger.critical('The file is not JSON!', exc_info=JDE)
-        return None
+        return False
+
+    with _lock:
+        _tokens = data
+    logger.info(f'Loaded {len(data)} tokens.')
+
+    return True
+
+
+def get(token_name: str):
+    """:returns: The token, the file is read on the first call only (see
+        :func:`reload`)."""
+    logger.info(f'Requested access: {token_name}.')
+
+    with _lock:
+        data: dict[str: str] | None = _tokens
+    if data is None:
+        if not reload():
+            return None
+        data = _tokens
 
     if token_name not in data:
         logger.error(f'There is no such token ({token_name})!')
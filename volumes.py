@@ -0,0 +1,84 @@
+from collections import deque
+from math import ceil
+from threading import Lock
+
+import log
+
+logger = log.get_logger(__name__)
+
+# Upload limits of the Bot API server (local server has to be run with --local)
+LOCAL_SERVER_LIMIT: int = 2_000_000_000
+CLOUD_SERVER_LIMIT: int = 50_000_000
+
+MIN_VOLUME_SIZE: int = 10_000_000
+# Smaller uploads are dominated by the overhead of requests
+MIN_OBSERVED_SIZE: int = MIN_VOLUME_SIZE
+# Uploads the throughput is estimated over
+WINDOW: int = 10
+
+
+class VolumePlanner:
+    """Picks the size of archive parts.
+
+    Parts are as big as the Bot API server accepts, but not bigger than
+    what can be uploaded in ``max_upload_time`` with observed throughput
+    (a request that takes longer is dropped by the client timeout).
+
+    Throughput is the total size of the last uploads over their total
+    time, uploads smaller than ``MIN_OBSERVED_SIZE`` aren't counted."""
+
+    def __init__(self, local_server: bool = True,
+                 max_upload_time: float = 240.0,
+                 volume_size: int | None = None):
+        self._lock: Lock = Lock()
+        self._throughput: float | None = None
+        # Sizes and seconds of the last uploads
+        self._uploads: deque[tuple[int, float]] = deque(maxlen=WINDOW)
+
+        self.LIMIT: int = LOCAL_SERVER_LIMIT if local_server else CLOUD_SERVER_LIMIT
+        if volume_size:
+            self.LIMIT = min(self.LIMIT, int(volume_size))
+        self.MAX_UPLOAD_TIME: float = float(max_upload_time)
+
+    @property
+    def throughput(self) -> float | None:
+        """:returns: Observed upload throughput (bytes per second)."""
+        return self._throughput
+
+    def observe(self, size: int, seconds: float) -> None:
+        """Adds an upload measurement."""
+        if size < MIN_OBSERVED_SIZE or seconds <= 0:
+            return
+
+        with self._lock:
+            self._uploads.append((size, seconds))
+            self._throughput = (
+                sum(size for size, _ in self._uploads)
+                / sum(seconds for _, seconds in self._uploads)
+            )
+
+        logger.debug(f'Upload throughput: {self._throughput / 1e6:.2f} MB/s.')
+
+    def max_volume_size(self) -> int:
+        if self._throughput is None:
+            return self.LIMIT
+
+        return max(
+            MIN_VOLUME_SIZE,
+            min(self.LIMIT, int(self._throughput * self.MAX_UPLOAD_TIME))
+        )
+
+    def parts(self, size: int) -> int:
+        """:returns: Number of parts an archive of ``size`` bytes is split into."""
+        return max(1, ceil(size / self.max_volume_size()))
+
+    def volume_size(self, size: int) -> int:
+        """:returns: Part size for an archive of ``size`` bytes.
+
+        Parts are balanced, so the last one is not just a small leftover."""
+        return ceil(size / self.parts(size))
+
+    def is_split(self, file_size: int) -> bool:
+        """:returns: Whether an archive with the file will be split."""
+        # Deflate may slightly grow incompressible data
+        return self.parts(ceil(file_size * 1.001) + 1024) > 1
@@ -0,0 +1,149 @@
+import time
+from sqlite3 import connect, Connection, Error
+from threading import Event, Thread
+from typing import Callable
+
+from requests import RequestException
+
+import log
+import metrics
+from cache import Cache, cache_key
+from jobs import Job, JobQueue
+from yadisk_api import YDResource
+
+logger = log.get_logger(__name__)
+
+# Downloads of this period are ranked, seconds
+WINDOW: int = 7 * 86400
+MIN_REQUESTS: int = 2
+
+RANK: str = """
+    SELECT PublicKey, Path, IsDir, MAX(Size), COUNT(*) AS Requests
+    FROM Statistics
+    WHERE StartTime > ? AND IsDir IS NOT NULL
+    GROUP BY PublicKey, Path, IsDir
+    HAVING Requests >= ?
+    ORDER BY Requests DESC
+    LIMIT ?
+"""
+
+WARMING: metrics.Counter = metrics.counter(
+    'cache_warming_total', 'Cache entries of popular resources checked.',
+    ('result',)
+)
+
+
+class CacheWarmer:
+    """Keeps cache entries of popular resources valid, so users get them
+    without downloading.
+
+    Every ``interval`` seconds, resources downloaded most often are
+    checked, and outdated or missing entries are refreshed by jobs, which
+    send the files to ``chat_id``. A job is only put in the queue when a
+    worker is free and no job is queued, one at a time, and it is cancelled
+    as soon as users' jobs wait for a worker."""
+
+    def __init__(self, requests: JobQueue, cache: Cache, db_path: str,
+                 chat_id: int, free: Callable[[], int],
+                 interval: float = 600.0, top: int = 20):
+        """:param free: Returns the number of free workers."""
+        self.requests: JobQueue = requests
+        self.cache: Cache = cache
+        self.db_path: str = db_path
+        self.CHAT_ID: int = int(chat_id)
+        self.free: Callable[[], int] = free
+        self.INTERVAL: float = float(interval)
+        self.TOP: int = int(top)
+
+        # Keys of refreshed entries, which no user has got yet
+        self.warmed: set[str] = set()
+        self._stop: Event = Event()
+        self._thread: Thread = Thread(
+            target=self._warm, name='CacheWarmer', daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def hit(self, key: str) -> bool:
+        """:returns: The entry was refreshed for this hit (the first one)."""
+        try:
+            self.warmed.remove(key)
+        except KeyError:
+            return False
+
+        return True
+
+    def idle(self) -> bool:
+        return self.free() > 0 and not self.requests.qsize()
+
+    def popular(self) -> list[tuple[str, str, bool, int]]:
+        """:returns: Public keys, paths, whether they are folders and sizes
+            of resources downloaded most often."""
+        try:
+            con: Connection = connect(self.db_path)
+            try:
+                return [
+                    (public_key, path, bool(is_dir), size or 0)
+                    for public_key, path, is_dir, size, _ in con.execute(
+                        RANK, (time.time() - WINDOW, MIN_REQUESTS, self.TOP)
+                    )
+                ]
+            finally:
+                con.close()
+        except Error as e:
+            logger.error(f'Popular resources are not ranked: {e}')
+            return []
+
+    def _warm(self):
+        while not self._stop.wait(self.INTERVAL):
+            for public_key, path, is_dir, size in self.popular():
+                if not self._wait_idle():
+                    return
+                try:
+                    self._refresh(public_key, path, is_dir, size)
+                except RequestException as e:
+                    WARMING.inc('failed')
+                    logger.warning(f'{path} ({public_key}) is not checked: {e}')
+
+    def _wait_idle(self) -> bool:
+        """:returns: Workers are idle, ``False`` if the warmer is stopped."""
+        while not self.idle():
+            if self._stop.wait(1):
+                return False
+
+        return True
+
+    def _refresh(self, public_key: str, path: str, is_dir: bool, size: int):
+        key: str = cache_key(public_key, path)
+        entry: dict = self.cache[key]
+        # The same rule as in workers: a touched file with the same hash is
+        # still valid
+        modified, hashes = YDResource(public_key).get_file(path)
+        if self.cache.is_fresh(key, modified, hashes):
+            WARMING.inc('valid')
+            return
+
+        job: Job = Job(self.CHAT_ID, public_key, path, size, is_dir)
+        job.warm = True
+        logger.info(f'{job} refreshes the cache.')
+        self.requests.put(job)
+
+        while job.id in self.requests.registry.jobs:
+            if self.requests.qsize() and not self.free():
+                # Users' jobs are not delayed
+                self.requests.cancel(job.id, job.user_id)
+            if self._stop.wait(0.2):
+                return
+
+        if job.cancelled is not None:
+            WARMING.inc('preempted')
+        elif self.cache[key] and self.cache[key] != entry:
+            WARMING.inc('refreshed')
+            self.warmed.add(key)
+        else:
+            WARMING.inc('failed')
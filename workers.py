@@ -1,266 +1,1080 @@
-import logging
+import json
 import os
 import queue
-from hashlib import md5
+import random
+import shutil
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed, wait
+from hashlib import md5, sha256
+from io import BytesIO
 import time
 
-from requests import HTTPError
-from logging.handlers import TimedRotatingFileHandler
-from sqlite3 import connect, Connection, Cursor
-from threading import Thread, Event, Lock
-from zipfile import ZipFile, ZIP_DEFLATED
-
-from bot import YDBot
-from cache import Cache
-from tokens import get
+from aiogram.types import InputFile
+from requests import HTTPError, RequestException, Response
+from threading import Thread, Event, Lock, current_thread
+from typing import Callable
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+
+import log
+import metrics
+from accounts import AccountPool, NoAccount, is_account_error
+from bot import ProgressReporter, YDBot, loop as bot_loop
+from breaker import (
+    CircuitBreakers, CircuitOpen, limited_key, retry_after
+)
+from cache import Cache, cache_key
+from jobs import Job, JobQueue, JobStore
+from retry import RetryScheduler, is_retryable
+from stats import StatsWriter
+from storage import MemoryBudget, StorageBudget, NotEnoughSpace
+from volumes import VolumePlanner
+from warming import CacheWarmer
 from yadisk_api import YDApi, YDResource
 
-logger = logging.getLogger(__name__)
-handler = TimedRotatingFileHandler(
-    filename='logs/workers.log',
-    when='midnight'
+logger = log.get_logger(__name__)
+
+QUEUE_WAIT: metrics.Histogram = metrics.histogram(
+    'queue_wait_seconds', 'Time jobs spend in the queue.'
 )
-handler.setFormatter(
-    logging.Formatter(
-        '[%(asctime)s] [%(levelname)s] "%(message)s"',
-        datefmt='%d.%m.%Y %H:%M:%S'
-    )
+PHASES: metrics.Histogram = metrics.histogram(
+    'job_phase_seconds', 'Time spent in job phases.', ('phase',)
+)
+JOBS: metrics.Counter = metrics.counter(
+    'jobs_total', 'Handled jobs.', ('result',)
+)
+TRANSFERRED: metrics.Counter = metrics.counter(
+    'transferred_bytes_total', 'Downloaded and uploaded bytes.',
+    ('direction',)
+)
+CACHE: metrics.Counter = metrics.counter(
+    'cache_lookups_total', 'Cache lookups.', ('result',)
 )
-handler.setLevel(logging.DEBUG)
-logger.addHandler(handler)
+SHUTDOWN: metrics.Gauge = metrics.gauge(
+    'shutdown_seconds', 'Time the last shutdown of workers took.'
+)
+VERIFIED: metrics.Counter = metrics.counter(
+    'downloads_verified_total',
+    'Downloads checked against hashes of Yandex Disk.', ('result',)
+)
+CANCEL: metrics.Histogram = metrics.histogram(
+    'cancel_seconds',
+    'Time from cancelling a job until its resources are released.'
+)
+
+
+class Interrupted(Exception):
+    """The job is stopped by shutdown and saved to be resumed."""
+
+
+class Cancelled(Exception):
+    """The job is cancelled by the user, its files are removed."""
 
-bot: YDBot = YDBot(get('tg_token'))
+
+class Corrupted(Exception):
+    """The downloaded file doesn't match its hash even after downloading
+    it again."""
+
+
+# Hashes checked, the first one Yandex Disk gives is used (it is faster)
+HASHES: dict[str: Callable] = {"sha256": sha256, "md5": md5}
 
 
 class Workers:
-    def __init__(self, workers: int, download_requests: queue.Queue,
-                 token: str, volume_size: int, buffer_size: int, db_path: str):
+    def __init__(self, workers: int, download_requests: JobQueue,
+                 token: str | list[str], volumes: VolumePlanner,
+                 bot: YDBot, buffer_size: int,
+                 db_path: str, folder_size_limit: int = 10_000_000_000,
+                 folder_threads: int = 4, temp_budget: int = None,
+                 temp_keep_free: int = 1_000_000_000,
+                 admission_timeout: float = 60.0, job_delay: float = 5.0,
+                 retry_base_delay: float = 10.0,
+                 retry_max_delay: float = 600.0, max_attempts: int = 5,
+                 breaker_cool_down: float = 600.0,
+                 breaker_max_cool_down: float = 86400.0,
+                 job_store: str = 'data/jobs.json',
+                 drain_timeout: float = 5.0, abort_timeout: float = 3.0,
+                 progress_delay: float = 10.0,
+                 progress_interval: float = 5.0,
+                 warm_chat_id: int = None, warm_interval: float = 600.0,
+                 warm_top: int = 20, memory_threshold: int = 1 << 20,
+                 memory_budget: int = 64 << 20):
         self._stop: Event = Event()
+        self._abort: Event = Event()
+        self._interrupted: list[Job] = []
         self._file_lock: Lock = Lock()
         self.workers: list[Thread] = []
         self.cache: Cache = Cache(self._file_lock)
 
-        self.VOL_SIZE: int = int(volume_size)
+        self.volumes: VolumePlanner = volumes
+        # Messages and files are sent by the bot, which polls updates
+        self.bot: YDBot = bot
         self.BUF_SIZE: int = int(buffer_size)
+        self.FOLDER_SIZE_LIMIT: int = int(folder_size_limit)
+        self.FOLDER_THREADS: int = int(folder_threads)
         self.PATH: str = f'temp{os.sep}'
-
-        connection: Connection = connect(db_path)
-        connection.cursor().execute(
-            """
-            CREATE TABLE IF NOT EXISTS Statistics(
-                ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                PublicKey TEXT,
-                Path TEXT,
-                Size INT,
-                StartTime INT,
-                EndTime INT
-            )
-            """
+        self.ADMISSION_TIMEOUT: float = float(admission_timeout)
+        self.JOB_DELAY: float = float(job_delay)
+        self.DRAIN_TIMEOUT: float = float(drain_timeout)
+        self.ABORT_TIMEOUT: float = float(abort_timeout)
+
+        self.requests: JobQueue = download_requests
+        self.requests.on_cancel = self._cancelled
+        self.store: JobStore = JobStore(job_store)
+        restored: list[Job] = self.store.load()
+        for job in restored:
+            self.requests.put(job)
+
+        self.storage: StorageBudget = StorageBudget(
+            self.PATH, temp_budget, temp_keep_free
         )
+        # Smaller files skip the disk if their footprint fits in memory
+        self.MEMORY_THRESHOLD: int = int(memory_threshold)
+        self.memory: MemoryBudget = MemoryBudget(memory_budget)
+        # Partial downloads of restored jobs are resumed
+        self.storage.sweep(keep={job.id for job in restored})
 
-        connection.close()
+        self.stats: StatsWriter = StatsWriter(db_path)
+        self.current: dict[str: Job | None] = {}
 
         for i in range(workers):
             self.workers.append(
                 Thread(
                     target=self.worker,
-                    args=(db_path,),
-                    name=f'Worker-{i+1:0>2}'
+                    name=f'Worker-{i+1:0>2}',
+                    # Workers stuck after the abort don't block the exit
+                    daemon=True
                 )
             )
+        self.requests.registry.workers = [w.name for w in self.workers]
+        self.progress: ProgressReporter = ProgressReporter(
+            bot.bot, bot_loop, self.requests.registry,
+            delay=progress_delay, chat_interval=progress_interval
+        )
 
-        self.yd_api: YDApi = YDApi(token)
-        self.requests: queue.Queue = download_requests
+        # Files of refreshed cache entries are sent to the chat
+        self.warmer: CacheWarmer | None = None
+        if warm_chat_id is not None:
+            self.warmer = CacheWarmer(
+                self.requests, self.cache, db_path, warm_chat_id,
+                lambda: sum(job is None for job in self.current.values()),
+                warm_interval, warm_top
+            )
+
+        self.retries: RetryScheduler = RetryScheduler(
+            self.requests.redeliver, retry_base_delay, retry_max_delay,
+            max_attempts
+        )
+        self.breakers: CircuitBreakers = CircuitBreakers(
+            breaker_cool_down, breaker_max_cool_down
+        )
+        self.accounts: AccountPool = AccountPool(
+            [token] if isinstance(token, str) else token, self.breakers
+        )
+
+        metrics.gauge(
+            'queue_size', 'Jobs in the queue.',
+            function=self.requests.qsize
+        )
+        metrics.gauge(
+            'retries_pending', 'Jobs waiting for a retry.',
+            function=self.retries.pending
+        )
+        metrics.gauge(
+            'worker_state', 'Phase of the job handled by the worker.',
+            ('worker', 'state'),
+            function=lambda: {
+                (name, job.state if job else 'idle'): 1
+                for name, job in self.current.items()
+            }
+        )
+        metrics.gauge(
+            'temp_reserved_bytes', 'Disk space reserved by tasks.',
+            function=lambda: self.storage.reserved
+        )
+        metrics.gauge(
+            'temp_reservations', 'Disk space reservations.',
+            function=lambda: len(self.storage.reservations)
+        )
+        metrics.gauge(
+            'temp_capacity_bytes', 'Disk space budget of tasks.',
+            function=lambda: self.storage.CAPACITY
+        )
+        metrics.gauge(
+            'memory_reserved_bytes', 'Memory reserved by small files.',
+            function=lambda: self.memory.reserved
+        )
+        metrics.gauge(
+            'temp_used_bytes', 'Disk space used in the working directory.',
+            function=self.storage.used
+        )
 
     def start(self):
+        self.stats.start()
+        self.progress.start()
+        self.retries.start()
+
         for w in self.workers:
             w.start()
-
-    def stop(self):
+        if self.warmer is not None:
+            self.warmer.start()
+
+    def stop(self) -> float:
+        """Lets workers finish their jobs for ``drain_timeout`` seconds,
+        then interrupts them. Unfinished jobs are saved to be resumed on
+        the next start.
+
+        :returns: Time the shutdown took, seconds."""
+        start: float = time.monotonic()
+        if self.warmer is not None:
+            self.warmer.stop()
         self._stop.set()
+        logger.info('Draining workers...')
+
+        self._join(start + self.DRAIN_TIMEOUT)
+        if any(w.is_alive() for w in self.workers):
+            logger.warning('Workers are not drained in time, interrupting...')
+            self._abort.set()
+            self._join(time.monotonic() + self.ABORT_TIMEOUT)
+
+        # Jobs of workers stuck even after the abort may be repeated
+        unfinished: list[Job] = self._interrupted + [
+            job for job in self.current.values() if job is not None
+        ] + self.retries.stop()
+        while True:
+            try:
+                unfinished.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+            self.requests.task_done()
+        unfinished = [
+            job for job in unfinished if job.cancelled is None and not job.warm
+        ]
+
+        self.store.save(unfinished)
+        self.stats.stop()
+        self.progress.stop()
+
+        elapsed: float = time.monotonic() - start
+        SHUTDOWN.set(elapsed)
+        logger.info(
+            f'Workers are stopped in {elapsed:.1f} s, '
+            f'{len(unfinished)} jobs are saved.'
+        )
 
-        for w in self.workers:
-            w.join()
+        return elapsed
 
-    def worker(self, db_path: str):
-        user_id: int
-        public_key: str
-        path: str
+    def _join(self, deadline: float):
+        for w in self.workers:
+            w.join(max(0.0, deadline - time.monotonic()))
+
+    def _check_cancel(self, job: Job):
+        if job.cancelled is not None:
+            raise Cancelled(f'{job} is cancelled')
+
+    def _check_abort(self, job: Job):
+        self._check_cancel(job)
+        if self._abort.is_set():
+            raise Interrupted(f'{job} is interrupted')
+
+    def _report(self, job: Job, done: int, total: int):
+        """Reports progress of compressing, splitting or uploading, which
+        are stopped here if the job is cancelled."""
+        self._check_cancel(job)
+        job.report(done, total)
+
+    def _wait_delay(self, job: Job) -> bool:
+        """Waits ``job_delay`` seconds before the job (less if it is
+        cancelled).
+
+        :returns: Workers are stopped meanwhile."""
+        deadline: float = time.monotonic() + self.JOB_DELAY
+        while job.cancelled is None:
+            remaining: float = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self._stop.wait(min(remaining, 0.5)):
+                return True
+
+        return False
+
+    def _cancelled(self, job: Job, removed: bool):
+        """Releases the job removed from the queue, a job waiting for a
+        retry is handed to a worker to be released."""
+        if removed:
+            self._discard(job)
+        else:
+            self.retries.hurry(job)
+
+    def _discard(self, job: Job):
+        """Removes files of the cancelled job."""
+        self._remove_files(job)
+
+        JOBS.inc('cancelled')
+        CANCEL.observe(time.monotonic() - job.cancelled)
+        logger.info(f'{job} is released.')
+
+    def _remove_files(self, job: Job):
+        """Removes files kept to resume the job."""
+        shutil.rmtree(f'{self.PATH}{job.id}', ignore_errors=True)
+        FolderCheckpoint(f'{self.PATH}{job.id}.json').remove()
+
+    def worker(self):
+        job: Job
         size: int
         start_time: int
 
-        con: Connection = connect(db_path)
-        cursor: Cursor = con.cursor()
+        name: str = current_thread().name
+        self.current[name] = None
 
         while not self._stop.is_set():
             try:
-                user_id, public_key, path = self.requests.get_nowait()
-                time.sleep(5)
+                job = self.requests.get(timeout=0.5)
             except queue.Empty:
                 continue
 
+            job.phases.append(
+                ('queue', job.queued, time.time() - job.queued)
+            )
+            QUEUE_WAIT.observe(time.time() - job.queued)
+            if self.JOB_DELAY and self._wait_delay(job):
+                # Saved with the rest of the queue
+                self.requests.redeliver(job)
+                break
+
+            if job.cancelled is not None:
+                # Cancelled while waiting for a retry or the delay
+                self._discard(job)
+                self.requests.registry.stop(job)
+                self.requests.task_done()
+                continue
+
+            self.current[name] = job
+            self.requests.registry.start(job, name)
+            self.progress.track(job)
+            job.state = 'running'
+            retried: bool = False
+            rescheduled: bool = False
+            interrupted: bool = False
+            log.JOB_ID.set(job.id)
+
             start_time = round(time.time())
             try:
-                size = self._handle_task(user_id, public_key, path)
+                if job.is_dir:
+                    size = self._handle_folder(job)
+                else:
+                    size = self._handle_task(job)
             except TypeError as e:
+                JOBS.inc('error')
                 logger.error(f'TypeError (probably in cache): {e}')
             except ValueError as e:
+                JOBS.inc('error')
                 logger.error(f'ValueError (probably while zipping): {e}')
 
-            except HTTPError as e:
-                logger.error(f'HTTPError: {e}')
-                time.sleep(10)
-                self.requests.task_done()
-                logger.error(f'Putting ({public_key}, {path}) back in queue...')
-                self.requests.put((user_id, public_key, path))
+            except NotEnoughSpace as e:
+                JOBS.inc('rescheduled')
+                logger.warning(f'{job} is rescheduled: {e}')
+                job.queued = time.time()
+                self.requests.put(job)
+                rescheduled = True
+                continue
+
+            except CircuitOpen as e:
+                self._park(job, e.key, e.wait)
+                retried = True
                 continue
 
+            except Interrupted as e:
+                interrupted = True
+                JOBS.inc('interrupted')
+                logger.warning(f'{e}, it is saved to be resumed.')
+                self._interrupted.append(job)
+
+            except Cancelled as e:
+                logger.info(f'{e}.')
+                self._discard(job)
+
+            except Corrupted as e:
+                logger.error(f'{job} is not downloaded: {e}')
+                if self.retries.retry(job, e) is not None:
+                    JOBS.inc('retried')
+                    retried = True
+                    continue
+
+                JOBS.inc('failed')
+                self.bot.send_message(
+                    job.user_id,
+                    f'Can\'t download "{job.name}": it is damaged on the way '
+                    'from Yandex Disk, please try again later.'
+                )
+
+            except NoAccount as e:
+                logger.error(f'{job} can\'t be started: {e}')
+                if self.retries.retry(job, e) is not None:
+                    JOBS.inc('retried')
+                    retried = True
+                    continue
+
+                JOBS.inc('failed')
+                self.bot.send_message(
+                    job.user_id,
+                    f'Can\'t download "{job.name}" now, please try again later.'
+                )
+
+            except RequestException as e:
+                logger.error(f'{type(e).__name__} in {job}: {e}')
+                key: str | None = limited_key(
+                    e, job.public_key, getattr(e, 'account', 'anonymous')
+                )
+                if key is not None:
+                    self._park(job, key, self.breakers.trip(key, retry_after(e)))
+                    retried = True
+                    continue
+                if is_account_error(e):
+                    # Another account is taken
+                    self.retries.schedule(job, 0)
+                    retried = True
+                    continue
+
+                if self.retries.retry(job, e) is not None:
+                    JOBS.inc('retried')
+                    # The job is unfinished until it is retried
+                    retried = True
+                    continue
+
+                JOBS.inc('failed')
+                self.bot.send_message(
+                    job.user_id,
+                    f'Can\'t download "{job.name}": '
+                    + ('Yandex Disk is not available now, please try '
+                       'again later.' if is_retryable(e) else
+                       'it is not available (the link may be closed or the '
+                       'file deleted).')
+                )
+
             except Exception as e:
+                JOBS.inc('error')
                 logger.critical(
                     'Unexpected error!',
                     exc_info=e
                 )
-                bot.send_message(
-                    user_id,
+                self.bot.send_message(
+                    job.user_id,
                     'Some unexpected error has occurred... '
                     'Please provide us with more info via /feedback.'
                 )
 
             else:
-                cursor.execute(
-                    f"""
-                    INSERT INTO Statistics(
-                        PublicKey, Path, Size,
-                        StartTime, EndTime
+                JOBS.inc('done')
+                self.requests.registry.observe(job)
+                self.breakers.success(job.id)
+                if not job.warm:
+                    # Refreshes don't make resources more popular
+                    self.stats.add_job(
+                        job.id, job.public_key, job.path, job.is_dir, size,
+                        start_time, round(time.time())
                     )
-                    VALUES (
-                        '{public_key}', '{path}', {size},
-                        {start_time}, {round(time.time())}
-                    )
-                    """
-                )
-                with self._file_lock:
-                    con.commit()
 
             finally:
-                self.requests.task_done()
+                if not (retried or rescheduled or interrupted):
+                    # Files kept for retries, when the job fails
+                    self._remove_files(job)
+                for phase, _, duration in job.phases:
+                    PHASES.observe(duration, phase)
+                self.stats.add_phases(job.id, job.phases)
+                job.phases = []
+                job.state = 'queued'
+                self.current[name] = None
+                self.requests.registry.stop(
+                    job, finished=not (retried or rescheduled)
+                )
+                self.progress.finish(job)
+                log.JOB_ID.set(None)
+                if not retried:
+                    self.requests.task_done()
 
-    def _handle_task(self, user_id: int, public_key: str, path: str) -> int:
+    def _handle_task(self, job: Job) -> int:
         size: int
-        hash_key: str = md5(
-            (public_key + path).encode(errors='replace'),
-            usedforsecurity=False
-        ).hexdigest()
+        user_id, public_key, path = job.user_id, job.public_key, job.path
+        hash_key: str = job.key
 
         if self._check_hash(path, public_key):
             logger.info(f'File {path} ({public_key}) is cached.')
-            self._send_files(user_id, self.cache[hash_key]["files"])
+            with job.phase('cache hit'):
+                self._send_files(user_id, self.cache[hash_key]["files"])
             return 0
 
-        name, link = self._save_file(public_key, path)
-        download_path: str = self._download_file(name, link)
+        self.breakers.check(job.id, f'public:{job.public_key}')
+        modified, hashes = YDResource(public_key).get_file(path)
+        checksum: str | None = _checksum(hashes)
 
-        with self._file_lock:
-            size = os.path.getsize(download_path)
-            files: list[str, ...] = split_file(
-                zip_file(download_path),
-                self.VOL_SIZE,
-                self.BUF_SIZE
-            )
+        if 0 < job.size <= self.MEMORY_THRESHOLD:
+            try:
+                # The file and its archive, the disk is used if they don't fit
+                with self.memory.reserve(job.id, 2 * job.size, timeout=0):
+                    size, files = self._handle_in_memory(job, checksum)
+            except NotEnoughSpace:
+                logger.debug(f'{job} doesn\'t fit in memory.')
+            else:
+                self.cache[hash_key] = {
+                    "time": modified,
+                    "files": files,
+                    "checksum": checksum
+                }
+                return size
+
+        # File and its archive, then archive and its parts
+        footprint: int = 2 * job.size + self.BUF_SIZE
+        if not self.storage.fits(footprint):
+            return self._reject_size(job, footprint)
+
+        # Names are unique, so jobs for equally named files don't collide
+        staging: str = f'{self.PATH}{job.id}'
+        if job.modified is not None and job.modified != modified:
+            # The file was changed since the job was interrupted
+            shutil.rmtree(staging, ignore_errors=True)
+        job.modified = modified
+        os.makedirs(staging, exist_ok=True)
+
+        interrupted: bool = False
+        try:
+            with self.storage.reserve(
+                    job.id, footprint, self.ADMISSION_TIMEOUT
+            ):
+                with self.accounts.acquire(job.id, job.size) as account:
+                    name, link = self._save_file(
+                        job, account.api, path, f'{job.id}-{job.name}'
+                    )
+                    with job.phase('download'):
+                        download_path: str = self._download_file(
+                            job, account.api, name, link,
+                            f'{staging}/{job.name}', resume=True,
+                            checksum=checksum, size=job.size
+                        )
+
+                self._check_abort(job)
+                size = os.path.getsize(download_path)
+                with job.phase('compress'):
+                    archive: str = zip_file(
+                        download_path,
+                        progress=lambda read: self._report(job, read, size)
+                    )
+                archive_size: int = os.path.getsize(archive)
+                with job.phase('split'):
+                    files: list[str, ...] = split_file(
+                        archive,
+                        self.volumes.volume_size(archive_size),
+                        self.BUF_SIZE,
+                        progress=lambda written: self._report(
+                            job, written, archive_size
+                        )
+                    )
 
-        files: list[str] = self._send_files(user_id, files)
+                self._check_abort(job)
+                with job.phase('upload'):
+                    files: list[str] = self._send_files(user_id, files, job)
+        except Interrupted:
+            # The downloaded part is kept to be resumed
+            interrupted = True
+            raise
+        finally:
+            if not interrupted:
+                shutil.rmtree(staging, ignore_errors=True)
 
         self.cache[hash_key] = {
-            "time": YDResource(public_key).get_modified(path),
-            "files": files
+            "time": modified,
+            "files": files,
+            "checksum": checksum
         }
 
         return size
 
-    def _save_file(self, public_key: str, path: str) -> tuple[str, str]:
+    def _handle_in_memory(self, job: Job,
+                          checksum: str = None) -> tuple[int, list[str]]:
+        """Downloads, zips and uploads a small file without writing it to
+        the disk.
+
+        :returns: Size of the file and sent file IDs."""
+        with self.accounts.acquire(job.id, job.size) as account:
+            name, link = self._save_file(
+                job, account.api, job.path, f'{job.id}-{job.name}'
+            )
+            with job.phase('download'):
+                data: bytes = self._download_buffer(
+                    job, account.api, name, link, checksum
+                )
+
+        self._check_abort(job)
+        with job.phase('compress'):
+            archive: bytes = zip_buffer(data, job.name)
+
+        self._check_abort(job)
+        with job.phase('upload'):
+            files: list[str] = self._send_files(
+                job.user_id,
+                [InputFile(BytesIO(archive), f'{job.name}.zip')],
+                job,
+                # Small archives in memory would skew the throughput of
+                # volumes on disk
+                observe=False
+            )
+
+        return len(data), files
+
+    def _park(self, job: Job, key: str, delay: float):
+        """Delays the job until the circuit breaker may be closed and tells
+        the user when the job is going to start."""
+        # Parked jobs don't come back all at once
+        delay *= 1 + 0.1 * random.random()
+        JOBS.inc('parked')
+        logger.info(f'{job} is parked for {delay:.0f} s: {key} is limited.')
+        self.retries.schedule(job, delay)
+
+        eta: float = time.time() + delay
+        if job.eta is not None and eta < job.eta + 60:
+            return
+        job.eta = eta
+
+        reason: str = (
+            'The download limit of this link is reached'
+            if key.startswith('public:') else
+            'Yandex Disk limits our downloads now'
+        )
+        self.bot.send_message(
+            job.user_id,
+            f'{reason}, "{job.name}" will be downloaded in about '
+            f'{max(1, round(delay / 60))} min.'
+        )
+
+    def _handle_folder(self, job: Job) -> int:
+        """Downloads files of the folder into one split archive.
+
+        Downloaded files are kept between attempts, so an interrupted
+        job is resumed when it is put in the queue again."""
+        if self._check_hash(job.path, job.public_key):
+            logger.info(f'Folder {job.path} ({job.public_key}) is cached.')
+            with job.phase('cache hit'):
+                self._send_files(job.user_id, self.cache[job.key]["files"])
+            return 0
+
+        self.breakers.check(job.id, f'public:{job.public_key}')
+        resource: YDResource = YDResource(job.public_key)
+        modified: int = resource.get_modified(job.path)
+        files: list[tuple[str, int, dict[str: str]]] = list(
+            resource.walk(job.path)
+        )
+        size: int = sum(file_size for _, file_size, _ in files)
+        job.size = size
+
+        if not files:
+            self.bot.send_message(job.user_id, 'The folder is empty.')
+            return 0
+        if size > self.FOLDER_SIZE_LIMIT:
+            logger.info(f'Folder {job} is too big ({size} B).')
+            self.bot.send_message(
+                job.user_id,
+                'Sorry, but currently we can\'t download folders bigger than '
+                f'{self.FOLDER_SIZE_LIMIT / 1e9:.0f} GB.'
+            )
+            return 0
+
+        # Staged files are removed while being zipped into parts
+        footprint: int = size + max(
+            file_size for _, file_size, _ in files
+        ) + self.BUF_SIZE
+        if not self.storage.fits(footprint):
+            return self._reject_size(job, footprint)
+
+        with self.storage.reserve(job.id, footprint, self.ADMISSION_TIMEOUT):
+            file_ids: list[str] = self._download_folder(
+                job, resource, files, size
+            )
+
+        self.cache[job.key] = {
+            "time": modified,
+            "files": file_ids
+        }
+
+        return size
+
+    def _download_folder(self, job: Job, resource: YDResource,
+                         files: list[tuple[str, int, dict[str: str]]],
+                         size: int) -> list[str]:
+        """:returns: Sent file IDs."""
+        # Kept with the checkpoint until the job is done
+        directory: str = f'{self.PATH}{job.id}'
+        staging: str = f'{directory}/files'
+        checkpoint: FolderCheckpoint = FolderCheckpoint(f'{directory}.json')
+
+        pending: list[tuple[int, str, int, dict[str: str]]] = [
+            (i, file, file_size, hashes)
+            for i, (file, file_size, hashes) in enumerate(files)
+            if not checkpoint.is_done(
+                file, _staging_path(staging, job.path, file)
+            )
+        ]
+        logger.info(
+            f'Downloading {len(pending)} of {len(files)} files of {job}...'
+        )
+        job.done = size - sum(file_size for _, _, file_size, _ in pending)
+
+        with ThreadPoolExecutor(self.FOLDER_THREADS) as pool:
+            futures: dict[Future, str] = {
+                pool.submit(
+                    self._fetch_file, job, file, file_size,
+                    f'{job.id}-{i}-{file.split("/")[-1]}',
+                    _staging_path(staging, job.path, file), _checksum(hashes)
+                ): file
+                for i, file, file_size, hashes in pending
+            }
+
+            try:
+                for future in as_completed(futures):
+                    future.result()
+                    checkpoint.add(futures[future])
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                # Files downloaded meanwhile aren't downloaded again
+                wait(futures)
+                for future, file in futures.items():
+                    if not future.cancelled() and future.exception() is None \
+                            and file not in checkpoint.done:
+                        checkpoint.add(file)
+                raise
+
+        self._check_abort(job)
+        name: str = resource.name if job.path == '/' else job.name
+        with job.phase('compress'):
+            volumes: list[str] = zip_folder(
+                staging,
+                f'{directory}/{name}.zip',
+                self.volumes.volume_size(size + 1024 * len(files)),
+                self.BUF_SIZE,
+                progress=lambda read: self._report(job, read, size)
+            )
+        checkpoint.remove()
+
+        try:
+            with job.phase('upload'):
+                return self._send_files(job.user_id, volumes, job)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _reject_size(self, job: Job, footprint: int) -> int:
+        logger.error(
+            f'{job} needs {footprint} B, '
+            f'but the budget is {self.storage.CAPACITY} B.'
+        )
+        self.bot.send_message(
+            job.user_id,
+            'Sorry, but there is not enough disk space to download it.'
+        )
+
+        return 0
+
+    def _fetch_file(self, job: Job, path: str, size: int, name: str,
+                    download_path: str, checksum: str = None) -> str:
+        """Downloads one file of a folder job.
+
+        :param checksum: Hash of the file from the listing of the folder."""
+        os.makedirs(os.path.dirname(download_path), exist_ok=True)
+
+        with log.job(job.id), self.accounts.acquire(job.id, size) as account:
+            name, link = self._save_file(job, account.api, path, name)
+            with job.phase('download'):
+                return self._download_file(
+                    job, account.api, name, link, download_path, resume=True,
+                    checksum=checksum, size=size
+                )
+
+    def _save_file(self, job: Job, api: YDApi, path: str,
+                   name: str = None) -> tuple[str, str]:
         """:return: Name and link."""
 
-        logger.debug(f'Started saving {path} ({public_key})...')
-        name: str = self.yd_api.save(public_key, path)
-        logger.info(f'Saved {path} ({public_key}).')
+        logger.debug(f'Started saving {path} ({job.public_key})...')
+        with job.phase('save'):
+            name, operation = api.save(job.public_key, path, name)
+        if operation is not None:
+            with job.phase('operation poll'):
+                api.wait_operation(operation)
+        logger.info(f'Saved {path} ({job.public_key}).')
 
-        link: str = self.yd_api.get_download_link(name)
+        with job.phase('link'):
+            link: str = api.get_download_link(name)
         logger.debug(f'Got the download link ({link}).')
 
         return name, link
 
-    def _download_file(self, name: str, link: str) -> str:
+    def _download_file(self, job: Job, api: YDApi, name: str, link: str,
+                       download_path: str = None, resume: bool = False,
+                       checksum: str = None, size: int = None) -> str:
         """Downloads file and deletes it from YD.
 
-        :returns: Path to downloaded file."""
+        Downloaded bytes are added to ``job.done``.
+
+        :param resume: Continue the file left by an interrupted job.
+        :param size: Size of the file, a complete file left by an
+            interrupted job isn't requested again.
+        :param checksum: Hash of the file (``algorithm:hex``) to check it
+            while it is downloaded (see :meth:`_verify`).
+        :returns: Path to downloaded file.
+        :raises Interrupted: Workers are stopped, the part is kept.
+        :raises Cancelled: The job is cancelled.
+        :raises Corrupted: The file doesn't match the checksum."""
 
-        download_path: str = f'{self.PATH}{name}'
+        if download_path is None:
+            download_path = f'{self.PATH}{name}'
 
+        offset: int = 0
         if os.path.exists(download_path):
-            logger.warning(f'File "{download_path}" already exists!')
-            open(download_path, 'w').close()
+            if resume:
+                offset = os.path.getsize(download_path)
+            else:
+                logger.warning(f'File "{download_path}" already exists!')
 
-        logger.debug(f'Started downloading from {link}...')
-        for chunk in self.yd_api.download(link, self.BUF_SIZE):
-            with self._file_lock:
-                with open(download_path, 'ab') as file:
+        logger.debug(f'Started downloading from {link} (offset {offset})...')
+        try:
+            if checksum is None:
+                self._stream(
+                    job, api, link, download_path, offset, total=size
+                )
+                VERIFIED.inc('unverified')
+            else:
+                algorithm, expected = checksum.split(':')
+                downloaded, digest = self._stream(
+                    job, api, link, download_path, offset, HASHES[algorithm](),
+                    total=size
+                )
+                self._verify(job, api, link, download_path, downloaded,
+                             digest, expected, size)
+            logger.info(f'Downloaded {name} from {link}.')
+        finally:
+            # The link of a resumed job is a new copy. A failed deletion
+            # doesn't replace the error of the download
+            try:
+                api.delete(f'/Загрузки/{name}')
+                logger.debug('Deleted.')
+            except RequestException as e:
+                logger.warning(f'Can\'t delete {name} from YD: {e}')
+
+        return download_path
+
+    def _stream(self, job: Job, api: YDApi, link: str, download_path: str,
+                offset: int = 0, digest=None, hashed: int = 0,
+                total: int = None) -> tuple:
+        """Downloads the file from the offset, bytes are hashed as they
+        arrive.
+
+        :param digest: Hash of the first ``hashed`` bytes of the file, the
+            rest of the file is added to it.
+        :param total: Size of the file, it isn't requested if the offset
+            is there already.
+        :returns: Size of the file and its hash."""
+        self._check_abort(job)
+        r: Response | None = None
+        if not offset or total is None or offset < total:
+            try:
+                r = api.download(link, offset)
+            except HTTPError as e:
+                # The range starts after the end of a complete file
+                if not offset or e.response is None or \
+                        e.response.status_code != 416:
+                    raise
+        if r is None:
+            logger.info(f'{download_path} is already downloaded.')
+        elif offset and r.status_code != 206:
+            logger.warning(f'{link} can\'t be resumed.')
+            offset = 0
+        if digest is not None:
+            if hashed > offset:
+                digest, hashed = HASHES[digest.name](), 0
+            # Only the part left by an interrupted job is read again
+            _hash_file(digest, download_path, hashed, offset)
+        job.done += offset
+
+        if r is not None:
+            with r, open(download_path, 'ab' if offset else 'wb') as file:
+                for chunk in r.iter_content(self.BUF_SIZE):
+                    self._check_abort(job)
                     file.write(chunk)
-        logger.info(f'Downloaded {name} from {link}.')
+                    if digest is not None:
+                        digest.update(chunk)
+                    # Threads of a folder may rarely miss a chunk
+                    job.done += len(chunk)
+
+        size: int = os.path.getsize(download_path)
+        TRANSFERRED.inc('download', amount=size - offset)
+
+        return size, digest
+
+    def _verify(self, job: Job, api: YDApi, link: str, download_path: str,
+                size: int, digest, expected: str, total: int = None):
+        """Downloads the rest of a short file (the range after its end), or
+        the whole file once, if its hash doesn't match.
+
+        :param total: Size of the file (of the job by default).
+        :raises Corrupted: The hash doesn't match again."""
+        if total is None:
+            total = job.size
+        if size < total:
+            VERIFIED.inc('truncated')
+            logger.warning(
+                f'{download_path} is truncated ({size} of {total} B), '
+                'downloading the rest...'
+            )
+            job.done -= size
+            size, digest = self._stream(
+                job, api, link, download_path, size, digest, size
+            )
 
-        self.yd_api.delete(f'/Загрузки/{name}')
-        logger.debug('Deleted.')
+        if digest.hexdigest() == expected:
+            VERIFIED.inc('ok')
+            return
 
-        return download_path
+        VERIFIED.inc('refetched')
+        logger.warning(
+            f'{digest.name} of {download_path} doesn\'t match, downloading '
+            'it again...'
+        )
+        job.done -= size
+        size, digest = self._stream(
+            job, api, link, download_path, 0, HASHES[digest.name]()
+        )
+        if digest.hexdigest() != expected:
+            VERIFIED.inc('corrupted')
+            raise Corrupted(
+                f'{digest.name} of {download_path} is {digest.hexdigest()}, '
+                f'not {expected}'
+            )
+        VERIFIED.inc('ok')
+
+    def _download_buffer(self, job: Job, api: YDApi, name: str, link: str,
+                         checksum: str = None) -> bytes:
+        """Downloads a small file into memory and deletes it from YD.
+
+        A file, which doesn't match the checksum, is downloaded once more
+        as a whole.
+
+        :raises Interrupted: Workers are stopped.
+        :raises Cancelled: The job is cancelled.
+        :raises Corrupted: The file doesn't match the checksum again."""
+        algorithm, expected = (
+            checksum.split(':') if checksum is not None else (None, None)
+        )
+
+        logger.debug(f'Started downloading from {link} into memory...')
+        try:
+            for attempt in range(2):
+                self._check_abort(job)
+                buffer: BytesIO = BytesIO()
+                digest = HASHES[algorithm]() if algorithm else None
+                with api.download(link) as r:
+                    r.raise_for_status()
+                    for chunk in r.iter_content(self.BUF_SIZE):
+                        self._check_abort(job)
+                        buffer.write(chunk)
+                        if digest is not None:
+                            digest.update(chunk)
+                        job.done += len(chunk)
+
+                data: bytes = buffer.getvalue()
+                TRANSFERRED.inc('download', amount=len(data))
+                if digest is None:
+                    VERIFIED.inc('unverified')
+                    break
+                if digest.hexdigest() == expected:
+                    VERIFIED.inc('ok')
+                    break
+
+                VERIFIED.inc('refetched' if not attempt else 'corrupted')
+                logger.warning(
+                    f'{algorithm} of {name} doesn\'t match '
+                    f'({len(data)} of {job.size} B).'
+                )
+                job.done -= len(data)
+            else:
+                raise Corrupted(
+                    f'{algorithm} of {name} is {digest.hexdigest()}, '
+                    f'not {expected}'
+                )
+            logger.info(f'Downloaded {name} from {link} into memory.')
+        finally:
+            # As in _download_file, the error of the download is kept
+            try:
+                api.delete(f'/Загрузки/{name}')
+                logger.debug(f'Deleted {name} from YD.')
+            except RequestException as e:
+                logger.warning(f'Can\'t delete {name} from YD: {e}')
+
+        return data
 
-    def _send_files(self, user_id: int, files: list[str, ...]) -> list[str, ...]:
+    def _send_files(self, user_id: int, files: list[str | InputFile],
+                    job: Job = None, observe: bool = True) -> list[str, ...]:
         """Sends files and deletes them from computer.
 
+        :param files: Paths, file IDs or files in memory.
+        :param job: Its upload progress is reported.
+        :param observe: Whether the upload is observed by the volume planner.
         :returns: Sent file IDs."""
 
         logger.debug(f'Sending files ({files})...')
 
-        with self._file_lock:
-            file_ids: list[str, ...] = bot.send_files(user_id, files)
+        size: int = sum(_upload_size(file) for file in files)
+        start_time: float = time.monotonic()
+        file_ids: list[str, ...] = self.bot.send_files(
+            user_id, files,
+            None if job is None else
+            lambda sent: self._report(job, sent, len(files))
+        )
+        if observe:
+            self.volumes.observe(size, time.monotonic() - start_time)
+        TRANSFERRED.inc('upload', amount=size)
 
         logger.info('Files sent.')
 
         for file in files:
-            with self._file_lock:
-                if not os.path.exists(file):
-                    logger.debug(f'File "{file}" does not exist.')
-                    continue
+            if isinstance(file, InputFile):
+                continue
+            if not os.path.exists(file):
+                logger.debug(f'File "{file}" does not exist.')
+                continue
 
-                logger.debug(f'Removing {file}...')
-                os.remove(file)
+            logger.debug(f'Removing {file}...')
+            os.remove(file)
 
         logger.debug('Files removed.')
 
         return file_ids
 
     def _check_hash(self, path: str, public_key: str) -> bool:
-        hash_key: str = md5(
-            (public_key + path).encode(errors='replace'),
-            usedforsecurity=False
-        ).hexdigest()
+        hash_key: str = cache_key(public_key, path)
 
         if not self.cache[hash_key]:
+            CACHE.inc('miss')
             logger.debug(f'File {path} ({public_key}) is not cached.')
             return False
 
         logger.debug(f'File {path} ({public_key}) is cached.')
-        if self.cache[hash_key]["time"] < YDResource(public_key).get_modified(path):
+        modified, hashes = YDResource(public_key).get_file(path)
+        if not self.cache.is_fresh(hash_key, modified, hashes):
+            CACHE.inc('outdated')
             logger.debug(f'File {path} ({public_key}) is outdated.')
             return False
 
+        # Hits, which would be misses without warming, are counted apart
+        CACHE.inc(
+            'warmed' if self.warmer is not None and self.warmer.hit(hash_key)
+            else 'hit'
+        )
         logger.debug(f'File {path} ({public_key}) is up to date.')
         return True
 
 
 def split_file(file: str,
-               volume_size: int, max_buff: int = float('inf')
-               ) -> list[str, ...]:
+               volume_size: int, max_buff: int = float('inf'),
+               progress: Callable[[int], None] = None) -> list[str, ...]:
     """Splits file and deletes it.
 
+    :param progress: Called with the number of bytes split after every part.
     :returns: List of split files names."""
     part: int = 0
 
@@ -268,7 +1082,7 @@ def split_file(file: str,
     part_name: str
 
     file_size: int = os.stat(file).st_size
-    if file_size < volume_size:
+    if file_size <= volume_size:
         return [file]
 
     name, ext = os.path.splitext(file)
@@ -287,22 +1101,230 @@ def split_file(file: str,
                             min(max_buff, volume_size - tgt.tell())
                         )
                     )
+            if progress is not None:
+                progress(src.tell())
 
     os.remove(file)
 
     return part_names
 
 
-def zip_file(file: str, name: str = None) -> str:
+def zip_file(file: str, name: str = None,
+             progress: Callable[[int], None] = None) -> str:
     """Zips file and deletes it.
 
+    :param progress: Called with the number of bytes zipped so far.
     :returns: Name of the created archive."""
     if name is None:
         name = f'{file}.zip'
 
     with ZipFile(name, 'w', ZIP_DEFLATED) as archive:
-        archive.write(file)
+        _add_file(archive, file, os.path.basename(file), 1 << 20, progress)
 
     os.remove(file)
 
     return name
+
+
+def zip_buffer(data: bytes, name: str) -> bytes:
+    """:returns: Archive with the file of the name."""
+    buffer: BytesIO = BytesIO()
+    with ZipFile(buffer, 'w', ZIP_DEFLATED) as archive:
+        archive.writestr(
+            ZipInfo(name, time.localtime()[:6]), data, ZIP_DEFLATED
+        )
+
+    return buffer.getvalue()
+
+
+def zip_folder(folder: str, name: str,
+               volume_size: int, max_buff: int = 1 << 16,
+               progress: Callable[[int], None] = None) -> list[str, ...]:
+    """Zips folder into split archive and deletes it.
+
+    Archive is written straight into parts, so it never exists on disk
+    as a whole.
+
+    :param progress: Called with the number of bytes zipped so far.
+    :returns: List of split files names."""
+    zipped: int = 0
+
+    def added(read: int):
+        if progress is not None:
+            progress(zipped + read)
+
+    with VolumeWriter(name, volume_size) as volumes:
+        with ZipFile(volumes, 'w', ZIP_DEFLATED) as archive:
+            for root, _, files in os.walk(folder):
+                for file in sorted(files):
+                    path: str = os.path.join(root, file)
+
+                    zipped += _add_file(
+                        archive, path, os.path.relpath(path, folder),
+                        max_buff, added
+                    )
+                    os.remove(path)
+
+    shutil.rmtree(folder, ignore_errors=True)
+
+    return volumes.names
+
+
+def _add_file(archive: ZipFile, path: str, arcname: str, max_buff: int,
+              progress: Callable[[int], None] = None) -> int:
+    """:returns: Size of the file."""
+    info: ZipInfo = ZipInfo.from_file(path, arcname)
+    info.compress_type = ZIP_DEFLATED
+    read: int = 0
+    reported: int = 0
+
+    # Files of folders may be bigger than 2 GiB, or grow after they are
+    # listed, so ZIP64 doesn't depend on the size
+    with open(path, 'rb') as src, \
+            archive.open(info, 'w', force_zip64=True) as tgt:
+        while chunk := src.read(max_buff):
+            tgt.write(chunk)
+            read += len(chunk)
+            # Chunks may be small
+            if progress is not None and read - reported >= 1 << 20:
+                progress(read)
+                reported = read
+
+    if progress is not None:
+        progress(read)
+
+    return read
+
+
+class VolumeWriter:
+    """Write-only stream which is split into parts of volume size.
+
+    If the stream fits into one part, it is written without ".partNN"
+    suffix, like in :func:`split_file`."""
+
+    def __init__(self, name: str, volume_size: int):
+        self.name: str = name
+        self.VOL_SIZE: int = volume_size
+        self.names: list[str, ...] = []
+
+        self._position: int = 0
+        self._volume = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def tell(self) -> int:
+        return self._position
+
+    def write(self, data: bytes) -> int:
+        view: memoryview = memoryview(data)
+
+        while view:
+            if self._volume is None or self._volume.tell() >= self.VOL_SIZE:
+                self._next_volume()
+
+            written: int = self._volume.write(
+                view[:self.VOL_SIZE - self._volume.tell()]
+            )
+            view = view[written:]
+            self._position += written
+
+        return len(data)
+
+    def flush(self):
+        if self._volume is not None:
+            self._volume.flush()
+
+    def close(self):
+        if self._volume is None:
+            return
+
+        self._volume.close()
+        self._volume = None
+
+        if len(self.names) == 1:
+            os.replace(self.names[0], self.name)
+            self.names = [self.name]
+
+    def _next_volume(self):
+        if self._volume is not None:
+            self._volume.close()
+
+        self.names.append(f'{self.name}.part{len(self.names) + 1:0>2}')
+        self._volume = open(self.names[-1], 'wb')
+
+
+class FolderCheckpoint:
+    """Files of a folder job which are already downloaded."""
+
+    def __init__(self, file: str):
+        self.file: str = file
+        self.done: set[str] = set()
+
+        try:
+            with open(self.file) as f:
+                self.done = set(json.load(f))
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError as JDE:
+            logger.warning(f'Checkpoint "{self.file}" is broken: {JDE}')
+
+    def is_done(self, path: str, download_path: str) -> bool:
+        return path in self.done and os.path.exists(download_path)
+
+    def add(self, path: str):
+        self.done.add(path)
+
+        with open(self.file, 'w') as f:
+            json.dump(list(self.done), f)
+
+    def remove(self):
+        if os.path.exists(self.file):
+            os.remove(self.file)
+
+
+def _checksum(hashes: dict[str: str]) -> str | None:
+    """:returns: The hash to check (``algorithm:hex``) of hashes by
+        algorithms, ``None`` if none is known."""
+    for algorithm in HASHES:
+        if hashes.get(algorithm):
+            return f'{algorithm}:{hashes[algorithm]}'
+
+    return None
+
+
+def _upload_size(file: str | InputFile) -> int:
+    """:returns: Bytes to upload, 0 for file IDs."""
+    if isinstance(file, InputFile):
+        return file.file.getbuffer().nbytes
+
+    return os.path.getsize(file) if os.path.exists(file) else 0
+
+
+def _hash_file(digest, file: str, start: int, end: int):
+    """Adds bytes [start, end) of the file to the hash."""
+    if start >= end:
+        return
+
+    with open(file, 'rb') as f:
+        f.seek(start)
+        while start < end:
+            chunk: bytes = f.read(min(1 << 20, end - start))
+            if not chunk:
+                break
+            digest.update(chunk)
+            start += len(chunk)
+
+
+def _staging_path(staging: str, root: str, path: str) -> str:
+    """:returns: Local path of the file of the folder job."""
+    return os.path.join(
+        staging,
+        *(
+            part if part not in ('.', '..') else '_'
+            for part in path.removeprefix(root).strip('/').split('/')
+        )
+    )
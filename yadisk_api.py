@@ -1,32 +1,40 @@
-import logging
+import os
 import time
-from logging.handlers import TimedRotatingFileHandler
+from concurrent.futures import Future, ThreadPoolExecutor
 from math import ceil
 from threading import Lock
-from time import sleep
+from time import sleep, perf_counter
 from time import strptime, mktime
-from typing import Iterator
+from typing import Iterable, Iterator
 
 import requests
 from requests import Session, Response
 from requests.exceptions import ConnectionError
 from urllib3.exceptions import MaxRetryError
 
-URL: str = 'https://cloud-api.yandex.net/v1/disk/'
+import log
+import metrics
 
-logger = logging.getLogger(__name__)
-handler = TimedRotatingFileHandler(
-    filename='logs/api.log',
-    when='midnight'
+URL: str = os.environ.get(
+    'YADISK_API_URL', 'https://cloud-api.yandex.net/v1/disk/'
 )
-handler.setFormatter(
-    logging.Formatter(
-        '[%(asctime)s] [%(levelname)s] "%(message)s"',
-        datefmt='%d.%m.%Y %H:%M:%S'
-    )
+PAGE_LIMIT: int = 1000
+
+logger = log.get_logger(__name__, 'api.log')
+
+API_LATENCY: metrics.Histogram = metrics.histogram(
+    'api_request_seconds',
+    'Latency of Yandex Disk requests (until headers are received).',
+    ('endpoint', 'status')
+)
+METADATA: metrics.Counter = metrics.counter(
+    'metadata_lookups_total', 'Lookups of public resources in the store.',
+    ('result',)
+)
+PREFETCHES: metrics.Counter = metrics.counter(
+    'metadata_prefetches_total', 'Prefetched metadata of public resources.',
+    ('result',)
 )
-handler.setLevel(logging.DEBUG)
-logger.addHandler(handler)
 
 
 class LimitedRPPSession(Session):
@@ -38,15 +46,25 @@ class LimitedRPPSession(Session):
 
         super().__init__()
 
-    def request(self, *args, **kwargs) -> Response:
+    def request(self, method: str, url: str, *args, **kwargs) -> Response:
         with self._lock:
             sleep(self._period)
+            start: float = perf_counter()
             try:
-                resp: Response = super().request(*args, **kwargs)
+                resp: Response = super().request(method, url, *args, **kwargs)
             except (MaxRetryError, ConnectionError) as e:
+                API_LATENCY.observe(
+                    perf_counter() - start, _endpoint(method, url), 'error'
+                )
                 logger.error(str(e))
                 raise
 
+        API_LATENCY.observe(
+            perf_counter() - start,
+            _endpoint(method, url),
+            str(resp.status_code)
+        )
+
         try:
             resp.raise_for_status()
         except requests.HTTPError as e:
@@ -56,16 +74,128 @@ class LimitedRPPSession(Session):
         return resp
 
 
+class MetadataStore:
+    """Metadata of public resources shared by all users for ``ttl`` seconds.
+
+    Concurrent lookups of a resource (e.g. by a user and prefetching) make
+    one request. Prefetching has its own session, so it makes at most
+    ``prefetch_rate`` requests per second, and at most ``max_pending`` are
+    waiting."""
+
+    def __init__(self, ttl: float = 60.0, prefetch_rate: float = 10.0,
+                 max_pending: int = 20, max_entries: int = 10_000):
+        self.TTL: float = float(ttl)
+        self.MAX_PENDING: int = int(max_pending)
+        self.MAX_ENTRIES: int = int(max_entries)
+
+        self._lock: Lock = Lock()
+        # (public key, path): (expiration time, metadata)
+        self._entries: dict[tuple[str, str]: tuple[float, Future]] = {}
+        self._pending: int = 0
+        self._session: LimitedRPPSession | None = (
+            LimitedRPPSession(prefetch_rate) if prefetch_rate else None
+        )
+        self._pool: ThreadPoolExecutor = ThreadPoolExecutor(
+            2, thread_name_prefix='Prefetch'
+        )
+
+    def get(self, public_key: str, path: str, session: Session) -> dict:
+        """:param session: Session to request the metadata, if it is not
+            stored.
+        :raises requests.HTTPError:"""
+        return self._get(public_key, path, session, True)
+
+    def prefetch(self, public_key: str, path: str) -> Future | None:
+        """Requests the metadata in the background, unless it is stored.
+
+        :returns: Future to cancel the request, ``None`` if it is not made."""
+        with self._lock:
+            entry: tuple[float, Future] | None = self._entries.get(
+                (public_key, path)
+            )
+            if self._session is None or (
+                    entry is not None and entry[0] > time.monotonic()
+            ):
+                return None
+            if self._pending >= self.MAX_PENDING:
+                PREFETCHES.inc('skipped')
+                return None
+            self._pending += 1
+
+        future: Future = self._pool.submit(self._prefetch, public_key, path)
+        future.add_done_callback(self._prefetched)
+
+        return future
+
+    def _prefetch(self, public_key: str, path: str):
+        try:
+            self._get(public_key, path, self._session, False)
+        except requests.RequestException as e:
+            PREFETCHES.inc('failed')
+            logger.debug(f'{path} ({public_key}) is not prefetched: {e}')
+        else:
+            PREFETCHES.inc('done')
+
+    def _prefetched(self, future: Future):
+        # Also called for cancelled prefetches
+        with self._lock:
+            self._pending -= 1
+
+    def _get(self, public_key: str, path: str, session: Session,
+             count: bool) -> dict:
+        key: tuple[str, str] = (public_key, path)
+        now: float = time.monotonic()
+
+        with self._lock:
+            entry: tuple[float, Future] | None = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                future: Future = entry[1]
+                if count:
+                    METADATA.inc('hit' if future.done() else 'waited')
+            else:
+                if count:
+                    METADATA.inc('miss')
+                if len(self._entries) >= self.MAX_ENTRIES:
+                    self._expire(now)
+                future = Future()
+                self._entries[key] = (now + self.TTL, future)
+                entry = None
+
+        if entry is None:
+            try:
+                future.set_result(_fetch_metadata(session, public_key, path))
+            except BaseException as e:
+                # Failures are not stored
+                with self._lock:
+                    if self._entries.get(key, (0.0, None))[1] is future:
+                        del self._entries[key]
+                future.set_exception(e)
+
+        return future.result()
+
+    def _expire(self, now: float):
+        self._entries = {
+            key: entry for key, entry in self._entries.items()
+            if entry[0] > now
+        }
+        if len(self._entries) >= self.MAX_ENTRIES:
+            # The oldest half of fresh entries
+            for key in list(self._entries)[:len(self._entries) // 2]:
+                del self._entries[key]
+
+
 class YDResource:
-    def __init__(self, public_key: str):
+    def __init__(self, public_key: str, metadata: MetadataStore = None):
+        """:param metadata: Store of listings shared with other users."""
         self.session: LimitedRPPSession = LimitedRPPSession(35)
+        self.metadata: MetadataStore | None = metadata
 
         self.files: dict[str: int | dict] = {
             "/": {}
         }
         self.path: list[str] = ['/']
 
-        data: dict = self._fetch_metadata(public_key, self.cwd)
+        data: dict = self._listing(public_key, self.cwd)
         self.name: str = data["name"]
         self.public_key: str = data["public_key"]
 
@@ -89,7 +219,7 @@ class YDResource:
                 files = files[folder]
                 continue
 
-            data: dict = self._fetch_metadata(self.public_key, self.cwd)
+            data: dict = self._listing(self.public_key, self.cwd)
 
             if "_embedded" not in data:
                 files[folder][data["name"]] = data["size"]
@@ -109,11 +239,18 @@ class YDResource:
         return files
 
     def get_modified(self, path: str) -> int:
-        # TODO: Do sth with "429 DiskResourceDownloadLimitExceededError"
+        return self.get_file(path)[0]
+
+    def get_file(self, path: str) -> tuple[int, dict[str: str]]:
+        """:returns: Modification time and hashes of the file by algorithms
+            (``md5``, ``sha256``), which Yandex Disk gives."""
         try:
             data: dict = self._fetch_metadata(self.public_key, path)
-        except requests.HTTPError:
-            return ceil(time.time())
+        except requests.HTTPError as e:
+            # Limits are handled by circuit breakers of workers
+            if e.response.status_code == 429:
+                raise
+            return ceil(time.time()), {}
 
         return ceil(
             mktime(
@@ -122,7 +259,40 @@ class YDResource:
                     '%Y-%m-%dT%H:%M:%S%z'
                 )
             )
-        )
+        ), _hashes(data)
+
+    def walk(self, path: str) -> Iterator[tuple[str, int, dict[str: str]]]:
+        """Walks the subtree of the directory.
+
+        :returns: Paths, sizes and hashes (like :meth:`get_file`) of
+            files."""
+        directories: list[str] = [path]
+
+        while directories:
+            directory: str = directories.pop()
+            offset: int = 0
+
+            while True:
+                data: dict = self._fetch_metadata(
+                    self.public_key, directory, PAGE_LIMIT, offset
+                )
+
+                if "_embedded" not in data:
+                    yield directory, data["size"], _hashes(data)
+                    break
+
+                items: list[dict] = data["_embedded"]["items"]
+                for item in items:
+                    item_path: str = f'{directory.rstrip("/")}/{item["name"]}'
+                    if item["type"] == 'dir':
+                        directories.append(item_path)
+                        continue
+
+                    yield item_path, item["size"], _hashes(item)
+
+                offset += len(items)
+                if not items or offset >= data["_embedded"]["total"]:
+                    break
 
     def up(self):
         self.path.pop()
@@ -133,16 +303,32 @@ class YDResource:
         else:
             raise FileNotFoundError(f"No such directory: '{location}'")
 
-    def _fetch_metadata(self, public_key: str, path: str):
-        r = self.session.get(
-            f'{URL}public/resources',
-            params={
-                "public_key": public_key,
-                "path": path
-            }
-        )
+    def prefetch(self, folders: Iterable[str]) -> list[Future]:
+        """Requests listings of the folders in the current directory in
+        the background.
+
+        :returns: Futures to cancel the requests."""
+        if self.metadata is None:
+            return []
+
+        futures: list[Future | None] = [
+            self.metadata.prefetch(
+                self.public_key, f'{self.cwd.rstrip("/")}/{folder}'
+            )
+            for folder in folders
+        ]
+
+        return [future for future in futures if future is not None]
 
-        return r.json()
+    def _listing(self, public_key: str, path: str) -> dict:
+        if self.metadata is None:
+            return self._fetch_metadata(public_key, path)
+
+        return self.metadata.get(public_key, path, self.session)
+
+    def _fetch_metadata(self, public_key: str, path: str,
+                        limit: int = None, offset: int = None):
+        return _fetch_metadata(self.session, public_key, path, limit, offset)
 
 
 class YDApi:
@@ -155,27 +341,49 @@ class YDApi:
             }
         )
 
-    def save(self, public_key: str, path: str) -> str:
+    def save(self, public_key: str, path: str,
+             name: str = None) -> tuple[str, str | None]:
+        """Saves the resource to "Загрузки".
+
+        :param name: Name to save the resource with.
+        :returns: Name of the saved resource and link to the operation,
+            if saving is asynchronous (see :meth:`wait_operation`)."""
         r = self.session.post(
             f'{URL}public/resources/save-to-disk',
             params={
                 "public_key": public_key,
                 "path": path,
+                "name": name,
                 "force_async": False
             }
         )
 
-        link: str = r.json()["href"]
+        return (
+            name or path.split('/')[-1],
+            r.json()["href"] if r.status_code == 202 else None
+        )
+
+    def get_free_space(self) -> int:
+        r: Response = self.session.get(
+            URL,
+            params={"fields": 'total_space,used_space'}
+        )
+        data: dict = r.json()
 
-        if r.status_code == 203:
-            if self._get_operation_result(link) == 'failed':
-                logger.error(
-                    'Operation '
-                    f'{link.removeprefix("https://cloud-api.yandex.net/v1/disk/operations/")}'
-                    ' failed!'
-                )
+        return data["total_space"] - data["used_space"]
+
+    def wait_operation(self, link: str) -> str:
+        """:returns: Status of the finished operation."""
+        status: str = self._get_operation_result(link)
 
-        return path.split('/')[-1]
+        if status == 'failed':
+            logger.error(
+                'Operation '
+                f'{link.removeprefix(f"{URL}operations/")}'
+                ' failed!'
+            )
+
+        return status
 
     def _get_operation_result(self, link: str):
         r: Response = self.session.get(
@@ -199,10 +407,16 @@ class YDApi:
 
         return r.json()["href"]
 
-    def download(self, link: str, buffer: int) -> Iterator[bytes]:
-        r: Response = self.session.get(link)
+    def download(self, link: str, offset: int = 0) -> Response:
+        """Starts streaming the file.
 
-        return r.iter_content(buffer)
+        :param offset: Bytes to skip (the response status is 206 if the
+            server skipped them)."""
+        return self.session.get(
+            link,
+            headers={"Range": f'bytes={offset}-'} if offset else None,
+            stream=True
+        )
 
     def delete(self, path):
         r: Response = self.session.delete(
@@ -215,3 +429,43 @@ class YDApi:
         )
 
         return r
+
+
+def _fetch_metadata(session: Session, public_key: str, path: str,
+                    limit: int = None, offset: int = None,
+                    fields: str = None) -> dict:
+    """:param fields: Keys of the metadata to get (all by default), like
+        ``_embedded.items.name,_embedded.total``."""
+    r = session.get(
+        f'{URL}public/resources',
+        params={
+            "public_key": public_key,
+            "path": path,
+            "limit": limit,
+            "offset": offset,
+            "fields": fields
+        }
+    )
+
+    return r.json()
+
+
+def _hashes(data: dict) -> dict[str: str]:
+    """:returns: Hashes of the file by algorithms, which Yandex Disk gives
+        in its metadata and in listings."""
+    return {
+        algorithm: data[algorithm] for algorithm in ('md5', 'sha256')
+        if data.get(algorithm)
+    }
+
+
+def _endpoint(method: str, url: str) -> str:
+    """:returns: Method and API endpoint of the URL without IDs."""
+    if not url.startswith(URL):
+        return f'{method} download'
+
+    path: str = url.removeprefix(URL).split('?')[0]
+    if path.startswith('operations/'):
+        path = 'operations'
+
+    return f'{method} {path}'